@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# time and memory-profile every feature extractor across timeline sizes
+#
+# usage: python3 -m benchmarks.bench_extractors [options]
+#        python3 -m benchmarks.bench_extractors --compare OLD.json NEW.json
+
+import json
+import math
+import os
+import subprocess
+import time
+import tracemalloc
+
+# benchmark whichever feature extractors can be imported here; see
+# feature_extractors.SKIP_MISSING_ENV
+os.environ.setdefault("BOTDETECTOR_SKIP_MISSING_EXTRACTORS", "1")
+
+from benchmarks.synthetic import TimelineGenerator
+from feature_extractors import FEATURE_EXTRACTORS
+
+DEFAULT_SIZES = [10, 30, 100, 300, 1000]
+DEFAULT_REPEATS = 3
+OUTPUT_DIR = "benchmarks/results"
+
+# name -> growth function used when fitting empirical complexity curves
+COMPLEXITY_CLASSES = [
+    ("O(1)", lambda n: 1),
+    ("O(log n)", lambda n: math.log(n)),
+    ("O(n)", lambda n: n),
+    ("O(n log n)", lambda n: n * math.log(n)),
+    ("O(n^2)", lambda n: n ** 2),
+    ("O(n^3)", lambda n: n ** 3)
+]
+
+def git_commit():
+    """ Return the current git commit hash, or None outside of a repository """
+
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr = subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fit_complexity(sizes, seconds):
+    """ Fit measured run times to common complexity classes
+
+    Each class f(n) is fitted as t = c * f(n) by least squares on relative
+    error, so that the small sizes count as much as the large ones.
+
+    Args:
+        sizes: A list of timeline sizes
+        seconds: A list of run times corresponding to sizes
+
+    Returns:
+        A dictionary containing the best-fitting class, the residual of every
+        class, and the exponent of a log-log fit of the run times
+    """
+
+    points = [(n, t) for (n, t) in zip(sizes, seconds) if (t > 0)]
+    if (len(points) < 2):
+        return None
+
+    residuals = {}
+    for (name, f) in COMPLEXITY_CLASSES:
+        ratios = [t / f(n) for (n, t) in points]
+        # geometric mean minimizes the squared error of the log ratio
+        c = math.exp(sum(math.log(r) for r in ratios) / len(ratios))
+        residuals[name] = sum(
+            math.log(r / c) ** 2 for r in ratios
+        ) / len(ratios)
+
+    # log-log slope
+    xs = [math.log(n) for (n, t) in points]
+    ys = [math.log(t) for (n, t) in points]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    denominator = sum((x - x_mean) ** 2 for x in xs)
+    if (denominator == 0):
+        exponent = None
+    else:
+        exponent = sum(
+            (x - x_mean) * (y - y_mean) for (x, y) in zip(xs, ys)
+        ) / denominator
+
+    return {
+        "best": min(residuals, key = residuals.get),
+        "residuals": residuals,
+        "exponent": exponent
+    }
+
+def measure(extractor, user, tweets, repeats):
+    """ Time and memory-profile a single feature extractor
+
+    Args:
+        extractor: An initialized feature extractor
+        user: A user dictionary
+        tweets: A list of tweet dictionaries
+        repeats: The number of timed runs; the fastest is reported
+
+    Returns:
+        A dictionary of measurements
+    """
+
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = extractor.run(user, tweets)
+        timings.append(time.perf_counter() - start)
+
+    # memory is measured in a separate run because tracemalloc slows down
+    # allocation-heavy code considerably
+    tracemalloc.start()
+    extractor.run(user, tweets)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "n_tweets": len(tweets),
+        "seconds": min(timings),
+        "peak_bytes": peak,
+        "result": result if isinstance(result, (int, float)) else repr(result)
+    }
+
+def run(extractors = "all", sizes = DEFAULT_SIZES, repeats = DEFAULT_REPEATS,
+        generator = None):
+    """ Benchmark feature extractors across timeline sizes
+
+    Feature extractors that fail to initialize (e.g. because sbserver or
+    OpenTripPlanner are not available) or that raise an exception are
+    recorded with the error instead of stopping the benchmark.
+
+    Args:
+        extractors: A list of feature extractor names, or "all"
+        sizes: A list of timeline sizes to benchmark
+        repeats: The number of timed runs per size
+        generator: An optional benchmarks.synthetic.TimelineGenerator
+
+    Returns:
+        A dictionary of results that can be serialized to JSON
+    """
+
+    if (extractors == "all"):
+        extractors = sorted(FEATURE_EXTRACTORS.keys())
+    if (generator is None):
+        generator = TimelineGenerator(seed = 0)
+
+    timelines = [generator.timeline(n) for n in sizes]
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "sizes": list(sizes),
+        "repeats": repeats,
+        "generator": {
+            "url_density": generator.url_density,
+            "hashtag_density": generator.hashtag_density,
+            "mention_density": generator.mention_density,
+            "geotag_fraction": generator.geotag_fraction,
+            "duplicate_fraction": generator.duplicate_fraction,
+            "sources": generator.sources
+        },
+        "extractors": {}
+    }
+
+    for name in extractors:
+        print("Benchmarking %s" % name)
+        entry = {"runs": [], "complexity": None, "error": None}
+        results["extractors"][name] = entry
+
+        try:
+            extractor = FEATURE_EXTRACTORS[name]()
+        except (Exception, SystemExit) as error:
+            entry["error"] = "initialization failed: %r" % error
+            print("> %s" % entry["error"])
+            continue
+
+        for (user, tweets) in timelines:
+            try:
+                measurement = measure(extractor, user, tweets, repeats)
+            except Exception as error:
+                entry["error"] = "n = %d: %r" % (len(tweets), error)
+                print("> %s" % entry["error"])
+                break
+            entry["runs"].append(measurement)
+            print("> n = %-6d %10.6fs %10d bytes" % (
+                measurement["n_tweets"], measurement["seconds"],
+                measurement["peak_bytes"]
+            ))
+
+        entry["complexity"] = fit_complexity(
+            [m["n_tweets"] for m in entry["runs"]],
+            [m["seconds"] for m in entry["runs"]]
+        )
+        if (entry["complexity"]):
+            print("> best fit %s (exponent %.2f)" % (
+                entry["complexity"]["best"],
+                entry["complexity"]["exponent"] or 0
+            ))
+
+    return results
+
+def compare(old, new):
+    """ Print the change in run time and peak memory between two results
+
+    Args:
+        old, new: Dictionaries loaded from benchmark JSON files
+    """
+
+    print("%-32s %8s %12s %12s %12s" % (
+        "extractor", "n", "time ratio", "mem ratio", "complexity"
+    ))
+
+    for name in sorted(set(old["extractors"]) & set(new["extractors"])):
+        old_runs = {
+            run["n_tweets"]: run for run in old["extractors"][name]["runs"]
+        }
+        complexity = new["extractors"][name]["complexity"]
+
+        for run in new["extractors"][name]["runs"]:
+            if (run["n_tweets"] not in old_runs):
+                continue
+            old_run = old_runs[run["n_tweets"]]
+            print("%-32s %8d %12.2f %12.2f %12s" % (
+                name, run["n_tweets"],
+                run["seconds"] / max(old_run["seconds"], 1e-12),
+                run["peak_bytes"] / max(old_run["peak_bytes"], 1),
+                complexity["best"] if complexity else "-"
+            ))
+
+if (__name__ == "__main__"):
+    import optparse
+
+    parser = optparse.OptionParser()
+
+    parser.add_option("-e", "--extractors", dest = "extractors",
+                      default = "all",
+                      help = "Comma-separated feature extractors to benchmark")
+    parser.add_option("-s", "--sizes", dest = "sizes",
+                      default = ",".join(str(n) for n in DEFAULT_SIZES),
+                      help = "Comma-separated timeline sizes")
+    parser.add_option("-r", "--repeats", dest = "repeats", type = "int",
+                      default = DEFAULT_REPEATS,
+                      help = "Timed runs per size; the fastest is reported")
+    parser.add_option("-o", "--output", dest = "output",
+                      help = "The JSON file to write results to")
+    parser.add_option("--url-density", dest = "url_density", type = "float",
+                      default = 0.3, help = "Average URLs per tweet")
+    parser.add_option("--geotag-fraction", dest = "geotag_fraction",
+                      type = "float", default = 1.0,
+                      help = "Fraction of tweets with coordinates")
+    parser.add_option("--duplicate-fraction", dest = "duplicate_fraction",
+                      type = "float", default = 0.1,
+                      help = "Fraction of tweets repeating earlier text")
+    parser.add_option("--seed", dest = "seed", type = "int", default = 0,
+                      help = "Seed for the synthetic timeline generator")
+    parser.add_option("--compare", dest = "compare", nargs = 2,
+                      help = "Compare two result files instead of running")
+    (options, args) = parser.parse_args()
+
+    if (options.compare):
+        with open(options.compare[0], "r") as f:
+            old = json.load(f)
+        with open(options.compare[1], "r") as f:
+            new = json.load(f)
+        compare(old, new)
+
+    else:
+        extractors = options.extractors
+        if (extractors != "all"):
+            extractors = extractors.split(",")
+
+        results = run(
+            extractors,
+            [int(n) for n in options.sizes.split(",")],
+            options.repeats,
+            TimelineGenerator(
+                url_density = options.url_density,
+                geotag_fraction = options.geotag_fraction,
+                duplicate_fraction = options.duplicate_fraction,
+                seed = options.seed
+            )
+        )
+
+        output = options.output
+        if (output is None):
+            if (not os.path.isdir(OUTPUT_DIR)):
+                os.makedirs(OUTPUT_DIR)
+            output = "%s/%s.json" % (
+                OUTPUT_DIR, results["commit"] or int(results["timestamp"])
+            )
+
+        with open(output, "w") as f:
+            json.dump(results, f, indent = 2)
+        print("Wrote benchmark results to %s" % output)
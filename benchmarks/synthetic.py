@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# generate synthetic Twitter users and timelines for benchmarking
+
+import random
+import time
+
+WORDS = (
+    "the a to of and in is for on you it my that with me this be at so have "
+    "just are not all your love new get day like now out up time good can "
+    "what free win click follow today great check deal video photo life"
+).split()
+
+DOMAINS = [
+    "bit.ly", "t.co", "goo.gl", "example.com", "tinyurl.com", "ow.ly",
+    "youtube.com", "instagram.com", "news.example.org", "shop.example.net"
+]
+
+# (client, relative weight) pairs loosely based on training/twitter_clients.csv
+DEFAULT_SOURCES = [
+    ("instagram.com", 17),
+    ("foursquare.com", 9),
+    ("twitter.com", 30),
+    ("tweetdeck.com", 3),
+    ("dlvr.it", 2),
+    ("twitterfeed.com", 2),
+    ("ifttt.com", 1)
+]
+
+CREATED_AT_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+class TimelineGenerator(object):
+    """ Generates users and timelines shaped like the Twitter API's JSON
+
+    Attributes:
+        url_density: The average number of URLs per tweet
+        hashtag_density: The average number of hashtags per tweet
+        mention_density: The average number of mentions per tweet
+        geotag_fraction: The fraction of tweets that have coordinates
+        sources: A list of (client, weight) pairs to draw tweet sources from
+        duplicate_fraction: The fraction of tweets that repeat an earlier
+            tweet's text
+    """
+
+    def __init__(self, url_density = 0.3, hashtag_density = 0.5,
+                 mention_density = 0.5, geotag_fraction = 1.0,
+                 sources = DEFAULT_SOURCES, duplicate_fraction = 0.1,
+                 seed = None):
+        """ Initializes TimelineGenerator
+
+        Args:
+            url_density, hashtag_density, mention_density, geotag_fraction,
+                sources, duplicate_fraction: See class attributes
+            seed: An optional seed for the random number generator
+        """
+
+        self.url_density = url_density
+        self.hashtag_density = hashtag_density
+        self.mention_density = mention_density
+        self.geotag_fraction = geotag_fraction
+        self.sources = sources
+        self.duplicate_fraction = duplicate_fraction
+
+        self.random = random.Random(seed)
+        self._next_id = 1
+
+    def _id(self):
+        id_ = self._next_id
+        self._next_id += 1
+        return id_
+
+    def _count(self, density):
+        """ Draw a small non-negative count with the given mean """
+
+        count = int(density)
+        if (self.random.random() < density - count):
+            count += 1
+        return count
+
+    def _source(self):
+        clients, weights = zip(*self.sources)
+        client = self.random.choices(clients, weights)[0]
+        return "<a href=\"http://%s/\" rel=\"nofollow\">%s</a>" % (
+            client, client
+        )
+
+    def user(self, screen_name = None):
+        """ Generate a Twitter user
+
+        Args:
+            screen_name: An optional screen name
+
+        Returns:
+            A dictionary shaped like a Twitter API user object
+        """
+
+        id_ = self._id()
+        created = time.gmtime(
+            self.random.randint(1167609600, 1325376000) # 2007 - 2012
+        )
+
+        return {
+            "id": id_,
+            "screen_name": screen_name or "user%d" % id_,
+            "followers_count": self.random.randint(0, 5000),
+            "friends_count": self.random.randint(0, 5000),
+            "verified": self.random.random() < 0.01,
+            "created_at": time.strftime(CREATED_AT_FORMAT, created)
+        }
+
+    def tweet(self, user, timestamp_ms, text = None):
+        """ Generate a single tweet
+
+        Args:
+            user: The user dictionary of the author
+            timestamp_ms: The time of the tweet, in milliseconds
+            text: Optional text to use instead of generated text
+
+        Returns:
+            A dictionary shaped like a Twitter API tweet object
+        """
+
+        urls = [
+            {"expanded_url": "http://%s/%x" % (
+                self.random.choice(DOMAINS), self.random.getrandbits(32)
+            )}
+            for i in range(self._count(self.url_density))
+        ]
+        hashtags = [
+            {"text": self.random.choice(WORDS)}
+            for i in range(self._count(self.hashtag_density))
+        ]
+        mentions = [
+            {"id": self.random.randint(1, 10 ** 9)}
+            for i in range(self._count(self.mention_density))
+        ]
+
+        if (text is None):
+            text = " ".join(
+                self.random.choice(WORDS)
+                for i in range(self.random.randint(4, 20))
+            )
+
+        if (self.random.random() < self.geotag_fraction):
+            coordinates = {
+                "type": "Point",
+                "coordinates": [
+                    self.random.uniform(-71.2, -70.9),
+                    self.random.uniform(42.2, 42.5)
+                ]
+            }
+        else:
+            coordinates = None
+
+        return {
+            "id": self._id(),
+            "text": text,
+            "source": self._source(),
+            "retweet_count": self.random.randint(0, 3),
+            "timestamp_ms": str(timestamp_ms),
+            "created_at": time.strftime(
+                CREATED_AT_FORMAT, time.gmtime(timestamp_ms // 1000)
+            ),
+            "coordinates": coordinates,
+            "entities": {
+                "urls": urls,
+                "hashtags": hashtags,
+                "user_mentions": mentions
+            },
+            "user": user
+        }
+
+    def timeline(self, n_tweets, user = None):
+        """ Generate a user and a chronological timeline of their tweets
+
+        Args:
+            n_tweets: The number of tweets to generate
+            user: An optional user dictionary to generate tweets for
+
+        Returns:
+            A tuple containing the user dictionary and a list of tweets. As in
+            Classifier.collect_tweets, the "user" field is removed from the
+            tweets.
+        """
+
+        if (user is None):
+            user = self.user()
+
+        tweets = []
+        timestamp_ms = 1325376000000
+        for i in range(n_tweets):
+            timestamp_ms += self.random.randint(1000, 6 * 60 * 60 * 1000)
+
+            text = None
+            if (tweets and (self.random.random() < self.duplicate_fraction)):
+                text = self.random.choice(tweets)["text"]
+
+            tweet = self.tweet(user, timestamp_ms, text)
+            tweet.pop("user")
+            tweets.append(tweet)
+
+        return (user, tweets)
@@ -2,41 +2,203 @@
 
 import configparser
 import csv
+import heapq
+import json
+import logging
+import multiprocessing
+import numpy
 import os
 import pymongo
+import sklearn.base
 import sklearn.ensemble
-import sklearn.externals
+import sklearn.model_selection
 import shutil
 import sys
+import threading
+import time
 
+import lib
 from feature_extractors import FEATURE_EXTRACTORS
-from util import train_crm114, config_loader
+from feature_extractors.templates import (
+    Estimate, SharedIntermediates, UserIntermediates
+)
+from lib import metrics, records, timeline
+from lib.forest import CompiledForest
+from lib.sketch import FeatureSketches
+from util import train_crm114, config_loader, evaluate, user_index
 
-def sample_user_ids(collection, n_users):
+logger = logging.getLogger("botdetector")
+# progress messages are silent unless logging is configured by the caller
+logger.addHandler(logging.NullHandler())
+
+# suffix of the progress file that gen_feature_matrix writes next to its output
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# subdirectory of a saved classifier that holds the cheap stage of a cascade
+CASCADE_DIR = "cascade"
+
+# in a fused pass, the calls of every n-th tweet are timed to estimate how the
+# time of the pass is divided between the feature extractors
+TIMING_SAMPLE_INTERVAL = 16
+
+# ways of running feature extractors under a time limit; see
+# FeatureExtractor.timeout_isolation
+TIMEOUT_ISOLATIONS = ["thread", "process"]
+
+# pooled MongoDB clients, shared by every Classifier in a process
+_clients = {}
+_clients_lock = threading.Lock()
+
+def mongo_client(address = None):
+    """ Get the pooled MongoDB client of an address
+
+    A MongoClient holds its own connection pool and is thread-safe, so one is
+    created per address and reused by every connection to it. Clients can not
+    be shared with forked processes, so each process gets its own.
+
+    Args:
+        address: The host and port where Mongo is located; defaults to
+            localhost
+
+    Returns:
+        A pymongo.MongoClient object
+    """
+
+    key = (address, os.getpid())
+    with _clients_lock:
+        if (key not in _clients):
+            _clients[key] = pymongo.MongoClient(address)
+        return _clients[key]
+
+def username(user):
+    """ Describe a user for logging: @ and their screen name, or their ID
+    for datasets without screen names, such as caverlee-2011 """
+
+    if ("screen_name" in user):
+        return "@%s" % user["screen_name"]
+    return "ID %s" % user["id"]
+
+def split_user_ids(collection, n_ranges, sample_size = 10000):
+    """ Split the user IDs of a collection into ranges with roughly the same
+    number of tweets
+
+    The boundaries are quantiles of the user IDs of a random sample of
+    tweets, so that ranges can be scanned in parallel (see
+    Classifier.iter_collection_features).
+
+    Args:
+        collection: A pymongo.collection.Collection object
+        n_ranges: The number of ranges
+        sample_size: The number of tweets to sample
+
+    Returns:
+        A list of (low, high) tuples of user IDs, where low is inclusive,
+        high is exclusive, and None means unbounded
+    """
+
+    user_ids = sorted(
+        doc["user"]["id"]
+        for doc in collection.aggregate([
+            {"$sample": {"size": sample_size}},
+            {"$project": {"_id": 0, "user.id": 1}}
+        ])
+    )
+
+    boundaries = sorted(set(
+        user_ids[len(user_ids) * i // n_ranges] for i in range(1, n_ranges)
+    )) if user_ids else []
+    bounds = [None] + boundaries + [None]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def sample_user_ids(collection, n_users, min_tweets = 0):
     """ Sample n unique user IDs from a MongoDB collection of tweets
 
+    The collection's user index (see util/user_index.py) is used if it
+    exists; otherwise, the distinct users are grouped from the whole
+    collection, which requires a full collection scan.
+
     Args:
         collection: A pymongo.collection.Collection object
         n_users: The number of user IDs to sample
+        min_tweets: Users with fewer tweets than this are skipped
 
     Returns:
         A list of Twitter user IDs
     """
 
+    if (user_index.exists(collection)):
+        return user_index.sample(collection, n_users, min_tweets)
+
+    logger.warning("%s has no user index; scanning the whole collection",
+                   collection.full_name)
+
     return [
         doc["_id"]
         for doc in collection.aggregate([
             {"$group": {
-                "_id": "$user.id"
+                "_id": "$user.id",
+                "tweet_count": {"$sum": 1}
             }},
-            {"$sample": {"size": 3}}
-        ])
+            {"$match": {
+                "tweet_count": {"$gte": min_tweets}
+            }},
+            {"$sample": {"size": n_users}}
+        ], allowDiskUse = True)
     ]
 
+def _call_in_worker(output, function, args):
+    """ Call a function and pass an (ok, value) tuple to output
+
+    Args:
+        output: A list to append the tuple to, or the sending end of a
+            multiprocessing.Pipe
+        function: The function to call
+        args: The arguments to call the function with
+    """
+
+    try:
+        outcome = (True, function(*args))
+    except Exception as error:
+        outcome = (False, error)
+
+    if (isinstance(output, list)):
+        output.append(outcome)
+    else:
+        try:
+            output.send(outcome)
+        except Exception:
+            # the value or exception could not be pickled
+            output.send((False, Exception(repr(outcome[1]))))
+        output.close()
+
 class FeatureExtractor(object):
 
-    def __init__(self):
-        """ Initialize FeatureExtractor """
+    """ FeatureExtractor
+
+    Attributes:
+        extractors: A dictionary of initialized feature extractors
+        metrics: A lib.metrics.Registry that timings and counters are recorded
+            to
+        extractor_timeout: The number of seconds a feature extractor may run
+            on one user, or None for no limit
+        user_timeout: The number of seconds that extract_features may spend
+            on one user, or None for no limit
+        timeout_isolation: How feature extractors are run when a time limit
+            applies; see TIMEOUT_ISOLATIONS
+        imputation: A dictionary mapping features to the values used when
+            they time out
+        default_imputation: The value used when a feature that is not in
+            imputation times out
+    """
+
+    def __init__(self, metrics_registry = None):
+        """ Initialize FeatureExtractor
+
+        Args:
+            metrics_registry: The lib.metrics.Registry to record to; defaults
+                to the shared lib.metrics.registry
+        """
 
         config = config_loader.ConfigLoader().load()
 
@@ -46,6 +208,30 @@ class FeatureExtractor(object):
 
         # dictionary of initialized feture extractors
         self.extractors = {}
+        self.metrics = metrics_registry or metrics.registry
+
+        self.extractor_timeout = float(
+            config["classifier"].get("extractor_timeout", "0")
+        ) or None
+        self.user_timeout = float(
+            config["classifier"].get("user_timeout", "0")
+        ) or None
+        self.timeout_isolation = config["classifier"].get(
+            "timeout_isolation", "thread"
+        )
+        assert self.timeout_isolation in TIMEOUT_ISOLATIONS, (
+               "Unknown timeout isolation %s" % self.timeout_isolation)
+
+        self.imputation = {}
+        self.default_imputation = 0.0
+        for entry in config["classifier"].get("imputation", "").split(","):
+            if (not entry.strip()):
+                continue
+            (feature, value) = entry.split(":")
+            if (feature.strip() == "default"):
+                self.default_imputation = float(value)
+            else:
+                self.imputation[feature.strip()] = float(value)
 
     def initialize_feature_extractors(self, extractors):
         """ Initialize feature extractors if they have not been initialized yet
@@ -58,7 +244,7 @@ class FeatureExtractor(object):
             extractors = FEATURE_EXTRACTORS.keys()
         for extractor in extractors:
             if (not extractor in self.extractors):
-                print("Initializing feature extractor %s" % extractor)
+                logger.info("Initializing feature extractor %s", extractor)
                 self.extractors[extractor] = FEATURE_EXTRACTORS[extractor]()
 
     def extract_features(self, user, tweets, features = "all"):
@@ -71,9 +257,24 @@ class FeatureExtractor(object):
         Each feature extractor should take the user's JSON and an array of the
         user's tweets as arguments and return an integer or floating point.
 
+        Feature extractors that support it (see fused in
+        feature_extractors.templates.FeatureExtractor) are all fed in a single
+        pass over the tweets; the others are run on the whole list, and share
+        a single UserIntermediates (see uses_intermediates).
+
         If a feature extractor does not return an integer or floating point, it
         is not added to the results dictionary.
 
+        If extractor_timeout or user_timeout is set, feature extractors that
+        are run on the whole list are run in a worker (see timeout_isolation)
+        and abandoned when they exceed extractor_timeout, or when the time
+        spent on the user exceeds user_timeout. Their results are then
+        replaced by their imputation values, and once the user's time is up
+        the remaining feature extractors are not run at all. Blocking feature
+        extractors (see blocking in feature_extractors.templates
+        .FeatureExtractor) are then run on the whole list even if they
+        support fusion, so that they are bounded too.
+
         Args:
             user: A dictionary of the twitter user
             tweets: A list of tweet dictionaries
@@ -82,47 +283,479 @@ class FeatureExtractor(object):
 
         Returns:
             A dictionary where the indices are the feature names and the values
-            are the results
+            are the results, plus an "imputed" field containing a
+            comma-separated list of the features that timed out, and an
+            "error_bounds" field containing a comma-separated list of
+            feature:bound pairs for features that were estimated (see
+            feature_extractors.templates.Estimate)
         """
 
         results = {}
+        imputed = []
+        deadline = (time.perf_counter() + self.user_timeout
+                    if self.user_timeout else None)
 
         if (features == "all"):
             features = FEATURE_EXTRACTORS.keys()
 
         self.initialize_feature_extractors(features)
 
-        print("========== Extracting features for user @%s" % user["screen_name"])
+        logger.info("Extracting features for user %s", username(user))
+        self.metrics.inc("users_processed_total")
+        self.metrics.inc("tweets_processed_total", len(tweets))
 
-        for feature_extractor in sorted(features):
+        for feature_extractor in features:
             assert feature_extractor in FEATURE_EXTRACTORS, (
                    "Feature extractor %s is undefined" % feature_extractor)
 
-            print("Running %s" % feature_extractor)
-            result = self.extractors[feature_extractor].run(user, tweets)
-
-            # Result validation
-            if ((type(result) is int) or (type(result) is float)):
-                results[feature_extractor] = result
+        (fused, others) = self._split(features, "fused")
+        if (self._bounds_apply()):
+            (blocking, fused) = self._split(fused, "blocking")
+            others = sorted(others + blocking)
+
+        if (fused):
+            logger.debug("Running %s in a single pass", ", ".join(fused))
+            states = self._start(fused, user)
+            timings = self._accumulate(fused, states, tweets)
+            self._finish(fused, states, timings, results)
+
+        intermediates = UserIntermediates(user, tweets)
+        for feature_extractor in others:
+            logger.debug("Running %s", feature_extractor)
+            extractor = self.extractors[feature_extractor]
+            args = ((user, tweets, intermediates)
+                    if extractor.uses_intermediates else (user, tweets))
+            timeout = self.extractor_timeout
+            if (deadline is not None):
+                remaining = deadline - time.perf_counter()
+                timeout = (remaining if (timeout is None)
+                           else min(timeout, remaining))
+
+            if (timeout is None):
+                result = self._timed(feature_extractor, extractor.run, *args)
+            elif ((timeout <= 0) or (not self._bounded(
+                feature_extractor, timeout, results, extractor.run, *args
+            ))):
+                self._impute(feature_extractor, user, results)
+                imputed.append(feature_extractor)
+                continue
             else:
-                print("Feature extractor %s returned non-numeric value: %s" % (
-                    feature_extractor, result
-                ))
+                result = results.pop(feature_extractor)
+            self._validate(feature_extractor, result, results)
 
-        print()
+        results["imputed"] = ",".join(imputed)
+        results.setdefault("error_bounds", "")
 
         return results
 
+    def extract_features_chunked(self, chunks, features, sample_size,
+                                 seed = None):
+        """ Extract features from a timeline that arrives in chunks
+
+        Streaming feature extractors are fed every chunk and see the whole
+        timeline; the other feature extractors are run once at the end on a
+        uniform random sample of at most sample_size tweets. When a time limit
+        is set, blocking feature extractors are not streamed, so that they
+        are run on the sample with a bound.
+
+        Args:
+            chunks: An iterable of (user, tweets) tuples
+            features: A list of features to extract
+            sample_size: The number of tweets to sample for feature extractors
+                that do not support streaming
+            seed: An optional seed for the sample
+
+        Returns:
+            A tuple containing the user, a results dictionary as generated by
+            extract_features, and the number of tweets that were seen
+        """
+
+        self.initialize_feature_extractors(features)
+
+        (streaming, others) = self._split(features, "streaming")
+        if (self._bounds_apply()):
+            (blocking, streaming) = self._split(streaming, "blocking")
+            others = sorted(others + blocking)
+        (fused, streaming) = self._split(streaming, "fused")
+
+        reservoir = lib.Reservoir(sample_size, seed)
+        states = None
+        timings = None
+        user = None
+
+        for (user, tweets) in chunks:
+            if (states is None):
+                states = self._start(fused + streaming, user)
+            timings = self._accumulate(fused, states, tweets, timings)
+            for feature_extractor in streaming:
+                self._timed(
+                    feature_extractor,
+                    self.extractors[feature_extractor].update,
+                    states[feature_extractor], tweets
+                )
+            for tweet in tweets:
+                reservoir.add(tweet)
+
+        results = {}
+        if (states is not None):
+            self._finish(fused, states, timings, results)
+        for feature_extractor in streaming:
+            result = self._timed(
+                feature_extractor,
+                self.extractors[feature_extractor].finish,
+                states[feature_extractor]
+            )
+            self._validate(feature_extractor, result, results)
+        self.metrics.inc(
+            "tweets_streamed_total", reservoir.seen - len(reservoir.items())
+        )
+
+        # also sets the "imputed" and "error_bounds" fields
+        error_bounds = results.get("error_bounds")
+        results.update(self.extract_features(
+            user, reservoir.items(), others
+        ))
+        if (error_bounds):
+            results["error_bounds"] = ",".join(filter(None, [
+                error_bounds, results["error_bounds"]
+            ]))
+
+        return (user, results, reservoir.seen)
+
+    def _bounds_apply(self):
+        """ Check if extractor_timeout or user_timeout is set """
+
+        return (self.extractor_timeout is not None) or (
+            self.user_timeout is not None
+        )
+
+    def _split(self, features, attribute):
+        """ Split features by a boolean attribute of their extractors
+
+        Args:
+            features: A list of initialized features
+            attribute: The name of the attribute, e.g. "streaming"
+
+        Returns:
+            A tuple of two sorted lists: the features whose extractors have
+            the attribute set, and the others
+        """
+
+        with_attribute = []
+        without_attribute = []
+        for feature_extractor in sorted(features):
+            if (getattr(self.extractors[feature_extractor], attribute)):
+                with_attribute.append(feature_extractor)
+            else:
+                without_attribute.append(feature_extractor)
+        return (with_attribute, without_attribute)
+
+    def _start(self, features, user):
+        """ Start streaming runs of feature extractors
+
+        Returns:
+            A dictionary mapping the features to their states
+        """
+
+        return {
+            feature_extractor: self.extractors[feature_extractor].start(user)
+            for feature_extractor in features
+        }
+
+    def _accumulate(self, fused, states, tweets, timings = None):
+        """ Feed tweets to fused feature extractors in a single pass
+
+        Each tweet's SharedIntermediates are created once and passed to every
+        feature extractor, so that values like the parsed source are only
+        computed once per tweet.
+
+        Args:
+            fused: A list of fused features
+            states: A dictionary mapping the features to their states
+            tweets: An iterable of tweets
+            timings: A dictionary returned by a previous call to add to
+
+        Returns:
+            A dictionary mapping the features to [wall, cpu] seconds spent in
+            them. The wall and CPU time of the whole pass are measured and
+            divided between the feature extractors in proportion to their
+            time on every TIMING_SAMPLE_INTERVAL-th tweet; only those calls
+            are timed individually.
+        """
+
+        if (timings is None):
+            timings = {
+                feature_extractor: [0.0, 0.0] for feature_extractor in fused
+            }
+        if (not fused):
+            return timings
+
+        sampled = dict.fromkeys(fused, 0.0)
+        accumulators = [
+            (
+                feature_extractor,
+                self.extractors[feature_extractor].accumulate,
+                states[feature_extractor]
+            )
+            for feature_extractor in fused
+        ]
+        clock = time.perf_counter
+        wall_start = clock()
+        cpu_start = time.process_time()
+
+        for (i, tweet) in enumerate(tweets):
+            shared = SharedIntermediates(tweet)
+            if (i % TIMING_SAMPLE_INTERVAL):
+                for (feature_extractor, accumulate, state) in accumulators:
+                    accumulate(state, tweet, shared)
+            else:
+                for (feature_extractor, accumulate, state) in accumulators:
+                    start = clock()
+                    accumulate(state, tweet, shared)
+                    sampled[feature_extractor] += clock() - start
+
+        wall = clock() - wall_start
+        cpu = time.process_time() - cpu_start
+        total_sampled = sum(sampled.values())
+        for feature_extractor in fused:
+            share = ((sampled[feature_extractor] / total_sampled)
+                     if total_sampled else (1 / len(fused)))
+            timings[feature_extractor][0] += wall * share
+            timings[feature_extractor][1] += cpu * share
+
+        return timings
+
+    def _finish(self, fused, states, timings, results):
+        """ Finish the runs of fused feature extractors and record their time
+
+        Args:
+            fused: A list of fused features
+            states: A dictionary mapping the features to their states
+            timings: The dictionary returned by _accumulate
+            results: The results dictionary to add the results to
+        """
+
+        for feature_extractor in fused:
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+
+            result = self.extractors[feature_extractor].finish(
+                states[feature_extractor]
+            )
+
+            (wall, cpu) = timings[feature_extractor]
+            self._record(
+                feature_extractor,
+                wall + time.perf_counter() - wall_start,
+                cpu + time.process_time() - cpu_start
+            )
+            self._validate(feature_extractor, result, results)
+
+    def _record(self, feature_extractor, wall, cpu):
+        """ Record the wall and CPU time of a feature extractor """
+
+        self.metrics.observe(
+            "extractor_wall_seconds", wall, extractor = feature_extractor
+        )
+        self.metrics.observe(
+            "extractor_cpu_seconds", cpu, extractor = feature_extractor
+        )
+
+    def _timed(self, feature_extractor, function, *args):
+        """ Call a feature extractor method and record its wall and CPU time
+
+        Args:
+            feature_extractor: The name of the feature extractor
+            function: The method to call
+            args: The arguments to call the method with
+
+        Returns:
+            The return value of the method
+        """
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        result = function(*args)
+
+        self._record(
+            feature_extractor,
+            time.perf_counter() - wall_start,
+            time.process_time() - cpu_start
+        )
+
+        return result
+
+    def _bounded(self, feature_extractor, timeout, results, function, *args):
+        """ Call a feature extractor method in a worker with a time limit and
+        record its wall and CPU time
+
+        With "thread" isolation, the method runs in a daemon thread that is
+        abandoned if it does not return in time; Python threads can not be
+        killed, so it may keep running in the background. With "process"
+        isolation, the method runs in a forked process that is killed if it
+        does not return in time; changes that it makes to the state of the
+        feature extractor are not kept.
+
+        Args:
+            feature_extractor: The name of the feature extractor
+            timeout: The number of seconds to wait for the method
+            results: A dictionary that the return value is stored in under
+                the name of the feature extractor
+            function: The method to call
+            args: The arguments to call the method with
+
+        Returns:
+            True if the method returned in time, False otherwise. Exceptions
+            raised by the method are raised again.
+        """
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        if (self.timeout_isolation == "process"):
+            (receiver, sender) = multiprocessing.Pipe(duplex = False)
+            worker = multiprocessing.get_context("fork").Process(
+                target = _call_in_worker, args = (sender, function, args),
+                daemon = True
+            )
+            worker.start()
+            sender.close()
+            finished = receiver.poll(timeout)
+            outcome = None
+            if (finished):
+                try:
+                    outcome = receiver.recv()
+                except EOFError:
+                    outcome = (False, Exception(
+                        "Worker of %s exited without a result"
+                        % feature_extractor
+                    ))
+            receiver.close()
+            if (not finished):
+                worker.kill()
+            worker.join()
+
+        else:
+            box = []
+            worker = threading.Thread(
+                target = lambda: _call_in_worker(box, function, args),
+                name = "extractor-%s" % feature_extractor,
+                daemon = True
+            )
+            worker.start()
+            worker.join(timeout)
+            finished = not worker.is_alive()
+            outcome = box[0] if finished else None
+
+        self._record(
+            feature_extractor,
+            time.perf_counter() - wall_start,
+            time.process_time() - cpu_start
+        )
+
+        if (not finished):
+            return False
+        (ok, value) = outcome
+        if (not ok):
+            raise value
+        results[feature_extractor] = value
+        return True
+
+    def _impute(self, feature_extractor, user, results):
+        """ Add the imputation value of a feature extractor that timed out to
+        a results dictionary """
+
+        self.metrics.inc(
+            "extractor_timeouts_total", extractor = feature_extractor
+        )
+        logger.warning("Feature extractor %s timed out for user %s",
+                       feature_extractor, username(user))
+        results[feature_extractor] = self.imputation.get(
+            feature_extractor, self.default_imputation
+        )
+
+    def _validate(self, feature_extractor, result, results):
+        """ Add a result to a results dictionary if it is numeric
+
+        The error bound of an Estimate is added to the "error_bounds" field
+        of the results dictionary.
+
+        Args:
+            feature_extractor: The name of the feature extractor
+            result: The value returned by the feature extractor
+            results: The results dictionary to add the result to
+        """
+
+        self.metrics.inc(
+            "extractor_calls_total", extractor = feature_extractor
+        )
+
+        if (isinstance(result, Estimate)):
+            results[feature_extractor] = float(result)
+            results["error_bounds"] = ",".join(filter(None, [
+                results.get("error_bounds"),
+                "%s:%g" % (feature_extractor, result.error_bound)
+            ]))
+        elif ((type(result) is int) or (type(result) is float)):
+            results[feature_extractor] = result
+        else:
+            self.metrics.inc(
+                "extractor_non_numeric_total",
+                extractor = feature_extractor
+            )
+            logger.warning(
+                "Feature extractor %s returned non-numeric value: %s",
+                feature_extractor, result
+            )
+
 class Classifier(object):
 
     """ Classifier
 
     Attributes:
         feature_extractor: A FeatureExtractor object
-        classifier: A sklearn.ensemble.RandomForestClassifier object
+        classifier: A sklearn.ensemble.RandomForestClassifier object, used for
+            training
+        forest: A lib.forest.CompiledForest object compiled from the trained
+            classifier, used for prediction
         features: A list of features being considered
+        compact_records: Whether or not tweets are collected as compact
+            lib.records objects instead of full dictionaries
+        pushdown: Whether or not features that declare a MongoDB aggregation
+            are computed by MongoDB instead of in Python
+        pushdown_batch_size: The number of users per pushdown aggregation
+        max_tweets: The maximum number of tweets per user that are loaded
+            into memory at once, or 0 for no limit
+        oversize_policy: How users with more than max_tweets tweets are
+            handled; see OVERSIZE_POLICIES
+        stream_chunk_size: The number of tweets per chunk under the "stream"
+            policy
+        scan_batch_size: The number of tweets per batch when a whole
+            collection is scanned
+        cascade: Whether or not a cheap-feature forest is trained alongside
+            the full forest and used to classify users without extracting
+            the expensive features when it is confident
+        cascade_band: A (low, high) tuple; users whose cheap-stage spam
+            probability lies inside this band are passed to the full forest
+        cascade_cheap_ms: Features whose measured extraction time is at most
+            this many milliseconds per user are cheap
+        cheap_features: The features of the cheap forest
+        cheap_forest: A lib.forest.CompiledForest trained on cheap_features,
+            or None if the cascade is not used
+        cascade_stats: Statistics of the cascade measured during training,
+            including the estimated accuracy cost and skipped extraction time
+        cascade_report: Statistics of the cascade in the last call to
+            predict
     """
 
+    # "recent": only the most recent max_tweets tweets are used
+    # "reservoir": a uniform random sample of max_tweets tweets is used, seeded
+    #     by the user ID so that it can be reproduced
+    # "stream": streaming feature extractors see every tweet in chunks, and
+    #     the rest use a reservoir sample
+    OVERSIZE_POLICIES = ["recent", "reservoir", "stream"]
+
     def __init__(self):
         """ Initializes Classifier """
 
@@ -134,52 +767,572 @@ class Classifier(object):
         self.classifier = sklearn.ensemble.RandomForestClassifier(
             n_estimators = int(config["classifier"]["n_estimators"])
         )
+        self.forest = None
+        self.compact_records = bool(int(
+            config["classifier"].get("compact_records", "0")
+        ))
+        self.pushdown = bool(int(config["classifier"].get("pushdown", "0")))
+        self.pushdown_batch_size = int(
+            config["classifier"].get("pushdown_batch_size", "100")
+        )
+        self.max_tweets = int(config["classifier"].get("max_tweets", "0"))
+        self.oversize_policy = config["classifier"].get(
+            "oversize_policy", "reservoir"
+        )
+        self.stream_chunk_size = int(
+            config["classifier"].get("stream_chunk_size", "1000")
+        )
+        assert self.oversize_policy in self.OVERSIZE_POLICIES, (
+               "Unknown oversize policy %s" % self.oversize_policy)
+        self.scan_batch_size = int(
+            config["classifier"].get("scan_batch_size", "1000")
+        )
+
+        self.cascade = bool(int(config["classifier"].get("cascade", "0")))
+        self.cascade_band = tuple(
+            float(bound) for bound in
+            config["classifier"].get("cascade_band", "0.2,0.8").split(",")
+        )
+        self.cascade_cheap_ms = float(
+            config["classifier"].get("cascade_cheap_ms", "1")
+        )
+        self.cheap_features = []
+        self.cheap_forest = None
+        self.cascade_stats = None
+        self.cascade_report = None
 
         if ((features == "all") or (features == ["all"])):
             features = FEATURE_EXTRACTORS.keys()
         self.features = sorted(features)
 
-    def connect(self, db, collection):
+    def connect(self, db, collection, address = None):
         """ Connect to a MongoDB collection
 
         Args:
             db: The database to connect to
             collection: The collection to connect to
+            address: The host and port where Mongo is located; defaults to
+                localhost
         """
 
-        self.collection = pymongo.MongoClient()[db][collection]
+        self.collection = mongo_client(address)[db][collection]
 
-    def collect_tweets(self, user_id):
+    def _find_tweets(self, user_id, **kwargs):
         """ Query Mongo for tweets by a user
 
+        Args:
+            user_id: The user ID to query for
+            kwargs: Extra arguments to pymongo.collection.Collection.find
+
+        Returns:
+            A pymongo.cursor.Cursor object
+        """
+
+        assert self.collection is not None
+
+        return self.collection.find(
+            {"user.id": user_id},
+            records.TWEET_PROJECTION if self.compact_records else None,
+            no_cursor_timeout = True,
+            **kwargs
+        )
+
+    def _read_tweets(self, docs):
+        """ Convert tweet documents to the format returned by collect_tweets
+
         To save on memory, we remove the "user" field from the tweets because
-        it is redundant
+        it is redundant. If compact_records is set, the tweets and user are
+        stored in lib.records.Tweet and lib.records.User objects instead.
 
         Args:
-            user_id: The user ID to query for
+            docs: An iterable of tweet dictionaries
 
         Returns:
             A dict containing the user's Tweet objects and a User object
         """
 
-        assert self.collection is not None
+        if (self.compact_records):
+            return records.from_cursor(docs)
 
         data = {
             "tweets": [],
             "user": None
         }
 
-        cursor = self.collection.find(
-            {"user.id": user_id},
-            no_cursor_timeout = True
-        )
-        for doc in cursor:
+        for doc in docs:
             data["user"] = doc.pop("user") # Keep overwriting the "user" field
             data["tweets"].append(doc)
+
+        return data
+
+    def count_tweets(self, user_id):
+        """ Count a user's tweets if max_tweets is set
+
+        Args:
+            user_id: The user ID to count tweets for
+
+        Returns:
+            The number of tweets, or None if there is no limit
+        """
+
+        if (self.max_tweets <= 0):
+            return None
+        return self.collection.count_documents({"user.id": user_id})
+
+    def collect_tweets(self, user_id, n_tweets = None):
+        """ Query Mongo for tweets by a user
+
+        If the user has more than max_tweets tweets, only some of them are
+        loaded, as determined by oversize_policy. The "stream" policy is
+        handled by iter_user_features; here it falls back to "reservoir".
+
+        Args:
+            user_id: The user ID to query for
+            n_tweets: The number of tweets the user has, if already counted
+
+        Returns:
+            A dict containing the user's Tweet objects, a User object, and a
+            string describing how the tweets were sampled
+        """
+
+        if (n_tweets is None):
+            n_tweets = self.count_tweets(user_id)
+
+        if ((n_tweets is None) or (n_tweets <= self.max_tweets)):
+            cursor = self._find_tweets(user_id)
+            data = self._read_tweets(cursor)
+            data["sampling"] = "none"
+
+        elif (self.oversize_policy == "recent"):
+            # timestamp_ms strings have the same number of digits, so they
+            # sort the same way as the numbers
+            cursor = self._find_tweets(
+                user_id,
+                sort = [("timestamp_ms", pymongo.DESCENDING)],
+                limit = self.max_tweets
+            )
+            docs = list(cursor)
+            docs.reverse()
+            data = self._read_tweets(docs)
+            data["sampling"] = "recent:%d/%d" % (len(docs), n_tweets)
+
+        else:
+            cursor = self._find_tweets(user_id)
+            (docs, seen) = lib.reservoir_sample(
+                cursor, self.max_tweets, seed = user_id
+            )
+            data = self._read_tweets(docs)
+            data["sampling"] = "reservoir:%d/%d" % (len(docs), seen)
+
         cursor.close()
 
         return data
 
+    def stream_features(self, user_id, features):
+        """ Extract features from a user's timeline in chunks of
+        stream_chunk_size tweets, so that only one chunk and a sample of
+        max_tweets tweets are held in memory at once
+
+        Args:
+            user_id: The user ID to extract features for
+            features: A list of features to extract
+
+        Returns:
+            A tuple containing the user, a results dictionary as generated by
+            FeatureExtractor.extract_features, and a string describing how
+            the tweets were sampled
+        """
+
+        cursor = self._find_tweets(
+            user_id, batch_size = self.stream_chunk_size
+        )
+
+        def chunks():
+            chunk = []
+            for doc in cursor:
+                chunk.append(doc)
+                if (len(chunk) == self.stream_chunk_size):
+                    data = self._read_tweets(chunk)
+                    yield (data["user"], data["tweets"])
+                    chunk = []
+            if (chunk):
+                data = self._read_tweets(chunk)
+                yield (data["user"], data["tweets"])
+
+        (user, results, seen) = (
+            self.feature_extractor.extract_features_chunked(
+                chunks(), features, self.max_tweets, seed = user_id
+            )
+        )
+        cursor.close()
+
+        return (user, results, "stream:%d/%d" % (
+            min(self.max_tweets, seen), seen
+        ))
+
+    def scan_user_groups(self, user_id_range = None, after = None):
+        """ Scan a collection once in user ID order, cutting the stream into
+        the tweets of each user
+
+        Only one user's tweets are read at a time, so they must be consumed
+        before the next group is taken.
+
+        Args:
+            user_id_range: An optional (low, high) tuple of user IDs returned
+                by split_user_ids to restrict the scan to
+            after: An optional user ID; only users with greater IDs are
+                scanned
+
+        Yields:
+            (user_id, docs) tuples, where docs is an iterator over the tweet
+            documents of the user
+        """
+
+        assert self.collection is not None
+
+        query = {}
+        if (user_id_range is not None):
+            (low, high) = user_id_range
+            if (low is not None):
+                query["$gte"] = low
+            if (high is not None):
+                query["$lt"] = high
+        if ((after is not None)
+                and (("$gte" not in query) or (after >= query["$gte"]))):
+            query.pop("$gte", None)
+            query["$gt"] = after
+
+        cursor = self.collection.find(
+            {"user.id": query} if query else {},
+            records.TWEET_PROJECTION if self.compact_records else None,
+            sort = [("user.id", pymongo.ASCENDING)],
+            batch_size = self.scan_batch_size,
+            no_cursor_timeout = True
+        )
+
+        docs = iter(cursor)
+        pending = next(docs, None)
+
+        def group(user_id):
+            nonlocal pending
+            while ((pending is not None)
+                   and (pending["user"]["id"] == user_id)):
+                yield pending
+                pending = next(docs, None)
+
+        try:
+            while (pending is not None):
+                user_id = pending["user"]["id"]
+                yield (user_id, group(user_id))
+                # skip whatever the consumer did not read
+                for doc in group(user_id):
+                    pass
+        finally:
+            cursor.close()
+
+    def group_features(self, user_id, docs, features):
+        """ Extract the features of a user from an iterator over their tweet
+        documents, applying oversize_policy as the tweets are read
+
+        Args:
+            user_id: The user ID
+            docs: An iterator over the user's tweet documents
+            features: A list of features to extract
+
+        Returns:
+            A tuple containing the user and a results dictionary, as returned
+            by user_features
+        """
+
+        if (self.max_tweets <= 0):
+            data = self._read_tweets(docs)
+            sampling = "none"
+
+        elif (self.oversize_policy == "stream"):
+            def chunks():
+                chunk = []
+                for doc in docs:
+                    chunk.append(doc)
+                    if (len(chunk) == self.stream_chunk_size):
+                        data = self._read_tweets(chunk)
+                        yield (data["user"], data["tweets"])
+                        chunk = []
+                if (chunk):
+                    data = self._read_tweets(chunk)
+                    yield (data["user"], data["tweets"])
+
+            (user, results, seen) = (
+                self.feature_extractor.extract_features_chunked(
+                    chunks(), features, self.max_tweets, seed = user_id
+                )
+            )
+            results["sampling"] = (
+                "none" if (seen <= self.max_tweets)
+                else "stream:%d/%d" % (self.max_tweets, seen)
+            )
+            return (user, results)
+
+        elif (self.oversize_policy == "recent"):
+            seen = [0]
+            def counted():
+                for doc in docs:
+                    seen[0] += 1
+                    yield doc
+            # tweets without a timestamp_ms are dated by their created_at
+            recent = heapq.nlargest(
+                self.max_tweets, counted(),
+                key = lambda doc: timeline.tweet_ms(doc) or 0
+            )
+            recent.reverse()
+            data = self._read_tweets(recent)
+            sampling = (
+                "none" if (seen[0] <= self.max_tweets)
+                else "recent:%d/%d" % (len(recent), seen[0])
+            )
+
+        else:
+            (sample, seen) = lib.reservoir_sample(
+                docs, self.max_tweets, seed = user_id
+            )
+            data = self._read_tweets(sample)
+            sampling = (
+                "none" if (seen <= self.max_tweets)
+                else "reservoir:%d/%d" % (len(sample), seen)
+            )
+
+        results = self.feature_extractor.extract_features(
+            user = data["user"],
+            tweets = data["tweets"],
+            features = features
+        )
+        results["sampling"] = sampling
+
+        return (data["user"], results)
+
+    def iter_collection_features(self, user_id_range = None,
+                                 isolate_failures = False, features = None,
+                                 after = None):
+        """ Extract the features of every user in the collection with a
+        single scan, instead of one query per user
+
+        Pushdown is not used, since every tweet is read anyway.
+
+        Args:
+            user_id_range: An optional range of user IDs to restrict the scan
+                to; see scan_user_groups
+            isolate_failures: See iter_user_features
+            features: The features to extract; defaults to self.features
+            after: An optional user ID; see scan_user_groups
+
+        Yields:
+            (user_id, user, results) tuples, as iter_user_features does
+        """
+
+        if (features is None):
+            features = self.features
+        self.feature_extractor.initialize_feature_extractors(features)
+
+        for (user_id, docs) in self.scan_user_groups(user_id_range, after):
+            try:
+                (user, results) = self.group_features(
+                    user_id, docs, features
+                )
+            except Exception as error:
+                if (not isolate_failures):
+                    raise
+                logger.exception("Feature extraction failed for user ID "
+                                 "%d: %s", user_id, error)
+                self.feature_extractor.metrics.inc("users_failed_total")
+                yield (user_id, None, error)
+                continue
+
+            yield (user_id, user, results)
+
+    def aggregate_features(self, user_ids, features):
+        """ Compute features on the MongoDB server
+
+        The aggregation fragments of the given feature extractors are merged
+        into a single $group stage, so that the features of every user in
+        user_ids are computed in one query without any tweets being sent to
+        the client.
+
+        Args:
+            user_ids: A list of user IDs
+            features: A list of feature extractors that declare an aggregation
+
+        Returns:
+            A dictionary where the keys are user IDs and the values are
+            dictionaries containing the user and the feature values
+        """
+
+        assert self.collection is not None
+
+        group = {
+            "_id": "$user.id",
+            "user": {"$last": "$user"}
+        }
+        for feature in features:
+            for (key, accumulator) in (
+                FEATURE_EXTRACTORS[feature].aggregation.items()
+            ):
+                group["%s__%s" % (feature, key)] = accumulator
+
+        start = time.perf_counter()
+        aggregated = {}
+        for doc in self.collection.aggregate([
+            {"$match": {"user.id": {"$in": list(user_ids)}}},
+            {"$group": group}
+        ], allowDiskUse = True):
+            user = doc["user"]
+            if (self.compact_records):
+                user = records.User(user)
+
+            results = {"user": user}
+            for feature in features:
+                prefix = "%s__" % feature
+                results[feature] = self.feature_extractor.extractors[
+                    feature
+                ].finalize({
+                    key[len(prefix):]: value
+                    for (key, value) in doc.items()
+                    if (key.startswith(prefix))
+                })
+            aggregated[doc["_id"]] = results
+
+        self.feature_extractor.metrics.observe(
+            "pushdown_wall_seconds", time.perf_counter() - start
+        )
+        self.feature_extractor.metrics.inc(
+            "pushdown_users_total", len(aggregated)
+        )
+
+        return aggregated
+
+    def user_features(self, user_id, features, aggregated = None):
+        """ Extract the features of a single user
+
+        Args:
+            user_id: The user ID to extract features for
+            features: A list of features to extract
+            aggregated: An optional dictionary generated by aggregate_features
+                for this user; features that it contains are not extracted
+                again
+
+        Returns:
+            A tuple containing the user and a results dictionary generated by
+            FeatureExtractor.extract_features, plus a "sampling" field
+            describing how the user's tweets were sampled
+        """
+
+        if (aggregated is not None):
+            aggregated = dict(aggregated)
+            features = [
+                feature for feature in features if (feature not in aggregated)
+            ]
+            if (not features):
+                user = aggregated.pop("user")
+                aggregated["sampling"] = "none"
+                aggregated["imputed"] = ""
+                aggregated["error_bounds"] = ""
+                return (user, aggregated)
+
+        n_tweets = self.count_tweets(user_id)
+        if ((self.oversize_policy == "stream")
+                and (n_tweets is not None)
+                and (n_tweets > self.max_tweets)):
+            logger.info("Streaming %d tweets for user ID %d",
+                        n_tweets, user_id)
+            (user, results, sampling) = self.stream_features(
+                user_id, features
+            )
+
+        else:
+            logger.info("Querying tweets for user ID %d", user_id)
+            data = self.collect_tweets(user_id, n_tweets)
+            logger.info("Collected %d tweets (sampling: %s)",
+                        len(data["tweets"]), data["sampling"])
+
+            user = data["user"]
+            sampling = data["sampling"]
+            results = self.feature_extractor.extract_features(
+                user = user,
+                tweets = data["tweets"],
+                features = features
+            )
+
+        if (aggregated is not None):
+            aggregated.pop("user")
+            results.update(aggregated)
+        results["sampling"] = sampling
+
+        return (user, results)
+
+    def iter_user_features(self, user_ids, isolate_failures = False,
+                           features = None):
+        """ Extract the features of each user
+
+        If pushdown is enabled, features that declare an aggregation are
+        computed by MongoDB in batches of pushdown_batch_size users, and the
+        user's tweets are only queried if other features remain.
+
+        Args:
+            user_ids: A list of user IDs
+            isolate_failures: If True, an exception raised while extracting a
+                user's features is yielded in place of the results instead of
+                being raised, so that the remaining users are still processed
+            features: The features to extract; defaults to self.features
+
+        Yields:
+            (user_id, user, results) tuples, where results is a dictionary
+            generated by user_features. If isolate_failures is set and
+            extraction fails, user is None and results is the exception.
+        """
+
+        if (features is None):
+            features = self.features
+        self.feature_extractor.initialize_feature_extractors(features)
+
+        if (self.pushdown):
+            pushed = [
+                feature
+                for feature in features
+                if (FEATURE_EXTRACTORS[feature].aggregation is not None)
+            ]
+        else:
+            pushed = []
+
+        user_ids = list(user_ids)
+        batch_size = self.pushdown_batch_size if pushed else len(user_ids)
+
+        for start in range(0, len(user_ids), max(batch_size, 1)):
+            batch = user_ids[start:start + batch_size]
+
+            aggregated = {}
+            if (pushed):
+                try:
+                    aggregated = self.aggregate_features(batch, pushed)
+                except Exception as error:
+                    if (not isolate_failures):
+                        raise
+                    # fall back to extracting every feature in Python
+                    logger.exception("Aggregation failed: %s", error)
+
+            for user_id in batch:
+                try:
+                    (user, results) = self.user_features(
+                        user_id, features, aggregated.get(user_id)
+                    )
+                except Exception as error:
+                    if (not isolate_failures):
+                        raise
+                    logger.exception("Feature extraction failed for user ID "
+                                     "%d: %s", user_id, error)
+                    self.feature_extractor.metrics.inc("users_failed_total")
+                    yield (user_id, None, error)
+                    continue
+
+                yield (user_id, user, results)
+
     def dict_to_feature_vector(self, features):
         """ Convert a dictionary generated by FeatureExtrctor.extract_features
         to a feature vector
@@ -204,46 +1357,229 @@ class Classifier(object):
             for feature_extractor in self.features
         ]
 
-    def gen_feature_matrix(self, user_ids, output_csv_path):
-        """ Create feature vectors from the given users
+    def read_checkpoint(self, output_csv_path):
+        """ Read the checkpoint of a feature matrix written by
+        gen_feature_matrix
 
         Args:
-            users: A list of Twitter user IDs
-            output_csv_path: The path that the feature vectors should be written to
-            feature_extractors: A list of feature extractors to use, or "all" if
-                all available feature extractors should be used
+            output_csv_path: The path of the feature matrix
+
+        Returns:
+            A dictionary containing the CSV fieldnames, the offset that the
+            CSV was last flushed at, the sets of completed and failed user
+            IDs, and the size of the checkpoint up to the end of its last
+            complete entry, or None if there is no checkpoint
         """
 
-        with open(output_csv_path, "w") as f:
-            writer = csv.DictWriter(
-                f,
-                fieldnames = ["user_id", "username"] + self.features
-            )
-            writer.writeheader()
-            for user_id in user_ids:
-                print("========== Querying tweets for user ID %d" % user_id)
+        checkpoint_path = "%s%s" % (output_csv_path, CHECKPOINT_SUFFIX)
+        if (not os.path.isfile(checkpoint_path)):
+            return None
 
-                data = self.collect_tweets(user_id)
-                username = data["user"]["screen_name"]
+        checkpoint = {
+            "fieldnames": None,
+            "offset": 0,
+            "done": set(),
+            "failed": set(),
+            "checkpoint_offset": 0
+        }
 
-                print("Collected %d tweets\n" % len(data["tweets"]))
+        with open(checkpoint_path, "rb") as f:
+            for line in f:
+                try:
+                    if (not line.endswith(b"\n")):
+                        raise ValueError("Incomplete entry")
+                    entry = json.loads(line)
+                except ValueError:
+                    # a partially written last line; the entry it described
+                    # was never completed
+                    break
+
+                if (entry["status"] == "started"):
+                    checkpoint["fieldnames"] = entry["fieldnames"]
+                elif (entry["status"] == "done"):
+                    checkpoint["done"].add(entry["user_id"])
+                    checkpoint["failed"].discard(entry["user_id"])
+                elif (entry["status"] == "failed"):
+                    checkpoint["failed"].add(entry["user_id"])
+                checkpoint["offset"] = entry["offset"]
+                checkpoint["checkpoint_offset"] += len(line)
+
+        return checkpoint
+
+    def gen_feature_matrix(self, user_ids, output_csv_path, resume = False,
+                           retry_failed = False, user_id_range = None,
+                           fence = None):
+        """ Create feature vectors from the given users
 
-                results = self.feature_extractor.extract_features(
-                    user = data["user"],
-                    tweets = data["tweets"],
-                    features = self.features
-                )
-                results.update({
-                    "user_id": user_id,
-                    "username": username
-                })
+        Progress is recorded in a checkpoint file next to the CSV, containing
+        one JSON line per user with its status and the size of the CSV after
+        its row was flushed to disk. When resuming, the CSV is truncated to the
+        last recorded size and the checkpoint to its last complete entry, so
+        that a row or entry that was only partially written before a crash is
+        discarded, and completed users are skipped.
 
-                writer.writerow(results)
+        If extracting a user's features fails, the user is marked as failed
+        in the checkpoint and the remaining users are still processed.
 
-                print(results)
-                print()
+        A KLL quantile sketch of every feature is updated as rows are written
+        and saved next to the CSV (see lib.sketch.FeatureSketches), so that
+        feature distributions can be plotted and compared without loading the
+        whole matrix. The time spent in each feature extractor is saved next
+        to the CSV too (see lib.metrics.extraction_costs).
 
-        print("Wrote feature vectors to %s" % output_csv_path)
+        If user_ids is None, every user in the collection (or in
+        user_id_range) is processed with a single scan of the collection; see
+        iter_collection_features.
+
+        Args:
+            user_ids: A list of Twitter user IDs, or None for every user
+            output_csv_path: The path that the feature vectors should be written to
+            resume: Whether or not to resume from an existing checkpoint
+            retry_failed: Whether or not users that failed in a previous run
+                should be retried when resuming
+            user_id_range: An optional range of user IDs returned by
+                split_user_ids to restrict a scan to
+            fence: An optional function that is called before every write to
+                the CSV or checkpoint, and raises an exception to stop before
+                the write, e.g. when a sharding worker lost its lease
+
+        Returns:
+            A list of the user IDs that failed
+        """
+
+        fieldnames = [
+            "user_id", "username", "sampling", "imputed", "error_bounds"
+        ] + self.features
+        checkpoint_path = "%s%s" % (output_csv_path, CHECKPOINT_SUFFIX)
+
+        checkpoint = None
+        if (resume):
+            checkpoint = self.read_checkpoint(output_csv_path)
+            if ((checkpoint is not None)
+                    and (checkpoint["fieldnames"] != fieldnames)):
+                raise Exception(
+                    "%s was generated with different features" % output_csv_path
+                )
+
+        failed = []
+        skip = set()
+        sketches = FeatureSketches(self.features)
+        metrics_before = self.feature_extractor.metrics.snapshot()
+
+        if (checkpoint):
+            # new entries must not be appended to a partially written one
+            with open(checkpoint_path, "r+b") as checkpoint_f:
+                checkpoint_f.truncate(checkpoint["checkpoint_offset"])
+
+        with open(checkpoint_path, "a" if checkpoint else "w") as checkpoint_f:
+
+            def mark(entry):
+                if (fence is not None):
+                    fence()
+                checkpoint_f.write("%s\n" % json.dumps(entry))
+                checkpoint_f.flush()
+                os.fsync(checkpoint_f.fileno())
+
+            if (checkpoint):
+                # drop a row that was partially written, or whose entry in
+                # the checkpoint was not
+                f = open(output_csv_path, "r+")
+                f.truncate(checkpoint["offset"])
+                f.seek(checkpoint["offset"])
+
+                # rebuild the sketches from the rows that were kept
+                f.seek(0)
+                for row in csv.DictReader(f):
+                    sketches.update(row)
+                f.seek(checkpoint["offset"])
+
+                skip = set(checkpoint["done"])
+                if (not retry_failed):
+                    skip |= checkpoint["failed"]
+                if (user_ids is not None):
+                    user_ids = [
+                        user_id for user_id in user_ids
+                        if (user_id not in skip)
+                    ]
+                logger.info("Resuming %s: skipping %d users",
+                            output_csv_path, len(skip))
+            else:
+                f = open(output_csv_path, "w")
+
+            with f:
+                writer = csv.DictWriter(f, fieldnames = fieldnames)
+                if (not checkpoint):
+                    writer.writeheader()
+                    f.flush()
+                    os.fsync(f.fileno())
+                    mark({
+                        "status": "started",
+                        "fieldnames": fieldnames,
+                        "offset": f.tell()
+                    })
+
+                if (user_ids is not None):
+                    users = self.iter_user_features(
+                        user_ids, isolate_failures = True
+                    )
+                else:
+                    # a scan is in user ID order, so users up to the last
+                    # one that was skipped do not need to be read again
+                    users = (
+                        (user_id, user, results)
+                        for (user_id, user, results)
+                        in self.iter_collection_features(
+                            user_id_range, isolate_failures = True,
+                            after = max(skip) if (
+                                skip and (not retry_failed)
+                            ) else None
+                        )
+                        if (user_id not in skip)
+                    )
+
+                for (user_id, user, results) in users:
+                    if (user is None):
+                        failed.append(user_id)
+                        mark({
+                            "status": "failed",
+                            "user_id": user_id,
+                            "error": repr(results),
+                            "offset": f.tell()
+                        })
+                        continue
+
+                    results.update({
+                        "user_id": user_id,
+                        "username": user.get("screen_name", "")
+                    })
+
+                    if (fence is not None):
+                        fence()
+                    writer.writerow(results)
+                    sketches.update(results)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    mark({
+                        "status": "done",
+                        "user_id": user_id,
+                        "offset": f.tell()
+                    })
+                    logger.debug("%s", results)
+
+        sketches.save(FeatureSketches.path_of(output_csv_path))
+        with open("%s%s" % (
+            output_csv_path, metrics.COSTS_SUFFIX
+        ), "w") as f:
+            json.dump(metrics.extraction_costs(
+                metrics_before, self.feature_extractor.metrics.snapshot()
+            ), f, indent = 4)
+
+        logger.info("Wrote feature vectors to %s", output_csv_path)
+        if (failed):
+            logger.warning("Failed to extract features for %d users: %s",
+                           len(failed), failed)
+
+        return failed
 
     def load_feature_vectors(self, csv_path):
         """ Load feature vectors from a CSV generated by extract_features
@@ -290,6 +1626,109 @@ class Classifier(object):
 
         self.classifier.fit(feature_vectors, class_labels)
 
+        self.forest = CompiledForest.from_sklearn(
+            self.classifier, self.features
+        )
+        assert self.forest.verify(self.classifier, feature_vectors), (
+               "Compiled forest predictions differ from the trained classifier")
+
+        if (self.cascade):
+            self.train_cascade(
+                feature_vectors, class_labels,
+                evaluate.feature_costs([spam_csv, ham_csv], self.features)
+            )
+
+    def train_cascade(self, feature_vectors, class_labels, costs):
+        """ Train the cheap stage of a cascaded classifier
+
+        Features whose cost is at most cascade_cheap_ms are cheap. A forest
+        trained on them decides users whose spam probability lies outside
+        cascade_band on its own; the other users are passed to the full
+        forest. The accuracy cost of this and the share of extraction time
+        that it skips are estimated with cross-validated predictions and
+        stored in cascade_stats.
+
+        Args:
+            feature_vectors: The training feature vectors of the full forest
+            class_labels: The "spam" or "ham" label of each feature vector
+            costs: A dictionary mapping features to their extraction time in
+                seconds per user, or None if unknown, as returned by
+                util.evaluate.feature_costs
+        """
+
+        self.cheap_features = [
+            feature for feature in self.features
+            if ((costs.get(feature) is not None)
+                and (costs[feature] * 1000 <= self.cascade_cheap_ms))
+        ]
+        if ((not self.cheap_features)
+                or (len(self.cheap_features) == len(self.features))):
+            logger.warning("No split into cheap and expensive features at "
+                           "%s ms per user; not cascading",
+                           self.cascade_cheap_ms)
+            self.cheap_features = []
+            self.cheap_forest = None
+            self.cascade_stats = None
+            return
+
+        X = numpy.array(feature_vectors, dtype = numpy.float64)
+        y = numpy.array(class_labels)
+        columns = [self.features.index(feature)
+                   for feature in self.cheap_features]
+
+        cheap = sklearn.base.clone(self.classifier)
+        cheap_probabilities = sklearn.model_selection.cross_val_predict(
+            cheap, X[:, columns], y, method = "predict_proba"
+        )
+        full_predictions = sklearn.model_selection.cross_val_predict(
+            sklearn.base.clone(self.classifier), X, y
+        )
+
+        classes = sorted(set(class_labels))
+        spam_probability = cheap_probabilities[:, classes.index("spam")]
+        (low, high) = self.cascade_band
+        confident = (spam_probability < low) | (spam_probability > high)
+        cascaded = numpy.where(
+            confident,
+            numpy.where(spam_probability > high, "spam", "ham"),
+            full_predictions
+        )
+
+        cheap_cost = sum(costs[feature] for feature in self.cheap_features)
+        expensive_cost = sum(
+            costs.get(feature) or 0.0
+            for feature in self.features
+            if (feature not in self.cheap_features)
+        )
+        self.cascade_stats = {
+            "cheap_features": self.cheap_features,
+            "band": list(self.cascade_band),
+            "costs": costs,
+            "early_exit_fraction": float(confident.mean()),
+            "full_accuracy": float((full_predictions == y).mean()),
+            "cascade_accuracy": float((cascaded == y).mean()),
+            "skipped_cost_fraction": (
+                float(confident.mean()) * expensive_cost
+                / (cheap_cost + expensive_cost)
+            ) if (cheap_cost + expensive_cost) else 0.0
+        }
+        logger.info(
+            "Cascade: %.1f%% of users exit after the cheap stage, skipping "
+            "%.1f%% of extraction time; cross-validated accuracy %.4f "
+            "(full forest %.4f)",
+            self.cascade_stats["early_exit_fraction"] * 100,
+            self.cascade_stats["skipped_cost_fraction"] * 100,
+            self.cascade_stats["cascade_accuracy"],
+            self.cascade_stats["full_accuracy"]
+        )
+
+        cheap.fit(X[:, columns], y)
+        self.cheap_forest = CompiledForest.from_sklearn(
+            cheap, self.cheap_features
+        )
+        assert self.cheap_forest.verify(cheap, X[:, columns]), (
+               "Compiled forest predictions differ from the trained classifier")
+
     def predict(self, user_ids):
         """ Classify users
 
@@ -305,49 +1744,157 @@ class Classifier(object):
             user_ids = [user_ids]
         user_ids = sorted(user_ids)
 
-        for user_id in user_ids:
-            data = self.collect_tweets(user_id)
-            feature_vectors.append(
-                    self.dict_to_feature_vector(
-                    self.feature_extractor.extract_features(
-                        user = data["user"],
-                        tweets = data["tweets"],
-                        features = self.features
-                    )
-                )
-            )
+        assert self.forest is not None, "The classifier has not been trained"
+
+        if (self.cheap_forest is not None):
+            return self.predict_cascaded(user_ids)
+
+        for (user_id, user, results) in self.iter_user_features(user_ids):
+            feature_vectors.append(self.dict_to_feature_vector(results))
 
         return dict(zip(
             user_ids,
-            self.classifier.predict(feature_vectors)
+            self.forest.predict(feature_vectors)
         ))
 
-    def save(self, output_file):
-        """ Save the current classifier as a pickle to a given path
+    def predict_cascaded(self, user_ids):
+        """ Classify users with the cheap forest where it is confident, and
+        with the full forest elsewhere
+
+        Only the cheap features are extracted for users that the cheap forest
+        decides. The number of those users and the estimated extraction time
+        that was skipped are stored in cascade_report.
+
+        Args:
+            user_ids: A sorted list of user IDs to classify
+
+        Returns:
+            A dict of classifications for those user IDs
+        """
+
+        cheap_results = {
+            user_id: results
+            for (user_id, user, results) in self.iter_user_features(
+                user_ids, features = self.cheap_features
+            )
+        }
+        probabilities = self.cheap_forest.predict_proba([
+            [float(cheap_results[user_id][feature])
+             for feature in self.cheap_features]
+            for user_id in user_ids
+        ])[:, self.cheap_forest.classes.index("spam")]
+
+        (low, high) = self.cascade_band
+        classifications = {}
+        uncertain = []
+        for (user_id, probability) in zip(user_ids, probabilities):
+            if (probability > high):
+                classifications[user_id] = "spam"
+            elif (probability < low):
+                classifications[user_id] = "ham"
+            else:
+                uncertain.append(user_id)
+
+        expensive = [
+            feature for feature in self.features
+            if (feature not in self.cheap_features)
+        ]
+        feature_vectors = []
+        for (user_id, user, results) in self.iter_user_features(
+            uncertain, features = expensive
+        ):
+            results.update(cheap_results[user_id])
+            feature_vectors.append(self.dict_to_feature_vector(results))
+        if (uncertain):
+            classifications.update(zip(
+                uncertain, self.forest.predict(feature_vectors)
+            ))
+
+        costs = (self.cascade_stats or {}).get("costs", {})
+        n_early = len(user_ids) - len(uncertain)
+        self.cascade_report = {
+            "users": len(user_ids),
+            "early_exits": n_early,
+            "skipped_seconds": n_early * sum(
+                costs.get(feature) or 0.0 for feature in expensive
+            )
+        }
+        logger.info("Cascade: %d/%d users decided by the cheap stage, "
+                    "skipping an estimated %.2fs of extraction",
+                    n_early, len(user_ids),
+                    self.cascade_report["skipped_seconds"])
+
+        return {user_id: classifications[user_id] for user_id in user_ids}
+
+    def save(self, output_dir):
+        """ Save the current classifier as a directory of flat node arrays
 
         Args:
-            output_file: The path to save the classifier to
+            output_dir: The directory to save the classifier to
         """
 
-        sklearn.externals.joblib.dump(self.classifier, output_file)
-        print("Saved classifier to %s" % output_file)
+        assert self.forest is not None, "The classifier has not been trained"
+
+        self.forest.save(output_dir)
+        cascade_dir = os.path.join(output_dir, CASCADE_DIR)
+        if (self.cheap_forest is not None):
+            self.cheap_forest.save(cascade_dir)
+            with open(os.path.join(cascade_dir, "cascade.json"), "w") as f:
+                json.dump(self.cascade_stats, f, indent = 4)
+        elif (os.path.isdir(cascade_dir)):
+            shutil.rmtree(cascade_dir)
+        logger.info("Saved classifier to %s", output_dir)
+
+    def load(self, input_dir, mmap = True):
+        """ Overwrite the current classifier with one saved by Classifier.save
 
-    def load(self, input_file):
-        """ Overwrite the current classifier with one saved as a pickle at the
-        given path
+        The node arrays are memory-mapped by default, so loading is close to
+        instant regardless of the size of the forest
 
         Args:
-            input_file: The path to load a new classifier from
+            input_dir: The directory to load a new classifier from
+            mmap: Whether or not the node arrays should be memory-mapped
         """
 
-        self.classifier = sklearn.externals.joblib.load(input_file)
-        print("Loaded classifier from %s" % input_file)
+        forest = CompiledForest.load(input_dir, mmap = mmap)
+        assert forest.features == self.features, (
+               "Classifier was trained on features %s, but %s are configured"
+               % (forest.features, self.features))
+
+        self.forest = forest
+
+        cascade_dir = os.path.join(input_dir, CASCADE_DIR)
+        if (self.cascade and os.path.isdir(cascade_dir)):
+            self.cheap_forest = CompiledForest.load(cascade_dir, mmap = mmap)
+            self.cheap_features = self.cheap_forest.features
+            with open(os.path.join(cascade_dir, "cascade.json"), "r") as f:
+                self.cascade_stats = json.load(f)
+        else:
+            self.cheap_forest = None
+            self.cheap_features = []
+
+        logger.info("Loaded classifier from %s", input_dir)
 
 
 if (__name__ == "__main__"):
+    import optparse
     import random
 
+    parser = optparse.OptionParser()
+
+    parser.add_option("--resume", dest = "resume", action = "store_true",
+                      default = False,
+                      help = "Resume feature extraction from the checkpoints "
+                             "of a previous run")
+    parser.add_option("--seed", dest = "seed", type = "int", default = 0,
+                      help = "Seed used to sample users; must be the same "
+                             "when resuming")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = "%(message)s")
+
     n_sample = 500
+    sampler = random.Random(options.seed)
 
     classifier = Classifier()
     config = config_loader.ConfigLoader().load()
@@ -361,33 +1908,40 @@ if (__name__ == "__main__"):
     with open("%s/%s" % (
         training_root, config["training"]["ham_geotagged"]
     )) as f:
-        hpam_ids = [int(id_) for id_ in f.readlines()]
+        ham_ids = [int(id_) for id_ in f.readlines()]
 
     classifier.connect("caverlee_2011", "spam")
     classifier.gen_feature_matrix(
-        random.sample(spam_ids, n_sample),
-        "spam.csv"
+        sampler.sample(spam_ids, n_sample),
+        "spam.csv",
+        resume = options.resume
     )
 
     classifier.connect("caverlee_2011", "ham")
     classifier.gen_feature_matrix(
-        random.sample(ham_ids, n_sample),
-        "ham.csv"
+        sampler.sample(ham_ids, n_sample),
+        "ham.csv",
+        resume = options.resume
     )
 
-    classifier.train("spam.csv", "ham.csv")
-    classifier.save("out.pkl")
+    # cross-validate on the matrices that were just written instead of
+    # extracting the features of more users; see util/evaluate.py for
+    # feature subset and n_estimators sweeps
+    (results, report) = evaluate.evaluate(
+        "spam.csv", "ham.csv",
+        n_estimators = [int(config["classifier"]["n_estimators"])],
+        seed = options.seed
+    )
+    print(report)
 
-    classifier.connect("caverlee_2011", "ham")
-    test_ids = random.sample(ham_ids, 100)
-    results = classifier.predict(user_ids)
-    print(results)
-    n_correct = sum([
-        1
-        for correct in filter(
-            lambda result: result == "ham",
-            results.values()
-        )
-    ])
-    n = len(results)
-    print("%d/%d correct => %f%%" % (n_correct, n, n_correct/n*100))
+    classifier.train("spam.csv", "ham.csv")
+    if (classifier.cascade_stats is not None):
+        print("cascade: %.1f%% of users decided by %s, skipping %.1f%% of "
+              "extraction time; accuracy %.4f (full forest %.4f)" % (
+                  classifier.cascade_stats["early_exit_fraction"] * 100,
+                  ",".join(classifier.cheap_features),
+                  classifier.cascade_stats["skipped_cost_fraction"] * 100,
+                  classifier.cascade_stats["cascade_accuracy"],
+                  classifier.cascade_stats["full_accuracy"]
+              ))
+    classifier.save("forest")
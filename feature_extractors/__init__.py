@@ -2,9 +2,20 @@
 # dynamically load feature extractors
 
 import importlib
+import logging
 import os
+from . import templates
 from .templates import FeatureExtractor
 
+# if this environment variable is set to 1 before the package is imported,
+# modules with missing dependencies are left out instead of failing the
+# import. This changes the features of "all", and with them the columns of
+# feature matrices, so it is only meant for tools like
+# benchmarks/bench_extractors.py that run whatever is available.
+SKIP_MISSING_ENV = "BOTDETECTOR_SKIP_MISSING_EXTRACTORS"
+
+logger = logging.getLogger(__name__)
+
 FEATURE_EXTRACTORS = {}
 
 for module_name in [
@@ -14,7 +25,16 @@ for module_name in [
         os.listdir(os.path.dirname(os.path.realpath(__file__)))
     )
 ]:
-    module = importlib.import_module(".%s" % module_name, "feature_extractors")
+    try:
+        module = importlib.import_module(
+            ".%s" % module_name, "feature_extractors"
+        )
+    except ImportError as error:
+        if (os.environ.get(SKIP_MISSING_ENV) != "1"):
+            raise
+        logger.warning("Skipping feature_extractors/%s.py: %s",
+                       module_name, error)
+        continue
 
     print("Searching for feature extractors in feature_extractors/%s.py"
           % module_name)
@@ -23,7 +43,7 @@ for module_name in [
         if (
             (type(attr) is type)
             and (issubclass(attr, FeatureExtractor))
-            and (attr is not FeatureExtractor)
+            and (attr.__module__ != templates.__name__)
         ):
             print("> Found %s" % name)
             FEATURE_EXTRACTORS[name] = attr
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Feature extractors that look for coordinated posting across accounts
+
+import os
+
+from .templates import FeatureExtractor
+from lib.minhash import LSHIndex, MinHasher
+from util import config_loader
+
+class CrossUserDuplicateProportion(FeatureExtractor):
+    """ Returns the proportion of a user's tweets that have near-duplicates
+    posted by other accounts
+
+    Near-duplicates are found with the MinHash LSH index built by
+    util/build_lsh_index.py, so each tweet takes a constant number of indexed
+    lookups regardless of the size of the corpus. """
+
+    def __init__(self):
+        config = config_loader.ConfigLoader().load()
+        feature_config = config["feature_extractors"]
+
+        index_path = feature_config["lsh_index"]
+        if (not os.path.isfile(index_path)):
+            raise Exception(
+                "%s does not exist; build it with util/build_lsh_index.py"
+                % index_path
+            )
+
+        self.index = LSHIndex(index_path, MinHasher(
+            int(feature_config["lsh_bands"]), int(feature_config["lsh_rows"])
+        ))
+
+    def run(self, user, tweets):
+        n_tweets = 0
+        n_duplicates = 0
+
+        for tweet in tweets:
+            if ("text" in tweet):
+                n_tweets += 1
+                if (self.index.has_other_users(user["id"], tweet["text"])):
+                    n_duplicates += 1
+
+        if (n_tweets == 0):
+            return 0
+        else:
+            return n_duplicates / n_tweets
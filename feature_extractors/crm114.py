@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # Feature extractor that uses the CRM114 classifier
 
-from .templates import FeatureExtractor
-from util import config_loader
+from .templates import PerTweetAverage
+from lib import text
+from util import config_loader, train_crm114
 
 import crm114 # From https://github.com/ercas/crm114-python
+import sys
 
 def prompt_yn(prompt):
     """ Persistent y/n prompt that only accepts yes or no
@@ -32,10 +34,13 @@ def prompt_yn(prompt):
             return prompt_yn(prompt)
 
 # Chu, Gianvecchio, & Wang
-class AverageCRM114(FeatureExtractor):
+class AverageCRM114(PerTweetAverage):
+
+    blocking = True
 
     def __init__(self):
-        config = config_loader.ConfigLoader().load()
+        loader = config_loader.ConfigLoader()
+        config = loader.load()
         crm114_dir = "%s/%s" % (
             config["training"]["root"], config["training"]["crm114"]
         )
@@ -45,32 +50,48 @@ class AverageCRM114(FeatureExtractor):
             response = prompt_yn("Train now using the caverlee-2011 dataset?")
             if (response):
                 assert train_crm114.train(crm114_dir), "Training failed"
-                self.config["setup"]["trained_crm114"] = "y"
-                with open(CONFIG_FILE, "w") as f:
-                    self.config.write(f)
+                config["setup"]["trained_crm114"] = "y"
+                with open(loader.CONFIG_FILE, "w") as f:
+                    config.write(f)
             else:
                 sys.exit(1)
         self.crm = crm114.Classifier(crm114_dir, ["spam", "ham"])
 
-    def run(self, user, tweets):
-        """ Returns the average CRM114 discriminator classification score
+        # scores of recently seen texts, so that retweets and copies of the
+        # same text are only classified once
+        self.scores = text.LRUCache("crm114", int(
+            config["feature_extractors"].get(
+                "text_cache_size", text.DEFAULT_CACHE_SIZE
+            )
+        ))
+
+    def value(self, tweet, shared):
+        """ Returns the CRM114 discriminator classification score of a tweet;
+        the feature is the average score of the user's tweets
 
         The crm114 module returns a tuple containing the category and a
         probability. For this test, there are only two categories - "spam", and
         "ham", a.k.a. not spam. For spam, the raw probability is used; for not
-        spam, the raw probability is multiplied by negative 1. """
+        spam, the raw probability is multiplied by negative 1.
 
-        scores = []
+        CRM114 tokenizes text itself, so scores are cached by the exact text
+        rather than the normalized text. """
 
-        for tweet in tweets:
-            result = self.crm.classify(tweet["text"])
-            if (result[0] == "ham"):
-                scores.append(-result[1])
-            else:
-                scores.append(result[1])
+        return self.scores.get(
+            text.text_key(tweet["text"]),
+            lambda: self.score(tweet["text"])
+        )
+
+    def score(self, tweet_text):
+        """ Classify a text with CRM114
+
+        Returns:
+            The probability that the text is spam, or the negated
+            probability that it is ham
+        """
 
-        n_scores = len(scores)
-        if (n_scores == 0):
-            return 0
+        result = self.crm.classify(tweet_text)
+        if (result[0] == "ham"):
+            return -result[1]
         else:
-            return sum(scores)/n_scores
+            return result[1]
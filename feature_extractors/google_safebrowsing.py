@@ -2,7 +2,8 @@
 # Feature extractor that interfaces with sbserver from
 # https://github.com/google/safebrowsing/
 
-from .templates import FeatureExtractor
+from .templates import FeatureExtractor, SharedIntermediates
+from lib import metrics
 from util import config_loader
 
 import atexit
@@ -122,6 +123,7 @@ class SafeBrowsing(object):
             url = http_url
 
         if (not url in self.bloom_cache):
+            metrics.registry.inc("safebrowsing_bloom_cache_misses_total")
 
             try:
                 response = requests.get(
@@ -161,7 +163,7 @@ class SafeBrowsing(object):
 
         # in cache
         else:
-            pass
+            metrics.registry.inc("safebrowsing_bloom_cache_hits_total")
 
         return url
 
@@ -207,13 +209,26 @@ class AverageSafeBrowsing(FeatureExtractor):
     def __init__(self):
         self.sbclient = SafeBrowsing()
 
+    streaming = True
+    fused = True
+    blocking = True
+
     def run(self, user, tweets):
+        state = self.start(user)
+        self.update(state, tweets)
+        return self.finish(state)
 
-        score = 0
+    def start(self, user):
+        return [0]
 
+    def update(self, state, tweets):
         for tweet in tweets:
-            for url in tweet["entities"]["urls"]:
-                if (self.sbclient.lookup(url["expanded_url"])):
-                    score += 1
+            self.accumulate(state, tweet, SharedIntermediates(tweet))
+
+    def accumulate(self, state, tweet, shared):
+        for url in shared.urls:
+            if (self.sbclient.lookup(url)):
+                state[0] += 1
 
-        return score
+    def finish(self, state):
+        return state[0]
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # Simple feature extractors that maintain no internal state
 
-from .templates import FeatureExtractor
-import dateutil.parser
+from .templates import FeatureExtractor, PerTweetAverage
+from lib.timeline import parse_created_at
 
 class Test(FeatureExtractor):
     """ For testing purposes: returns 1 """
@@ -17,30 +17,28 @@ class Invalid(FeatureExtractor):
 '''
 
 # Ferrara, Varol, Davis, Menczer, & Flammini
-class AverageRetweetsPerTweet(FeatureExtractor):
+class AverageRetweetsPerTweet(PerTweetAverage):
     """ Returns the average number of retweets per tweet """
-    def run(self, user, tweets):
-        total_retweets = 0
-        for tweet in tweets:
-            total_retweets += tweet["retweet_count"]
-        return total_retweets/len(tweets)
+    aggregation = {"value": {"$avg": "$retweet_count"}}
+    def value(self, tweet, shared):
+        return tweet["retweet_count"]
 
-class AverageHashtagsPerTweet(FeatureExtractor):
+class AverageHashtagsPerTweet(PerTweetAverage):
     """ Returns the average number of retweets per tweet """
-    def run(self, user, tweets):
-        total_hashtags = 0
-        for tweet in tweets:
-            total_hashtags += len(tweet["entities"]["hashtags"])
-        return total_hashtags/len(tweets)
+    aggregation = {"value": {"$avg": {
+        "$size": {"$ifNull": ["$entities.hashtags", []]}
+    }}}
+    def value(self, tweet, shared):
+        return len(tweet["entities"]["hashtags"])
 
 # Lee, Eoff, & Caverlee
-class AverageMentionsPerTweet(FeatureExtractor):
+class AverageMentionsPerTweet(PerTweetAverage):
     """ Returns the average number of users mentioned per tweet """
-    def run(self, user, tweets):
-        total_mentions = 0
-        for tweet in tweets:
-            total_mentions += len(tweet["entities"]["user_mentions"])
-        return total_mentions/len(tweets)
+    aggregation = {"value": {"$avg": {
+        "$size": {"$ifNull": ["$entities.user_mentions", []]}
+    }}}
+    def value(self, tweet, shared):
+        return len(tweet["entities"]["user_mentions"])
 
 # Chu, Gianvecchio, & Wang
 class FollowersToFriendsRatio(FeatureExtractor):
@@ -55,26 +53,36 @@ class FollowersToFriendsRatio(FeatureExtractor):
 
 class TweetCount(FeatureExtractor):
     """ Returns the number of tweets """
+    aggregation = {"value": {"$sum": 1}}
+    streaming = True
+    fused = True
     def run(self, user, tweets):
         return len(tweets)
+    def start(self, user):
+        return [0]
+    def update(self, state, tweets):
+        state[0] += len(tweets)
+    def accumulate(self, state, tweet, shared):
+        state[0] += 1
+    def finish(self, state):
+        return state[0]
 
 # Chu, Gianvecchio, & Wang
-class TweetsWithLinksProportion(FeatureExtractor):
+class TweetsWithLinksProportion(PerTweetAverage):
     """ Returns the proportion of tweets containing links """
-    def run(self, user, tweets):
-        num_tweets = len(tweets)
-        tweets_with_links = 0
-
-        for tweet in tweets:
-            if (len(tweet["entities"]["urls"]) > 0):
-                tweets_with_links += 1
-
-        return tweets_with_links / num_tweets
+    aggregation = {"value": {"$avg": {"$cond": [
+        {"$gt": [{"$size": {"$ifNull": ["$entities.urls", []]}}, 0]}, 1, 0
+    ]}}}
+    def value(self, tweet, shared):
+        return int(len(shared.urls) > 0)
 
 # Ferrara, Varol, Davis, Menczer, & Flammini
 class UsernameLength(FeatureExtractor):
-    """ Returns the length of the user's screen name """
+    """ Returns the length of the user's screen name; datasets that only
+    have the length, such as caverlee-2011, store it as screen_name_length """
     def run(self, user, tweets):
+        if ("screen_name_length" in user):
+            return user["screen_name_length"]
         return len(user["screen_name"])
 
 # Chu, Gianvecchio, & Wang
@@ -87,4 +95,4 @@ class UserIsVerified(FeatureExtractor):
 class UserJoinDate(FeatureExtractor):
     """ Returns the user's join date as a Unix timestamp """
     def run(self, user, tweets):
-        return int(dateutil.parser.parse(user["created_at"]))
+        return parse_created_at(user["created_at"])
@@ -1,9 +1,215 @@
 #!/usr/bin/env python3
 
+import functools
+
+from lib import timeline
+
+class SharedIntermediates(object):
+    """ Values derived from a tweet that several feature extractors use
+
+    The fused extraction engine creates one of these per tweet and passes it
+    to every accumulate call, so each value is computed at most once per
+    tweet, and only if a feature extractor asks for it.
+    """
+
+    def __init__(self, tweet):
+        self.tweet = tweet
+
+    @functools.cached_property
+    def source(self):
+        """ The domain of the client that posted the tweet, or None """
+
+        if ("source" not in self.tweet):
+            return None
+        # this is the same cleanup algorithm as what is used in
+        # util/gen_client_list.py
+        try:
+            return self.tweet["source"].split("\"")[1].split("/")[2]
+        except IndexError:
+            return None
+
+    @functools.cached_property
+    def urls(self):
+        """ The expanded URLs of the tweet """
+
+        return [url["expanded_url"] for url in self.tweet["entities"]["urls"]]
+
+    @functools.cached_property
+    def timestamp_ms(self):
+        """ The time of the tweet in milliseconds as an int, or None """
+
+        return timeline.tweet_ms(self.tweet)
+
+class UserIntermediates(object):
+    """ Values derived from a user's whole timeline that several feature
+    extractors use
+
+    extract_features creates one of these per user and passes it to the run
+    of every feature extractor that sets uses_intermediates, so each value is
+    computed at most once per user, and only if a feature extractor asks for
+    it.
+    """
+
+    def __init__(self, user, tweets):
+        self.user = user
+        self.tweets = tweets
+
+    @functools.cached_property
+    def timeline(self):
+        """ The lib.timeline.Timeline of the tweets """
+
+        return timeline.Timeline(self.tweets)
+
+class Estimate(float):
+    """ An approximate feature value with a bound on its error
+
+    Feature extractors may return one of these instead of a float. The value
+    is used as the feature, and the bound is recorded in the "error_bounds"
+    column of the feature matrix.
+
+    Attributes:
+        error_bound: The largest expected absolute error of the value at the
+            confidence the feature extractor was configured with
+    """
+
+    def __new__(cls, value, error_bound):
+        estimate = super().__new__(cls, value)
+        estimate.error_bound = error_bound
+        return estimate
+
+    def __reduce__(self):
+        return (Estimate, (float(self), self.error_bound))
+
 class FeatureExtractor(object):
 
+    # Optional MongoDB $group accumulators that compute this feature on the
+    # server, e.g. {"value": {"$avg": "$retweet_count"}}. When set, the
+    # classifier may merge these into a single aggregation per batch of users
+    # and call finalize on the result instead of calling run.
+    aggregation = None
+
+    # Feature extractors that set this to True implement start, update and
+    # finish, and can be fed a timeline in chunks instead of all at once
+    streaming = False
+
+    # Feature extractors that set this to True implement accumulate, and are
+    # fed one tweet at a time, along with its SharedIntermediates, in a
+    # single pass over the timeline that serves all of them. They must also
+    # set streaming, as start and finish are used to create and finalise the
+    # state.
+    fused = False
+
+    # Feature extractors that set this to True take the UserIntermediates of
+    # the user as a third argument to run. It defaults to None, for when they
+    # are run on their own.
+    uses_intermediates = False
+
+    # Feature extractors that set this to True may stall, e.g. on a network
+    # request or a subprocess. When a time limit is set, they are taken out
+    # of the single pass and out of streaming, and their run is bounded like
+    # that of any other feature extractor.
+    blocking = False
+
     def __init__(self):
         pass
 
     def run(self, user, tweets):
         return 1
+
+    def finalize(self, result):
+        """ Compute the feature from the result of the aggregation
+
+        Args:
+            result: A dictionary with the same keys as the aggregation
+                attribute, containing the values computed by MongoDB
+
+        Returns:
+            An integer or floating point
+        """
+
+        value = result["value"]
+        if (isinstance(value, int)):
+            return int(value)
+        return float(value)
+
+    def start(self, user):
+        """ Create the state of a streaming run
+
+        Args:
+            user: A dictionary of the twitter user
+
+        Returns:
+            An object that is passed to update and finish
+        """
+
+        raise NotImplementedError
+
+    def update(self, state, tweets):
+        """ Update the state of a streaming run with a chunk of tweets
+
+        Args:
+            state: The object returned by start
+            tweets: A list of tweet dictionaries
+        """
+
+        raise NotImplementedError
+
+    def accumulate(self, state, tweet, shared):
+        """ Update the state of a streaming run with a single tweet
+
+        Args:
+            state: The object returned by start
+            tweet: A tweet dictionary
+            shared: The SharedIntermediates of the tweet
+        """
+
+        raise NotImplementedError
+
+    def finish(self, state):
+        """ Compute the feature from the state of a streaming run
+
+        Args:
+            state: The object returned by start
+
+        Returns:
+            An integer or floating point
+        """
+
+        raise NotImplementedError
+
+class PerTweetAverage(FeatureExtractor):
+    """ Template for features that average a value over a user's tweets
+
+    Subclasses define value, which returns a number for a tweet given its
+    SharedIntermediates, or None if the tweet should not be counted. If no
+    tweets are counted, the feature is 0.
+    """
+
+    streaming = True
+    fused = True
+
+    def value(self, tweet, shared):
+        raise NotImplementedError
+
+    def run(self, user, tweets):
+        state = self.start(user)
+        self.update(state, tweets)
+        return self.finish(state)
+
+    def start(self, user):
+        return [0, 0] # [total, count]
+
+    def update(self, state, tweets):
+        for tweet in tweets:
+            self.accumulate(state, tweet, SharedIntermediates(tweet))
+
+    def accumulate(self, state, tweet, shared):
+        value = self.value(tweet, shared)
+        if (value is not None):
+            state[0] += value
+            state[1] += 1
+
+    def finish(self, state):
+        if (state[1] == 0):
+            return 0
+        return state[0] / state[1]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Feature extractors over the times of a user's tweets; they share the sorted
+# timestamps of the timeline (see lib/timeline.py and UserIntermediates in
+# templates.py), so each one costs little more than its own arithmetic
+
+import numpy
+
+from .templates import FeatureExtractor, UserIntermediates
+
+class MeanTweetInterval(FeatureExtractor):
+    """ Returns the mean number of seconds between consecutive tweets """
+    uses_intermediates = True
+
+    def run(self, user, tweets, intermediates = None):
+        intermediates = intermediates or UserIntermediates(user, tweets)
+        intervals = intermediates.timeline.intervals
+
+        if (len(intervals) == 0):
+            return 0
+
+        return float(intervals.mean())
+
+class TweetIntervalCV(FeatureExtractor):
+    """ Returns the coefficient of variation of the intervals between
+    consecutive tweets; automated accounts tend to post at regular intervals,
+    which gives a low value """
+    uses_intermediates = True
+
+    def run(self, user, tweets, intermediates = None):
+        intermediates = intermediates or UserIntermediates(user, tweets)
+        intervals = intermediates.timeline.intervals
+
+        if (len(intervals) == 0):
+            return 0
+
+        mean = intervals.mean()
+        if (mean == 0):
+            return 0
+
+        return float(intervals.std() / mean)
+
+class PostingHourEntropy(FeatureExtractor):
+    """ Returns the entropy, in bits, of the UTC hour of the day that tweets
+    were posted at """
+    uses_intermediates = True
+
+    def run(self, user, tweets, intermediates = None):
+        intermediates = intermediates or UserIntermediates(user, tweets)
+        hours = intermediates.timeline.hours
+
+        if (len(hours) == 0):
+            return 0
+
+        p = numpy.bincount(hours, minlength = 24) / len(hours)
+        p = p[p > 0]
+
+        # tweets that were all posted in the same hour give -0.0, which is
+        # clipped so that it is written out as 0.0
+        return max(0.0, float(-(p * numpy.log2(p)).sum()))
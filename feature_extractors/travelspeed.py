@@ -6,7 +6,7 @@ import math
 import otpmanager
 import route_distances
 
-from .templates import FeatureExtractor
+from .templates import FeatureExtractor, UserIntermediates
 from util import config_loader
 
 RADIUS_OF_EARTH = 6371000
@@ -51,8 +51,12 @@ class OTPTopSpeeds(FeatureExtractor):
             "localhost:%d" % self.manager.port
         )
 
-    def run(self, user, tweets):
+    uses_intermediates = True
+
+    def run(self, user, tweets, intermediates = None):
         travel_speeds = []
+        intermediates = intermediates or UserIntermediates(user, tweets)
+        times = intermediates.timeline.ms.tolist()
 
         for i in range(len(tweets) - 1):
             origin = tweets[i]["coordinates"]["coordinates"]
@@ -64,10 +68,7 @@ class OTPTopSpeeds(FeatureExtractor):
             )
 
             if (route):
-                travel_time = (
-                    int(tweets[i+1]["timestamp_ms"])
-                    - int(tweets[i]["timestamp_ms"])
-                ) / 1000
+                travel_time = (times[i + 1] - times[i]) / 1000
                 travel_speeds.append(route["distance"] / travel_time)
 
         if (len(travel_speeds) > 0):
@@ -86,18 +87,19 @@ class StraightLineTopSpeeds(FeatureExtractor):
         config = config_loader.ConfigLoader().load()
         self.top_n = int(config["feature_extractors"]["top_n_speeds"])
 
-    def run(self, user, tweets):
+    uses_intermediates = True
+
+    def run(self, user, tweets, intermediates = None):
 
         travel_speeds = []
+        intermediates = intermediates or UserIntermediates(user, tweets)
+        times = intermediates.timeline.ms.tolist()
 
         for i in range(len(tweets) - 1):
             origin = tweets[i]["coordinates"]["coordinates"]
             dest = tweets[i + 1]["coordinates"]["coordinates"]
 
-            travel_time = (
-                int(tweets[i+1]["timestamp_ms"])
-                - int(tweets[i]["timestamp_ms"])
-            ) / 1000
+            travel_time = (times[i + 1] - times[i]) / 1000
             travel_distance = law_of_cosines(
                 origin[0], origin[1], dest[0], dest[1]
             )
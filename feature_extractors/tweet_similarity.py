@@ -1,26 +1,111 @@
 #!/usr/bin/env python3
 
-from .templates import FeatureExtractor
-import sklearn.feature_extraction.text
+from .templates import Estimate, FeatureExtractor
+from lib import text
+from util import config_loader
+import math
+import numpy
 
 # Lee, Eoff, & Caverlee
 class AverageTweetContentSimilarity(FeatureExtractor):
-    """ Find the average cosine similarity of tweets """
+    """ Find the average cosine similarity of tweets
+
+    If feature_extractors.similarity_error is set, timelines with more than
+    similarity_exact_max tweets are estimated from a uniform random sample of
+    tweet pairs, and an Estimate with a Hoeffding bound on its error is
+    returned. """
+
+    def __init__(self):
+        config = config_loader.ConfigLoader().load()
+        feature_config = config["feature_extractors"]
+
+        self.error = float(feature_config.get("similarity_error", "0"))
+        self.confidence = float(
+            feature_config.get("similarity_confidence", "0.95")
+        )
+        self.exact_max = int(
+            feature_config.get("similarity_exact_max", "2000")
+        )
+        self.tokens = text.token_cache(int(
+            feature_config.get("text_cache_size", text.DEFAULT_CACHE_SIZE)
+        ))
+
+        # similarities are in [0, 1], so by Hoeffding's inequality the mean
+        # of this many sampled pairs is within error of the true mean with
+        # probability confidence
+        self.n_samples = math.ceil(
+            math.log(2 / (1 - self.confidence)) / (2 * self.error ** 2)
+        ) if self.error else None
+
     def run(self, user, tweets):
-        similarities = []
         len_ = len(tweets)
 
-        if (len_ == 1):
+        if (len_ < 2):
             return 0
 
-        else:
-            # https://stackoverflow.com/a/8897648
-            vectorizer = sklearn.feature_extraction.text.TfidfVectorizer()
-            tf_idf = vectorizer.fit_transform([tweet["text"] for tweet in tweets])
-            tf_idf_matrix = (tf_idf * tf_idf.T).toarray()
+        n_pairs = len_ * (len_ - 1) // 2
+        if ((self.n_samples is None) or (len_ <= self.exact_max)
+                or (self.n_samples >= n_pairs)):
+            return self.exact(tweets)
+
+        return self.sampled(tweets, numpy.random.default_rng(
+            [len_, user["id"] or 0]
+        ))
+
+    def exact(self, tweets):
+        """ Find the mean similarity of every pair of tweets
+
+        The rows of the TF-IDF matrix are L2-normalised, so the sum of the
+        similarities of all pairs is half of the squared norm of the sum of
+        the rows minus their own squared norms, which takes time linear in
+        the number of non-zero entries instead of the number of pairs. Each
+        distinct text is only vectorised once and weighted by its number of
+        copies.
+        """
+
+        len_ = len(tweets)
+        (tf_idf, inverse) = text.tf_idf(
+            [tweet["text"] for tweet in tweets], self.tokens
+        )
+        copies = numpy.bincount(inverse, minlength = tf_idf.shape[0])
+
+        total = tf_idf.T @ copies
+        norms = copies @ numpy.asarray(
+            tf_idf.multiply(tf_idf).sum(axis = 1)
+        ).ravel()
+        similarity = (float(total @ total) - float(norms)) / 2
+
+        return max(similarity, 0.0) / (len_ * (len_ - 1) / 2)
+
+    def sampled(self, tweets, rng):
+        """ Estimate the mean similarity from n_samples random pairs of
+        distinct tweets
+
+        Only the tweets in the sampled pairs are vectorised, so their inverse
+        document frequencies are estimated from the sample too; the error
+        bound covers the sampling of pairs.
+        """
+
+        len_ = len(tweets)
+        i = rng.integers(len_, size = self.n_samples)
+        j = rng.integers(len_ - 1, size = self.n_samples)
+        j += j >= i
+
+        (sampled, rows) = numpy.unique(
+            numpy.concatenate([i, j]), return_inverse = True
+        )
+        (tf_idf, inverse) = text.tf_idf(
+            [tweets[k]["text"] for k in sampled], self.tokens
+        )
+        rows = inverse[rows]
 
-            for i in range(len_ - 1):
-                for j in range(i + 1, len_):
-                    similarities.append(tf_idf_matrix[i][j])
+        similarities = numpy.asarray(tf_idf[rows[:self.n_samples]].multiply(
+            tf_idf[rows[self.n_samples:]]
+        ).sum(axis = 1)).ravel()
 
-            return float(sum(similarities) / len(similarities))
+        return Estimate(
+            float(similarities.mean()),
+            math.sqrt(
+                math.log(2 / (1 - self.confidence)) / (2 * self.n_samples)
+            )
+        )
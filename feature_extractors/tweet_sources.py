@@ -1,61 +1,75 @@
 #!/usr/bin/env python3
 # Feature extractor that checks Tweet sources against a manually-annotated list
 
-from .templates import FeatureExtractor
+from .templates import PerTweetAverage
+from lib.shared import StringTable, is_published
 from util import config_loader
 
 import csv
+import functools
+import os
+
+# scores of the annotated source categories; a client that is listed more
+# than once gets the lowest of its scores
+SCORES = {"-1": -1, "0": 0, "1": 1}
+
+# the number of distinct sources whose scores each process keeps in memory
+SCORE_CACHE_SIZE = 4096
 
 # Chu, Gianvecchio, & Wang
-class TweetSources(FeatureExtractor):
+class TweetSources(PerTweetAverage):
 
     def __init__(self):
         config = config_loader.ConfigLoader().load()
-        self.tweet_sources = {
-            "mostly_human": [],
-            "mixed": [],
-            "mostly_bot": []
-        }
-
-        with open("%s/%s" % (
+        csv_path = "%s/%s" % (
             config["training"]["root"], config["training"]["tweet_sources"]
-        ), "r") as f:
+        )
+
+        self.tweet_sources = self.attach_table(csv_path)
+        self.score = functools.lru_cache(maxsize = SCORE_CACHE_SIZE)(
+            self.tweet_sources.get
+        )
+
+    @staticmethod
+    def attach_table(csv_path):
+        """ Attach to the memory-mapped table of annotated sources, publishing
+        it next to the CSV first if it is missing or older than the CSV
+
+        Args:
+            csv_path: The path to the annotated sources CSV
+
+        Returns:
+            A lib.shared.StringTable mapping clients to their scores
+        """
+
+        table_dir = "%s.table" % csv_path
+        stat = os.stat(csv_path)
+        version = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+        if (is_published(table_dir)):
+            (table, metadata) = StringTable.attach(table_dir)
+            if (metadata == version):
+                return table
+
+        scores = {}
+        with open(csv_path, "r") as f:
             for row in csv.DictReader(f):
-                mostly_bot = row["MOSTLY_BOT"]
-                client = row["CLIENT"]
-                if (mostly_bot == "-1"):
-                    self.tweet_sources["mostly_human"].append(client)
-                elif (mostly_bot == "0"):
-                    self.tweet_sources["mixed"].append(client)
-                elif (mostly_bot == "1"):
-                    self.tweet_sources["mostly_bot"].append(client)
-
-    def run(self, user, tweets):
-        """ Returns the average score of the tweets' sources, where -1 means
-        that all tweets came from a mostly human source, 0 means that all
-        tweets came from a mixed human/bot source, and 1 means that all tweets
-        came from a mostly bot source """
-
-        scores = []
-
-        for tweet in tweets:
-            if ("source" in tweet):
-                # this is the same cleanup algorithm as what is used in
-                # util/gen_client_list.py
-                try:
-                    source = tweet["source"].split("\"")[1].split("/")[2]
-                except IndexError:
-                    continue
-
-                if (source in self.tweet_sources["mostly_human"]):
-                    scores.append(-1)
-                elif (source in self.tweet_sources["mixed"]):
-                    scores.append(0)
-                elif (source in self.tweet_sources["mostly_bot"]):
-                    scores.append(1)
-
-        n_scores = len(scores)
-        if (n_scores == 0):
-            return 0
-        else:
-            return sum(scores)/n_scores
+                if (row["MOSTLY_BOT"] in SCORES):
+                    score = SCORES[row["MOSTLY_BOT"]]
+                    scores[row["CLIENT"]] = min(
+                        score, scores.get(row["CLIENT"], score)
+                    )
+
+        StringTable.from_dict(scores).publish(table_dir, version)
+        return StringTable.attach(table_dir)[0]
+
+    def value(self, tweet, shared):
+        """ Returns the score of the tweet's source, where -1 means that the
+        tweet came from a mostly human source, 0 means that it came from a
+        mixed human/bot source, and 1 means that it came from a mostly bot
+        source. Tweets from unknown sources are not counted, so the feature is
+        the average score of the tweets' sources. """
+
+        if (shared.source is None):
+            return None
+        return self.score(shared.source)
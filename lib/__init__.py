@@ -1,5 +1,15 @@
 #!/usr/bin/env python3
 
+import operator
+import random
+
+import numpy
+
+# default memory ceiling of a block of pairs: two int64 index arrays plus one
+# float64 result per pair
+PAIR_BLOCK_BYTES = 64 * 1024 * 1024
+BYTES_PER_PAIR = 24
+
 def unique_pairs(list_):
     """ Given a list, return every unique combination of two of its items
 
@@ -39,6 +49,10 @@ class UniquePairsIterator(object):
         return self
 
     def __next__(self):
+        # lists with fewer than two items have no pairs
+        if (self._index >= self._len - 1):
+            raise StopIteration
+
         self._seek += 1
 
         if (self._seek == self._len):
@@ -50,6 +64,131 @@ class UniquePairsIterator(object):
 
         return (self._list[self._index], self._list[self._seek])
 
+def pair_index_blocks(n, max_bytes = PAIR_BLOCK_BYTES,
+                      bytes_per_pair = BYTES_PER_PAIR):
+    """ Generate the index pairs (i, j) with 0 <= i < j < n in blocks
+
+    Each block covers consecutive rows of the upper triangle of an n x n
+    matrix, so together the blocks are the same pairs as
+    numpy.triu_indices(n, 1), in the same order, but no block holds more
+    pairs than fit in max_bytes. A row with more pairs than that is split
+    into several blocks.
+
+    Args:
+        n: The number of items
+        max_bytes: The memory ceiling of a block
+        bytes_per_pair: The memory used per pair by the indices and whatever
+            the caller computes from them
+
+    Yields:
+        Tuples of two equal length int64 numpy arrays (i, j)
+    """
+
+    max_pairs = max(int(max_bytes // bytes_per_pair), 1)
+    row = 0
+
+    while (row < n - 1):
+        width = n - 1 - row
+
+        if (width >= max_pairs):
+            for start in range(row + 1, n, max_pairs):
+                j = numpy.arange(start, min(start + max_pairs, n),
+                                 dtype = numpy.int64)
+                yield (numpy.full(len(j), row, dtype = numpy.int64), j)
+            row += 1
+            continue
+
+        end = row
+        n_pairs = 0
+        while ((end < n - 1) and (n_pairs + (n - 1 - end) <= max_pairs)):
+            n_pairs += n - 1 - end
+            end += 1
+
+        rows = numpy.arange(row, end, dtype = numpy.int64)
+        counts = n - 1 - rows
+        i = numpy.repeat(rows, counts)
+        starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        j = numpy.arange(n_pairs, dtype = numpy.int64) - starts + i + 1
+        yield (i, j)
+
+        row = end
+
+def pairwise_reduce(n, function, reduce = operator.add, initial = 0,
+                    max_bytes = PAIR_BLOCK_BYTES,
+                    bytes_per_pair = BYTES_PER_PAIR):
+    """ Reduce a vectorised function over every unique pair of n items
+
+    Args:
+        n: The number of items
+        function: A function that takes the index arrays (i, j) of a block
+            from pair_index_blocks and returns a partial result
+        reduce: A function that combines two partial results
+        initial: The result if there are no pairs
+        max_bytes: Passed to pair_index_blocks
+        bytes_per_pair: Passed to pair_index_blocks
+
+    Returns:
+        The combined result of every block
+    """
+
+    result = initial
+    for (i, j) in pair_index_blocks(n, max_bytes, bytes_per_pair):
+        result = reduce(result, function(i, j))
+    return result
+
+class Reservoir(object):
+    """ Uniform random sample of fixed size from a stream of unknown length
+
+    Items are kept in the order in which they were added.
+    """
+
+    def __init__(self, size, seed = None):
+        """ Initializes Reservoir
+
+        Args:
+            size: The maximum number of items to keep
+            seed: An optional seed, so that samples can be reproduced
+        """
+
+        self.size = size
+        self.seen = 0
+        self._random = random.Random(seed)
+        self._items = []
+
+    def add(self, item):
+        if (len(self._items) < self.size):
+            self._items.append((self.seen, item))
+        else:
+            replace = self._random.randrange(self.seen + 1)
+            if (replace < self.size):
+                self._items[replace] = (self.seen, item)
+        self.seen += 1
+
+    def items(self):
+        """ Return the sampled items in the order in which they were added """
+
+        return [item for (index, item) in sorted(
+            self._items, key = lambda x: x[0]
+        )]
+
+def reservoir_sample(iterable, size, seed = None):
+    """ Draw a uniform random sample from an iterable in a single pass
+
+    Args:
+        iterable: The iterable to sample from
+        size: The maximum number of items to return
+        seed: An optional seed, so that samples can be reproduced
+
+    Returns:
+        A tuple containing a list of at most size items, in their original
+        order, and the total number of items that were seen
+    """
+
+    reservoir = Reservoir(size, seed)
+    for item in iterable:
+        reservoir.add(item)
+    return (reservoir.items(), reservoir.seen)
+
 def test():
     """ Run some checks to make sure the functions and classes are
     functioning properly """
@@ -63,6 +202,31 @@ def test():
                         (3, 4)
     ]
 
+    assert list(UniquePairsIterator([])) == []
+    assert list(UniquePairsIterator([1])) == []
+    assert list(UniquePairsIterator([1, 2])) == [(1, 2)]
+
+    for n in (0, 1, 2, 7, 50):
+        (triu_i, triu_j) = numpy.triu_indices(n, 1)
+        for max_pairs in (1, 3, 10, 10000):
+            blocks = list(pair_index_blocks(n, max_pairs * BYTES_PER_PAIR))
+            assert all(len(i) <= max_pairs for (i, j) in blocks)
+            if (blocks):
+                assert (numpy.concatenate([i for (i, j) in blocks])
+                        == triu_i).all()
+                assert (numpy.concatenate([j for (i, j) in blocks])
+                        == triu_j).all()
+            else:
+                assert len(triu_i) == 0
+    assert pairwise_reduce(
+        50, lambda i, j: int((i * j).sum()), max_bytes = 100
+    ) == int((triu_i * triu_j).sum())
+
+    (sample, seen) = reservoir_sample(range(1000), 10, seed = 1)
+    assert seen == 1000 and len(sample) == 10 and sample == sorted(sample)
+    assert sample == reservoir_sample(range(1000), 10, seed = 1)[0]
+    assert reservoir_sample(range(5), 10) == (list(range(5)), 5)
+
 if (__name__ == "__main__"):
     test()
     print("All tests OK")
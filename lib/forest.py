@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# flat, array-backed random forest inference
+
+import numpy
+
+from lib import shared
+
+# node arrays that make up a compiled forest; each is stored as its own .npy
+# file so that it can be memory-mapped on load (see lib/shared.py)
+NODE_ARRAYS = ["feature", "threshold", "left", "right", "value"]
+
+METADATA_FILE = "forest.json"
+
+LEAF = -1
+
+class CompiledForest(object):
+    """ A random forest flattened into NumPy node arrays
+
+    Every node of every tree is stored in a single set of arrays, with child
+    indices pointing into the same arrays. Leaf nodes have a feature of -1 and
+    point to themselves, which lets every sample be walked down every tree at
+    the same time until all of them have reached a leaf.
+
+    Attributes:
+        feature: int32 array of the feature each node splits on, or -1 for
+            leaves
+        threshold: float64 array of split thresholds
+        left: int32 array of the left child of each node
+        right: int32 array of the right child of each node
+        value: float64 array of shape (n_nodes, n_classes) containing the
+            class probabilities of each node
+        roots: int32 array of the index of the root node of each tree
+        classes: A list of class labels
+        features: A list of feature names, in the order of the feature vector
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes,
+                 features = None):
+        """ Initializes CompiledForest
+
+        Args:
+            feature, threshold, left, right, value: Node arrays
+            roots: The root node index of each tree
+            classes: A list of class labels
+            features: An optional list of feature names
+        """
+
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = numpy.asarray(roots, dtype = numpy.int32)
+        self.classes = list(classes)
+        self.features = features
+
+    @classmethod
+    def from_sklearn(cls, forest, features = None):
+        """ Compile a trained sklearn.ensemble.RandomForestClassifier
+
+        Args:
+            forest: A fitted RandomForestClassifier
+            features: An optional list of feature names
+
+        Returns:
+            A CompiledForest object
+        """
+
+        feature = []
+        threshold = []
+        left = []
+        right = []
+        value = []
+        roots = []
+        offset = 0
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            is_leaf = tree.children_left == LEAF
+            node_ids = numpy.arange(n_nodes) + offset
+
+            # leaves point back to themselves
+            left.append(numpy.where(
+                is_leaf, node_ids, tree.children_left + offset
+            ))
+            right.append(numpy.where(
+                is_leaf, node_ids, tree.children_right + offset
+            ))
+            feature.append(numpy.where(is_leaf, LEAF, tree.feature))
+            threshold.append(tree.threshold)
+
+            # sklearn averages the normalized class distribution of each tree
+            values = tree.value[:, 0, :].astype(numpy.float64)
+            totals = values.sum(axis = 1, keepdims = True)
+            totals[totals == 0] = 1
+            value.append(values / totals)
+
+            roots.append(offset)
+            offset += n_nodes
+
+        return cls(
+            numpy.concatenate(feature).astype(numpy.int32),
+            numpy.concatenate(threshold).astype(numpy.float64),
+            numpy.concatenate(left).astype(numpy.int32),
+            numpy.concatenate(right).astype(numpy.int32),
+            numpy.concatenate(value),
+            roots,
+            forest.classes_.tolist(),
+            features
+        )
+
+    def apply(self, feature_vectors):
+        """ Find the leaf that each sample falls into in each tree
+
+        Args:
+            feature_vectors: A list or array of feature vectors
+
+        Returns:
+            An int array of shape (n_samples, n_trees) of leaf node indices
+        """
+
+        # sklearn compares features as float32 against float64 thresholds;
+        # doing the same keeps predictions identical on boundary values
+        X = numpy.asarray(feature_vectors, dtype = numpy.float32)
+        if (X.ndim == 1):
+            X = X.reshape(1, -1)
+
+        n_samples = X.shape[0]
+        nodes = numpy.tile(self.roots, (n_samples, 1))
+        rows = numpy.arange(n_samples)[:, numpy.newaxis]
+
+        while True:
+            node_features = self.feature[nodes]
+            active = node_features != LEAF
+            if (not active.any()):
+                break
+
+            values = X[rows, numpy.where(active, node_features, 0)]
+            go_left = values <= self.threshold[nodes]
+            nodes = numpy.where(
+                go_left, self.left[nodes], self.right[nodes]
+            )
+
+        return nodes
+
+    def predict_proba(self, feature_vectors):
+        """ Compute class probabilities
+
+        Args:
+            feature_vectors: A list or array of feature vectors
+
+        Returns:
+            An array of shape (n_samples, n_classes)
+        """
+
+        return self.value[self.apply(feature_vectors)].mean(axis = 1)
+
+    def predict(self, feature_vectors):
+        """ Classify feature vectors
+
+        Args:
+            feature_vectors: A list or array of feature vectors
+
+        Returns:
+            A list of class labels
+        """
+
+        return [
+            self.classes[i]
+            for i in self.predict_proba(feature_vectors).argmax(axis = 1)
+        ]
+
+    def verify(self, forest, feature_vectors):
+        """ Check that this forest gives the same predictions as the sklearn
+        forest that it was compiled from
+
+        Args:
+            forest: The original RandomForestClassifier
+            feature_vectors: The feature vectors to compare predictions on
+
+        Returns:
+            True if all predictions match, False otherwise
+        """
+
+        if (len(feature_vectors) == 0):
+            return True
+
+        return (
+            self.predict(feature_vectors)
+            == forest.predict(feature_vectors).tolist()
+        )
+
+    def save(self, output_dir):
+        """ Save the forest as a directory of .npy files
+
+        Args:
+            output_dir: The directory to save the forest to
+        """
+
+        shared.publish(output_dir, {
+            name: getattr(self, name) for name in NODE_ARRAYS + ["roots"]
+        }, {
+            "classes": self.classes,
+            "features": self.features
+        }, METADATA_FILE)
+
+    @classmethod
+    def load(cls, input_dir, mmap = True):
+        """ Load a forest saved with CompiledForest.save
+
+        Args:
+            input_dir: The directory the forest was saved to
+            mmap: Whether or not the node arrays should be memory-mapped
+                instead of being read into memory
+
+        Returns:
+            A CompiledForest object
+        """
+
+        (arrays, metadata) = shared.attach(
+            input_dir, NODE_ARRAYS + ["roots"], mmap, METADATA_FILE
+        )
+
+        return cls(
+            classes = metadata["classes"],
+            features = metadata["features"],
+            **arrays
+        )
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# in-process counters and histograms with a Prometheus-style text dump
+
+import bisect
+import threading
+
+# default histogram buckets, in seconds
+DEFAULT_BUCKETS = [
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60
+]
+
+def _label_string(labels):
+    """ Format a tuple of (key, value) label pairs Prometheus-style """
+
+    if (not labels):
+        return ""
+    return "{%s}" % ",".join(
+        "%s=\"%s\"" % (key, str(value).replace("\"", "\\\""))
+        for (key, value) in labels
+    )
+
+class Histogram(object):
+    """ A cumulative histogram with fixed bucket upper bounds """
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if (index < len(self.counts)):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = []
+        running = 0
+        for count in self.counts:
+            running += count
+            cumulative.append(running)
+
+        return {
+            "buckets": dict(zip(self.buckets, cumulative)),
+            "count": self.count,
+            "sum": self.sum
+        }
+
+class Registry(object):
+    """ A thread-safe collection of named counters and histograms
+
+    Metrics are identified by a name and an optional dictionary of labels,
+    e.g. registry.inc("extractor_calls_total", extractor = "TweetCount")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount = 1, **labels):
+        """ Increment a counter
+
+        Args:
+            name: The name of the counter
+            amount: The amount to increment the counter by
+            labels: Labels identifying the counter
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets = DEFAULT_BUCKETS, **labels):
+        """ Record a value in a histogram
+
+        Args:
+            name: The name of the histogram
+            value: The value to record
+            buckets: The bucket upper bounds, used if the histogram does not
+                exist yet
+            labels: Labels identifying the histogram
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if (key not in self._histograms):
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def get(self, name, **labels):
+        """ Return the value of a counter, or 0 if it does not exist """
+
+        with self._lock:
+            return self._counters.get(
+                (name, tuple(sorted(labels.items()))), 0
+            )
+
+    def snapshot(self):
+        """ Return a copy of all metrics
+
+        Returns:
+            A dictionary with "counters" and "histograms" lists, where each
+            item contains the metric's name, labels and value(s)
+        """
+
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for ((name, labels), value) in sorted(
+                        self._counters.items()
+                    )
+                ],
+                "histograms": [
+                    dict(
+                        {"name": name, "labels": dict(labels)},
+                        **histogram.snapshot()
+                    )
+                    for ((name, labels), histogram) in sorted(
+                        self._histograms.items(), key = lambda x: x[0]
+                    )
+                ]
+            }
+
+    def reset(self):
+        """ Remove all metrics """
+
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self):
+        """ Dump all metrics in the Prometheus text exposition format
+
+        Returns:
+            A string
+        """
+
+        lines = []
+        snapshot = self.snapshot()
+
+        seen = set()
+        for counter in snapshot["counters"]:
+            if (counter["name"] not in seen):
+                lines.append("# TYPE %s counter" % counter["name"])
+                seen.add(counter["name"])
+            lines.append("%s%s %s" % (
+                counter["name"],
+                _label_string(sorted(counter["labels"].items())),
+                counter["value"]
+            ))
+
+        for histogram in snapshot["histograms"]:
+            name = histogram["name"]
+            labels = sorted(histogram["labels"].items())
+            if (name not in seen):
+                lines.append("# TYPE %s histogram" % name)
+                seen.add(name)
+            for (bound, count) in histogram["buckets"].items():
+                lines.append("%s_bucket%s %d" % (
+                    name, _label_string(labels + [("le", bound)]), count
+                ))
+            lines.append("%s_bucket%s %d" % (
+                name, _label_string(labels + [("le", "+Inf")]),
+                histogram["count"]
+            ))
+            lines.append("%s_sum%s %s" % (
+                name, _label_string(labels), histogram["sum"]
+            ))
+            lines.append("%s_count%s %d" % (
+                name, _label_string(labels), histogram["count"]
+            ))
+
+        return "\n".join(lines) + "\n"
+
+# suffix of the extraction_costs summary that gen_feature_matrix writes next to
+# a feature matrix
+COSTS_SUFFIX = ".costs.json"
+
+def _histogram_totals(snapshot, name):
+    """ Return the (count, sum) of the histograms with a name in a snapshot,
+    keyed by their extractor label """
+
+    return {
+        histogram["labels"].get("extractor"): (
+            histogram["count"], histogram["sum"]
+        )
+        for histogram in snapshot["histograms"]
+        if (histogram["name"] == name)
+    }
+
+def _counter_total(snapshot, name):
+    """ Return the total of the counters with a name in a snapshot """
+
+    return sum(
+        counter["value"]
+        for counter in snapshot["counters"]
+        if (counter["name"] == name)
+    )
+
+def extraction_costs(before, after):
+    """ Compute the cost of the feature extraction between two snapshots
+
+    Args:
+        before: A snapshot returned by Registry.snapshot
+        after: A later snapshot of the same registry
+
+    Returns:
+        A dictionary with an "extractors" dictionary mapping each feature
+        extractor that ran in between to its number of calls and total wall
+        and CPU seconds, and a "pushdown" dictionary with the number of
+        aggregations, the number of users they covered and their total wall
+        seconds
+    """
+
+    costs = {"extractors": {}}
+
+    for (name, key) in (("extractor_wall_seconds", "wall_seconds"),
+                        ("extractor_cpu_seconds", "cpu_seconds")):
+        start = _histogram_totals(before, name)
+        for (extractor, (count, sum_)) in _histogram_totals(
+            after, name
+        ).items():
+            (start_count, start_sum) = start.get(extractor, (0, 0.0))
+            if (count > start_count):
+                entry = costs["extractors"].setdefault(extractor, {})
+                entry["calls"] = count - start_count
+                entry[key] = sum_ - start_sum
+
+    (start_count, start_sum) = _histogram_totals(
+        before, "pushdown_wall_seconds"
+    ).get(None, (0, 0.0))
+    (count, sum_) = _histogram_totals(
+        after, "pushdown_wall_seconds"
+    ).get(None, (0, 0.0))
+    costs["pushdown"] = {
+        "calls": count - start_count,
+        "users": (_counter_total(after, "pushdown_users_total")
+                  - _counter_total(before, "pushdown_users_total")),
+        "wall_seconds": sum_ - start_sum
+    }
+
+    return costs
+
+# default registry shared by the feature extraction pipeline
+registry = Registry()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# MinHash signatures of tweet text and an on-disk LSH index of their bands
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy
+
+SHINGLE_SIZE = 5
+
+# signature length = BANDS * ROWS; two texts with Jaccard similarity s share
+# at least one band with probability 1 - (1 - s^ROWS)^BANDS, which for 16 x 8
+# crosses 50% at a similarity of about 0.7
+BANDS = 16
+ROWS = 8
+
+SEED = 2011
+
+URL_PATTERN = re.compile(r"https?://\S+")
+NON_WORD_PATTERN = re.compile(r"\W+")
+
+def normalize(text):
+    """ Normalize tweet text so that trivial variations (case, links,
+    punctuation) do not affect its shingles
+
+    Args:
+        text: A string
+
+    Returns:
+        A normalized string
+    """
+
+    text = URL_PATTERN.sub(" ", text.lower())
+    return NON_WORD_PATTERN.sub(" ", text).strip()
+
+def shingles(text, size = SHINGLE_SIZE):
+    """ Hash the character shingles of a normalized text
+
+    Args:
+        text: A normalized string
+        size: The number of characters per shingle
+
+    Returns:
+        A uint64 array of unique 32-bit shingle hashes; texts shorter than a
+        single shingle are hashed as a whole, and empty texts have no shingles
+    """
+
+    if (len(text) == 0):
+        return numpy.zeros(0, dtype = numpy.uint64)
+
+    encoded = text.encode("utf-8")
+    return numpy.unique(numpy.fromiter(
+        (
+            zlib.crc32(encoded[i:i + size])
+            for i in range(max(len(encoded) - size + 1, 1))
+        ),
+        dtype = numpy.uint64
+    ))
+
+class MinHasher(object):
+    """ Computes MinHash signatures using multiply-shift hashing
+
+    Attributes:
+        bands: The number of LSH bands
+        rows: The number of signature values per band
+    """
+
+    def __init__(self, bands = BANDS, rows = ROWS, seed = SEED):
+        """ Initializes MinHasher
+
+        Args:
+            bands, rows: See class attributes
+            seed: The seed used to draw the hash functions; indexes can only be
+                queried with signatures made with the same seed
+        """
+
+        self.bands = bands
+        self.rows = rows
+
+        random = numpy.random.RandomState(seed)
+        n = bands * rows
+        # multiply-shift hashing needs odd multipliers
+        self._a = random.randint(
+            0, 2 ** 63, size = n, dtype = numpy.uint64
+        ) * numpy.uint64(2) + numpy.uint64(1)
+        self._b = random.randint(0, 2 ** 63, size = n, dtype = numpy.uint64)
+
+    def signature(self, text):
+        """ Compute the MinHash signature of a text
+
+        Args:
+            text: A string
+
+        Returns:
+            A uint32 array of length bands * rows, or None if the text has no
+            shingles
+        """
+
+        hashes = shingles(normalize(text))
+        if (len(hashes) == 0):
+            return None
+
+        with numpy.errstate(over = "ignore"):
+            permuted = (
+                hashes[:, numpy.newaxis] * self._a + self._b
+            ) >> numpy.uint64(32)
+
+        return permuted.min(axis = 0).astype(numpy.uint32)
+
+    def band_keys(self, signature):
+        """ Hash each band of a signature into a bucket key
+
+        Args:
+            signature: An array generated by MinHasher.signature
+
+        Returns:
+            A list of signed 64-bit integers, one per band
+        """
+
+        keys = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(
+                signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                digest_size = 8,
+                salt = band.to_bytes(2, "little")
+            ).digest()
+            keys.append(int.from_bytes(digest, "little", signed = True))
+        return keys
+
+class LSHIndex(object):
+    """ An on-disk LSH index that records which users posted text falling into
+    each bucket
+
+    Only up to two distinct users are kept per bucket, which is all that is
+    needed to tell whether a bucket contains text from more than one account.
+    Buckets are stored in an SQLite table keyed by bucket, so lookups take
+    logarithmic time in the number of buckets.
+
+    The index can be used from several threads; queries are serialised on a
+    single connection. SQLite connections must not be used across a fork, so
+    a forked process opens its own connection to the same file, and an
+    in-memory index appears empty there.
+    """
+
+    def __init__(self, path, hasher = None):
+        """ Initializes LSHIndex
+
+        Args:
+            path: The path of the SQLite database
+            hasher: The MinHasher to use; defaults to MinHasher()
+        """
+
+        self.path = path
+        self.hasher = hasher or MinHasher()
+        self._pid = None
+        self._db = None
+        self._lock = None
+        self._connection()
+
+    def _connection(self):
+        """ Get the connection of this process, opening it in a process that
+        was forked since it was last used
+
+        Returns:
+            A tuple containing the sqlite3.Connection and the lock that
+            guards it
+        """
+
+        if (self._pid != os.getpid()):
+            # a forked child must not touch the parent's connection, nor wait
+            # on a lock that another thread of the parent may have held
+            self._lock = threading.Lock()
+            self._db = sqlite3.connect(self.path, check_same_thread = False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key INTEGER PRIMARY KEY, user_a INTEGER NOT NULL, "
+                "user_b INTEGER"
+                ") WITHOUT ROWID"
+            )
+            self._pid = os.getpid()
+        return (self._db, self._lock)
+
+    def add(self, items):
+        """ Add tweets to the index
+
+        Args:
+            items: An iterable of (user_id, text) tuples
+        """
+
+        rows = []
+        for (user_id, text) in items:
+            signature = self.hasher.signature(text)
+            if (signature is not None):
+                rows.extend(
+                    (key, user_id) for key in self.hasher.band_keys(signature)
+                )
+
+        (db, lock) = self._connection()
+        with lock, db:
+            db.executemany(
+                "INSERT INTO buckets (key, user_a) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET user_b = excluded.user_a "
+                "WHERE user_b IS NULL AND user_a != excluded.user_a",
+                rows
+            )
+
+    def has_other_users(self, user_id, text):
+        """ Check if a text is a near-duplicate of text posted by another user
+
+        Args:
+            user_id: The ID of the user who posted the text
+            text: A string
+
+        Returns:
+            True if any of the text's buckets contains another user
+        """
+
+        signature = self.hasher.signature(text)
+        if (signature is None):
+            return False
+
+        (db, lock) = self._connection()
+        for key in self.hasher.band_keys(signature):
+            with lock:
+                row = db.execute(
+                    "SELECT user_a, user_b FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+            if ((row is not None)
+                    and ((row[0] != user_id) or (row[1] is not None))):
+                return True
+
+        return False
+
+    def close(self):
+        if (self._pid == os.getpid()):
+            with self._lock:
+                self._db.close()
+        self._pid = None
+
+def test():
+    """ Run some checks to make sure the index finds near-duplicates """
+
+    hasher = MinHasher()
+    a = hasher.signature("Win a FREE iPhone now!!! click http://bit.ly/abc")
+    b = hasher.signature("win a free iphone now click http://bit.ly/xyz")
+    c = hasher.signature("Heading to the beach with my family today")
+    assert (a == b).all()
+    assert (a == c).mean() < 0.2
+    assert hasher.signature("!!!") is None
+
+    index = LSHIndex(":memory:", hasher)
+    index.add([
+        (1, "Win a FREE iPhone now!!! click http://bit.ly/abc"),
+        (1, "Heading to the beach with my family today"),
+        (2, "win a free iphone now click http://bit.ly/xyz")
+    ])
+    assert index.has_other_users(1, "Win a FREE iPhone now!!!")
+    assert index.has_other_users(2, "win a free iphone now")
+    beach = "Heading to the beach with my family today"
+    assert not index.has_other_users(1, beach)
+    assert index.has_other_users(3, beach)
+
+    # from another thread, as when feature extractors run under a timeout
+    found = []
+    worker = threading.Thread(
+        target = lambda: found.append(index.has_other_users(3, beach))
+    )
+    worker.start()
+    worker.join()
+    assert found == [True]
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# compact, read-only tweet and user records
+
+import sys
+
+# the only fields that feature extractors read; used to project MongoDB queries
+# so that the rest of each document never leaves the server
+TWEET_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "text": 1,
+    "source": 1,
+    "retweet_count": 1,
+    "timestamp_ms": 1,
+    "created_at": 1,
+    "coordinates.coordinates": 1,
+    "entities.urls.expanded_url": 1,
+    "entities.hashtags.text": 1,
+    "entities.user_mentions.id": 1,
+    "user.id": 1,
+    "user.screen_name": 1,
+    "user.screen_name_length": 1,
+    "user.followers_count": 1,
+    "user.friends_count": 1,
+    "user.verified": 1,
+    "user.created_at": 1
+}
+
+class CountOnly(object):
+    """ Stands in for a list of entities of which only the length was kept """
+
+    __slots__ = ["_len"]
+
+    def __init__(self, len_):
+        self._len = len_
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        raise TypeError(
+            "Only the number of these entities is kept in compact records"
+        )
+
+    def __repr__(self):
+        return "CountOnly(%d)" % self._len
+
+class Record(object):
+    """ Base class for records that support read-only dict-style access
+
+    Fields set to None are treated as missing, so that `"source" in tweet`
+    behaves like it does on the original pymongo dictionaries.
+    """
+
+    __slots__ = []
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+        if (value is None):
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def get(self, key, default = None):
+        value = getattr(self, key, None)
+        if (value is None):
+            return default
+        return value
+
+    def keys(self):
+        return [key for key in self.FIELDS if (key in self)]
+
+    def to_dict(self):
+        """ Convert the record back into a plain dictionary """
+
+        return {key: self[key] for key in self.keys()}
+
+class User(Record):
+    """ The user fields that feature extractors use """
+
+    FIELDS = [
+        "id", "screen_name", "screen_name_length", "followers_count",
+        "friends_count", "verified", "created_at"
+    ]
+    __slots__ = FIELDS
+
+    def __init__(self, doc):
+        """ Initializes User
+
+        Args:
+            doc: A Twitter API user dictionary
+        """
+
+        for field in self.FIELDS:
+            setattr(self, field, doc.get(field))
+
+class Tweet(Record):
+    """ The tweet fields that feature extractors use
+
+    Only the URLs of the entities are kept; hashtags and mentions are reduced
+    to counts, and the "entities" and "coordinates" dictionaries are rebuilt
+    on access.
+    """
+
+    FIELDS = [
+        "id", "text", "source", "retweet_count", "timestamp_ms", "created_at",
+        "coordinates", "entities"
+    ]
+    __slots__ = [
+        "id", "text", "source", "retweet_count", "timestamp_ms", "created_at",
+        "_coordinates", "_urls", "_n_hashtags", "_n_mentions"
+    ]
+
+    def __init__(self, doc):
+        """ Initializes Tweet
+
+        Args:
+            doc: A Twitter API tweet dictionary
+        """
+
+        self.id = doc.get("id")
+        self.text = doc.get("text")
+        self.retweet_count = doc.get("retweet_count")
+        self.created_at = doc.get("created_at")
+
+        source = doc.get("source")
+        self.source = sys.intern(source) if (type(source) is str) else source
+
+        timestamp_ms = doc.get("timestamp_ms")
+        self.timestamp_ms = (
+            None if (timestamp_ms is None) else int(timestamp_ms)
+        )
+
+        coordinates = doc.get("coordinates")
+        if (coordinates and coordinates.get("coordinates")):
+            self._coordinates = tuple(coordinates["coordinates"])
+        else:
+            self._coordinates = None
+
+        entities = doc.get("entities") or {}
+        self._urls = tuple(
+            url.get("expanded_url")
+            for url in entities.get("urls", [])
+        )
+        self._n_hashtags = len(entities.get("hashtags", []))
+        self._n_mentions = len(entities.get("user_mentions", []))
+
+    @property
+    def coordinates(self):
+        if (self._coordinates is None):
+            return None
+        return {"type": "Point", "coordinates": list(self._coordinates)}
+
+    @property
+    def entities(self):
+        return {
+            "urls": [{"expanded_url": url} for url in self._urls],
+            "hashtags": CountOnly(self._n_hashtags),
+            "user_mentions": CountOnly(self._n_mentions)
+        }
+
+def from_cursor(cursor):
+    """ Build compact records from a cursor over a single user's tweets
+
+    Args:
+        cursor: An iterable of tweet dictionaries, e.g. a pymongo cursor
+            projected with TWEET_PROJECTION
+
+    Returns:
+        A dict containing a list of Tweet objects and the most recently seen
+        User object, in the same shape as Classifier.collect_tweets
+    """
+
+    data = {
+        "tweets": [],
+        "user": None
+    }
+
+    user_doc = None
+    for doc in cursor:
+        user_doc = doc.get("user", user_doc)
+        data["tweets"].append(Tweet(doc))
+
+    if (user_doc is not None):
+        data["user"] = User(user_doc)
+
+    return data
+
+def test():
+    """ Run some checks to make sure the records behave like dictionaries """
+
+    doc = {
+        "id": 1,
+        "text": "hello",
+        "source": "<a href=\"http://twitter.com/\">web</a>",
+        "retweet_count": 2,
+        "timestamp_ms": "1325376000000",
+        "coordinates": {"type": "Point", "coordinates": [-71.0, 42.3]},
+        "entities": {
+            "urls": [{"expanded_url": "http://example.com/"}],
+            "hashtags": [{"text": "a"}, {"text": "b"}],
+            "user_mentions": []
+        },
+        "user": {"id": 5, "screen_name": "someone", "verified": False}
+    }
+
+    data = from_cursor([
+        doc,
+        dict(doc, id = 2, source = "".join(list(doc["source"]))),
+        dict(doc, id = 3, source = None)
+    ])
+    (tweet, same_source, no_source) = data["tweets"]
+
+    assert tweet["retweet_count"] == 2
+    assert int(tweet["timestamp_ms"]) == 1325376000000
+    assert tweet["coordinates"]["coordinates"] == [-71.0, 42.3]
+    urls = tweet["entities"]["urls"]
+    assert urls == [{"expanded_url": "http://example.com/"}]
+    assert len(tweet["entities"]["hashtags"]) == 2
+    assert len(tweet["entities"]["user_mentions"]) == 0
+    assert "source" in tweet and "source" not in no_source
+    assert tweet["source"] is same_source["source"]
+    assert data["user"]["screen_name"] == "someone"
+    assert data["user"]["verified"] is False
+    assert "followers_count" not in data["user"]
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
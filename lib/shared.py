@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# read-only artifacts published once as memory-mapped .npy files, so that any
+# number of worker processes can attach to them without their own copy
+#
+# Pages of a memory-mapped file are shared through the page cache, so a worker
+# that attaches to an artifact only adds the pages it touches to its RSS, and
+# those pages are counted once for all workers.
+#
+# Every publish writes a new version directory inside the artifact directory
+# and then points POINTER_FILE at it, so that attaching never mixes the files
+# of two versions.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy
+
+METADATA_FILE = "metadata.json"
+
+# file in an artifact directory containing the name of its current version
+POINTER_FILE = "current"
+VERSION_PREFIX = "v"
+
+def publish(output_dir, arrays, metadata = None,
+            metadata_file = METADATA_FILE):
+    """ Publish a set of arrays as a directory of .npy files
+
+    The files are written to a new version directory inside output_dir, and
+    the pointer file is then atomically replaced to name it, so a process
+    that attaches while the artifact is being published again gets either
+    every old file or every new one. Versions older than the one that was
+    replaced are removed; arrays that are already memory-mapped stay
+    readable, as the mapping keeps the removed files alive.
+
+    Args:
+        output_dir: The directory to publish to
+        arrays: A dictionary mapping names to numpy arrays
+        metadata: An optional JSON-serializable object stored with the arrays
+        metadata_file: The name of the metadata file
+    """
+
+    # version names sort in the order in which they were created
+    version = "%s%020d.%d" % (VERSION_PREFIX, time.time_ns(), os.getpid())
+    version_dir = os.path.join(output_dir, version)
+    os.makedirs(version_dir)
+
+    for (name, array) in arrays.items():
+        with open(os.path.join(version_dir, "%s.npy" % name), "wb") as f:
+            numpy.save(f, numpy.ascontiguousarray(array))
+    with open(os.path.join(version_dir, metadata_file), "w") as f:
+        json.dump(metadata, f)
+
+    replaced = _current_version(output_dir)
+    pointer = os.path.join(output_dir, POINTER_FILE)
+    with open("%s.%d.tmp" % (pointer, os.getpid()), "w") as f:
+        f.write(version)
+    os.replace("%s.%d.tmp" % (pointer, os.getpid()), pointer)
+
+    # a process that read the pointer just before it was replaced may still
+    # be opening the files of the replaced version, so that one is kept
+    if (replaced is not None):
+        for name in os.listdir(output_dir):
+            if (name.startswith(VERSION_PREFIX) and (name < replaced)):
+                shutil.rmtree(
+                    os.path.join(output_dir, name), ignore_errors = True
+                )
+
+def _current_version(input_dir):
+    """ Return the name of the current version of an artifact, or None """
+
+    try:
+        with open(os.path.join(input_dir, POINTER_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _version_dir(input_dir):
+    """ Return the directory of the current version of an artifact, or None
+    if nothing has been published to input_dir """
+
+    version = _current_version(input_dir)
+    if (version is None):
+        return None
+    return os.path.join(input_dir, version)
+
+def attach(input_dir, names, mmap = True, metadata_file = METADATA_FILE):
+    """ Attach to arrays published with publish
+
+    Args:
+        input_dir: The directory the arrays were published to
+        names: The names of the arrays to attach to
+        mmap: Whether or not the arrays should be memory-mapped read-only
+            instead of being read into memory
+        metadata_file: The name of the metadata file
+
+    Returns:
+        A tuple containing a dictionary mapping names to arrays, and the
+        metadata
+    """
+
+    version_dir = _version_dir(input_dir)
+    if (version_dir is None):
+        raise FileNotFoundError("Nothing is published to %s" % input_dir)
+
+    with open(os.path.join(version_dir, metadata_file), "r") as f:
+        metadata = json.load(f)
+
+    arrays = {
+        name: numpy.load(
+            os.path.join(version_dir, "%s.npy" % name),
+            mmap_mode = "r" if mmap else None
+        )
+        for name in names
+    }
+
+    return (arrays, metadata)
+
+def is_published(input_dir, metadata_file = METADATA_FILE):
+    """ Check whether arrays have been published to a directory """
+
+    version_dir = _version_dir(input_dir)
+    return ((version_dir is not None)
+            and os.path.isfile(os.path.join(version_dir, metadata_file)))
+
+def string_key(string):
+    """ Hash a string to a 64-bit key that is the same in every process
+
+    Args:
+        string: A string
+
+    Returns:
+        An int
+    """
+
+    return int.from_bytes(hashlib.blake2b(
+        string.encode("utf-8"), digest_size = 8
+    ).digest(), "little")
+
+class StringTable(object):
+    """ A read-only mapping of strings to small integers, stored as a sorted
+    array of 64-bit string hashes and an array of values so that it can be
+    published and memory-mapped
+
+    Attributes:
+        keys: A sorted uint64 array of string keys (see string_key)
+        values: An int64 array of the value of each key
+    """
+
+    ARRAYS = ["keys", "values"]
+
+    def __init__(self, keys, values):
+        """ Initializes StringTable
+
+        Args:
+            keys, values: See class attributes
+        """
+
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, mapping):
+        """ Build a table from a dictionary mapping strings to integers """
+
+        keys = numpy.array(
+            [string_key(string) for string in mapping], dtype = numpy.uint64
+        )
+        values = numpy.array(list(mapping.values()), dtype = numpy.int64)
+        order = numpy.argsort(keys, kind = "stable")
+        return cls(keys[order], values[order])
+
+    def get(self, string, default = None):
+        """ Look up the value of a string
+
+        Args:
+            string: A string
+            default: The value returned if the string is not in the table
+
+        Returns:
+            The value of the string as an int, or default
+        """
+
+        key = numpy.uint64(string_key(string))
+        i = int(numpy.searchsorted(self.keys, key))
+        if ((i < len(self.keys)) and (self.keys[i] == key)):
+            return int(self.values[i])
+        return default
+
+    def __len__(self):
+        return len(self.keys)
+
+    def publish(self, output_dir, metadata = None):
+        """ Publish the table to a directory; see publish """
+
+        publish(output_dir, {
+            name: getattr(self, name) for name in self.ARRAYS
+        }, metadata)
+
+    @classmethod
+    def attach(cls, input_dir, mmap = True):
+        """ Attach to a table published with StringTable.publish
+
+        Returns:
+            A tuple containing a StringTable and its metadata
+        """
+
+        (arrays, metadata) = attach(input_dir, cls.ARRAYS, mmap)
+        return (cls(**arrays), metadata)
+
+def test():
+    """ Publish and attach to a table and check its lookups """
+
+    import tempfile
+
+    mapping = {"web": -1, "TweetDeck": 0, "twitterfeed": 1, "": 1}
+    table = StringTable.from_dict(mapping)
+    assert len(table) == 4
+    assert (numpy.diff(table.keys.astype(numpy.float64)) >= 0).all()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        table.publish(output_dir, {"version": 1})
+        assert is_published(output_dir)
+
+        (attached, metadata) = StringTable.attach(output_dir)
+        assert metadata == {"version": 1}
+        assert isinstance(attached.keys, numpy.memmap)
+        for (string, value) in mapping.items():
+            assert attached.get(string) == value
+        assert attached.get("Twitter for iPhone") is None
+        assert attached.get("Twitter for iPhone", 5) == 5
+
+        # publishing again switches to a new version; the mapped arrays of
+        # the old one stay readable, and older versions are removed
+        StringTable.from_dict({"web": 1}).publish(output_dir)
+        (new, metadata) = StringTable.attach(output_dir, mmap = False)
+        assert metadata is None
+        assert new.get("web") == 1 and new.get("TweetDeck") is None
+        StringTable.from_dict({"web": 2}).publish(output_dir)
+        assert StringTable.attach(output_dir)[0].get("web") == 2
+        assert attached.get("TweetDeck") == 0
+        assert len([
+            name for name in os.listdir(output_dir)
+            if (name.startswith(VERSION_PREFIX))
+        ]) == 2
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        assert not is_published(output_dir)
+        assert not is_published(os.path.join(output_dir, "missing"))
+
+    assert string_key("web") == string_key("web") != string_key("Web")
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# mergeable KLL quantile sketches for summarising feature distributions in
+# constant memory
+#
+# Karnin, Lang, & Liberty, "Optimal Quantile Approximation in Streams" (2016)
+
+import csv
+import json
+import math
+import os
+import random
+
+# number of items kept at the top level; the rank error is roughly 1.7 / K
+K = 200
+C = 2 / 3
+
+class KLL(object):
+    """ A KLL quantile sketch
+
+    Items are stored in a hierarchy of compactors, where an item at level h
+    stands in for 2 ** h items of the stream. When a compactor is full, it is
+    sorted and every other item is promoted to the next level, starting at a
+    random offset. The exact count, minimum and maximum are also kept.
+    """
+
+    def __init__(self, k = K, seed = None):
+        """ Initializes KLL
+
+        Args:
+            k: The capacity of the top level compactor
+            seed: A seed for the random compaction offsets
+        """
+
+        self.k = k
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.compactors = []
+        self._random = random.Random(seed)
+        self._size = 0
+        self._max_size = 0
+        self._grow()
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(
+            self._capacity(height) for height in range(len(self.compactors))
+        )
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil((C ** depth) * self.k)) + 1
+
+    def _compress(self):
+        for height in range(len(self.compactors)):
+            compactor = self.compactors[height]
+            if (len(compactor) >= self._capacity(height)):
+                if (height + 1 == len(self.compactors)):
+                    self._grow()
+                compactor.sort()
+                # an odd item out stays at this level
+                leftover = [compactor.pop()] if (len(compactor) % 2) else []
+                offset = self._random.randint(0, 1)
+                self.compactors[height + 1].extend(compactor[offset::2])
+                self.compactors[height] = leftover
+                self._size = sum(len(c) for c in self.compactors)
+                if (self._size < self._max_size):
+                    break
+
+    def update(self, value):
+        """ Add a value to the sketch """
+
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        if ((self.min is None) or (value < self.min)):
+            self.min = value
+        if ((self.max is None) or (value > self.max)):
+            self.max = value
+        if (self._size >= self._max_size):
+            self._compress()
+
+    def merge(self, other):
+        """ Add the items summarised by another sketch to this one
+
+        Args:
+            other: A KLL object; it is not modified
+        """
+
+        while (len(self.compactors) < len(other.compactors)):
+            self._grow()
+        for (height, compactor) in enumerate(other.compactors):
+            self.compactors[height].extend(compactor)
+
+        self.n += other.n
+        if (other.n):
+            self.min = other.min if (self.min is None) \
+                else min(self.min, other.min)
+            self.max = other.max if (self.max is None) \
+                else max(self.max, other.max)
+
+        self._size = sum(len(c) for c in self.compactors)
+        while (self._size >= self._max_size):
+            self._compress()
+
+    def __len__(self):
+        return self.n
+
+    def weighted_items(self):
+        """ Return the sorted (value, weight) pairs stored in the sketch """
+
+        return sorted(
+            (value, 2 ** height)
+            for (height, compactor) in enumerate(self.compactors)
+            for value in compactor
+        )
+
+    def rank(self, value):
+        """ Estimate the fraction of items that are at most value """
+
+        if (self.n == 0):
+            return 0.0
+        weight = sum(
+            (2 ** height) * sum(1 for item in compactor if (item <= value))
+            for (height, compactor) in enumerate(self.compactors)
+        )
+        total = sum(
+            (2 ** height) * len(compactor)
+            for (height, compactor) in enumerate(self.compactors)
+        )
+        return weight / total
+
+    def cdf(self):
+        """ Estimate the cumulative distribution function
+
+        Returns:
+            A tuple of two lists: the distinct values in the sketch, and the
+            estimated fraction of items at most each value
+        """
+
+        items = self.weighted_items()
+        total = sum(weight for (value, weight) in items)
+        values = []
+        fractions = []
+        running = 0
+
+        for (value, weight) in items:
+            running += weight
+            if (values and (values[-1] == value)):
+                fractions[-1] = running / total
+            else:
+                values.append(value)
+                fractions.append(running / total)
+
+        return (values, fractions)
+
+    def quantile(self, q):
+        """ Estimate the value at quantile q, from 0 to 1 """
+
+        if (self.n == 0):
+            return None
+        if (q <= 0):
+            return self.min
+        if (q >= 1):
+            return self.max
+
+        (values, fractions) = self.cdf()
+        for (value, fraction) in zip(values, fractions):
+            if (fraction >= q):
+                return value
+        return self.max
+
+    def to_dict(self):
+        return {
+            "k": self.k,
+            "n": self.n,
+            "min": self.min,
+            "max": self.max,
+            "compactors": self.compactors
+        }
+
+    @classmethod
+    def from_dict(cls, dict_):
+        sketch = cls(dict_["k"])
+        sketch.n = dict_["n"]
+        sketch.min = dict_["min"]
+        sketch.max = dict_["max"]
+        sketch.compactors = []
+        for compactor in dict_["compactors"]:
+            sketch._grow()
+            sketch.compactors[-1] = list(compactor)
+        sketch._size = sum(len(c) for c in sketch.compactors)
+        return sketch
+
+def ks_distance(a, b):
+    """ Estimate the Kolmogorov-Smirnov distance between two distributions
+
+    Args:
+        a: A KLL object
+        b: A KLL object
+
+    Returns:
+        The largest difference between the estimated CDFs of a and b, from 0
+        to 1
+    """
+
+    values = sorted(set(
+        value for (value, weight) in a.weighted_items() + b.weighted_items()
+    ))
+    return max(
+        (abs(a.rank(value) - b.rank(value)) for value in values),
+        default = 0.0
+    )
+
+class FeatureSketches(object):
+    """ One KLL sketch per feature of a feature matrix
+
+    Stored as JSON next to the feature matrix, e.g. spam.csv.sketch.json.
+    """
+
+    SUFFIX = ".sketch.json"
+
+    def __init__(self, features, k = K):
+        self.sketches = dict(
+            (feature, KLL(k, seed = feature)) for feature in features
+        )
+
+    def __getitem__(self, feature):
+        return self.sketches[feature]
+
+    def __contains__(self, feature):
+        return feature in self.sketches
+
+    def update(self, row):
+        """ Add a row of the feature matrix
+
+        Args:
+            row: A dictionary of feature values; values that are missing or
+                not numbers are ignored
+        """
+
+        for (feature, sketch) in self.sketches.items():
+            try:
+                value = float(row[feature])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if (not math.isnan(value)):
+                sketch.update(value)
+
+    def merge(self, other):
+        """ Merge the sketches of another feature matrix with the same
+        features into these ones """
+
+        for (feature, sketch) in self.sketches.items():
+            sketch.merge(other[feature])
+
+    def save(self, path):
+        """ Atomically write the sketches to a JSON file """
+
+        temp_path = "%s.tmp" % path
+        with open(temp_path, "w") as f:
+            json.dump(dict(
+                (feature, sketch.to_dict())
+                for (feature, sketch) in self.sketches.items()
+            ), f)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            dicts = json.load(f)
+        sketches = cls([])
+        sketches.sketches = dict(
+            (feature, KLL.from_dict(dict_))
+            for (feature, dict_) in dicts.items()
+        )
+        return sketches
+
+    @classmethod
+    def path_of(cls, csv_path):
+        return "%s%s" % (csv_path, cls.SUFFIX)
+
+    @classmethod
+    def from_csv(cls, csv_path, features = None, k = K):
+        """ Load the sketches of a feature matrix, building them by streaming
+        over the CSV if they were not stored
+
+        Args:
+            csv_path: The path to the feature matrix
+            features: The features to sketch when building; defaults to every
+                column
+            k: The size of the sketches when building
+
+        Returns:
+            A FeatureSketches object
+        """
+
+        sketch_path = cls.path_of(csv_path)
+        if (os.path.isfile(sketch_path)):
+            return cls.load(sketch_path)
+
+        with open(csv_path, "r") as f:
+            reader = csv.DictReader(f)
+            sketches = cls(features or reader.fieldnames, k)
+            for row in reader:
+                sketches.update(row)
+        return sketches
+
+def test():
+    """ Check the rank error of the sketch on a shuffled stream """
+
+    rng = random.Random(0)
+    values = list(range(100000))
+    rng.shuffle(values)
+
+    sketch = KLL(seed = 0)
+    for value in values:
+        sketch.update(value)
+    assert len(sketch) == 100000
+    assert (sketch.min, sketch.max) == (0, 99999)
+    assert sum(len(c) for c in sketch.compactors) < 1000
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        assert abs(sketch.quantile(q) / 100000 - q) < 0.02
+        assert abs(sketch.rank(q * 100000) - q) < 0.02
+
+    # merging sketches of two halves approximates a sketch of the whole
+    (a, b) = (KLL(seed = 1), KLL(seed = 2))
+    for value in values[:50000]:
+        a.update(value)
+    for value in values[50000:]:
+        b.update(value * 2)
+    a.merge(b)
+    assert len(a) == 100000
+    assert abs(a.quantile(0.5) / 100000 - 0.67) < 0.03
+
+    restored = KLL.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
+    restored.update(-1)
+    assert restored.min == -1
+
+    assert ks_distance(sketch, sketch) == 0
+    assert ks_distance(sketch, b) > 0.3
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# a tokenisation cache shared by the feature extractors that read tweet text,
+# so that retweets and copies of the same spam are only tokenised once
+#
+# Entries are keyed by a 64-bit hash of the text instead of the text itself,
+# which keeps the keys of a large cache small.
+
+import collections
+import hashlib
+import threading
+
+import numpy
+import scipy.sparse
+import sklearn.feature_extraction.text
+
+from lib import metrics
+
+DEFAULT_CACHE_SIZE = 100000
+
+# the tokenizer of sklearn's TfidfVectorizer with its default settings, so
+# that tf_idf gives the same matrix as TfidfVectorizer().fit_transform
+_analyze = sklearn.feature_extraction.text.TfidfVectorizer().build_analyzer()
+
+def normalize(text):
+    """ Normalize text without changing its tokens
+
+    The tokenizer lowercases text and splits it on runs of non-word
+    characters, so texts that only differ in case or whitespace have the
+    same tokens and share a cache entry.
+
+    Args:
+        text: A string
+
+    Returns:
+        A normalized string
+    """
+
+    return " ".join(text.lower().split())
+
+def text_key(text):
+    """ Hash a text to a 64-bit cache key
+
+    Args:
+        text: A string
+
+    Returns:
+        An int
+    """
+
+    return int.from_bytes(hashlib.blake2b(
+        text.encode("utf-8", "surrogatepass"), digest_size = 8
+    ).digest(), "little")
+
+class LRUCache(object):
+    """ A thread-safe bounded mapping that evicts its least recently used
+    entries
+
+    Attributes:
+        name: The name that hits and misses are counted under in
+            lib.metrics.registry
+        size: The maximum number of entries
+    """
+
+    def __init__(self, name, size = DEFAULT_CACHE_SIZE):
+        """ Initializes LRUCache
+
+        Args:
+            name, size: See class attributes
+        """
+
+        self.name = name
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """ Get the value of a key, computing and storing it if it is not
+        cached
+
+        Args:
+            key: A hashable key
+            compute: A function without arguments that computes the value
+
+        Returns:
+            The value
+        """
+
+        with self._lock:
+            if (key in self._entries):
+                self._entries.move_to_end(key)
+                value = self._entries[key]
+                hit = True
+            else:
+                hit = False
+
+        if (hit):
+            metrics.registry.inc("text_cache_hits_total", cache = self.name)
+            return value
+
+        metrics.registry.inc("text_cache_misses_total", cache = self.name)
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            if (len(self._entries) > self.size):
+                self._entries.popitem(last = False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+class TokenCache(LRUCache):
+    """ An LRUCache of the term counts of texts, keyed by the hash of their
+    normalized text """
+
+    def __init__(self, size = DEFAULT_CACHE_SIZE):
+        super().__init__("tokens", size)
+
+    def term_counts(self, text):
+        """ Get the term counts of a text
+
+        Args:
+            text: A string
+
+        Returns:
+            A collections.Counter mapping tokens to the number of times they
+            occur; it must not be modified
+        """
+
+        normalized = normalize(text)
+        return self.get(
+            text_key(normalized),
+            lambda: collections.Counter(_analyze(normalized))
+        )
+
+# the cache shared by every feature extractor in this process
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+def token_cache(size = DEFAULT_CACHE_SIZE):
+    """ Get the shared TokenCache of this process
+
+    Args:
+        size: The size of the cache, if it has not been created yet
+
+    Returns:
+        A TokenCache object
+    """
+
+    global _token_cache
+
+    with _token_cache_lock:
+        if (_token_cache is None):
+            _token_cache = TokenCache(size)
+        return _token_cache
+
+def tf_idf(texts, cache = None):
+    """ Compute the TF-IDF vectors of a list of texts, once per distinct text
+
+    The result is the same as that of
+    sklearn.feature_extraction.text.TfidfVectorizer().fit_transform(texts),
+    up to the order of the columns, but texts that normalize to the same
+    string are tokenized and weighted only once.
+
+    Args:
+        texts: A list of strings
+        cache: The TokenCache to use; defaults to the shared one
+
+    Returns:
+        A tuple containing a CSR matrix with the L2-normalized vector of each
+        distinct text, and an int array mapping each text to its row
+
+    Raises:
+        ValueError: If none of the texts contain any tokens, as
+            TfidfVectorizer does
+    """
+
+    if (cache is None):
+        cache = token_cache()
+
+    rows = {}
+    inverse = numpy.empty(len(texts), dtype = numpy.int64)
+    counts = []
+    for (i, text) in enumerate(texts):
+        normalized = normalize(text)
+        key = text_key(normalized)
+        if (key not in rows):
+            rows[key] = len(counts)
+            counts.append(cache.get(
+                key, lambda: collections.Counter(_analyze(normalized))
+            ))
+        inverse[i] = rows[key]
+
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for term_counts in counts:
+        for (term, count) in term_counts.items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(count)
+        indptr.append(len(indices))
+
+    if (not vocabulary):
+        raise ValueError("empty vocabulary; the texts contain no tokens")
+
+    matrix = scipy.sparse.csr_matrix(
+        (numpy.array(data, dtype = numpy.float64), indices, indptr),
+        shape = (len(counts), len(vocabulary))
+    )
+
+    # document frequencies count every copy of a text
+    multiplicity = numpy.bincount(inverse, minlength = len(counts))
+    df = numpy.bincount(
+        matrix.indices,
+        weights = numpy.repeat(multiplicity, numpy.diff(matrix.indptr)),
+        minlength = len(vocabulary)
+    )
+    idf = numpy.log((1 + len(texts)) / (1 + df)) + 1
+
+    matrix = matrix.multiply(idf).tocsr()
+    norms = numpy.sqrt(numpy.asarray(
+        matrix.multiply(matrix).sum(axis = 1)
+    )).ravel()
+    norms[norms == 0] = 1
+    matrix = scipy.sparse.diags(1 / norms) @ matrix
+
+    return (matrix.tocsr(), inverse)
+
+def test():
+    """ Compare tf_idf to TfidfVectorizer and check the cache """
+
+    import random
+
+    rng = random.Random(0)
+    words = ["buy", "now", "free", "Free", "followers", "http", "t", "co",
+             "a", "!!", "the", "spam", "ham"]
+    texts = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(0, 8)))
+        for _ in range(40)
+    ]
+    texts += texts[:10] + ["FREE  followers", "free followers", "", "!!"]
+
+    cache = TokenCache(size = 16)
+    (matrix, inverse) = tf_idf(texts, cache)
+    expected = sklearn.feature_extraction.text.TfidfVectorizer(
+    ).fit_transform(texts)
+
+    similarities = (matrix @ matrix.T).toarray()[inverse][:, inverse]
+    assert numpy.allclose(similarities, (expected @ expected.T).toarray())
+    assert len(cache) <= 16
+    assert inverse[-4] == inverse[-3]
+
+    assert cache.term_counts("Free  followers") == {"free": 1, "followers": 1}
+
+    try:
+        tf_idf(["", "!"], cache)
+        assert False, "Expected a ValueError"
+    except ValueError:
+        pass
+
+    lru = LRUCache("test", size = 2)
+    assert lru.get(1, lambda: "a") == "a"
+    assert lru.get(2, lambda: "b") == "b"
+    assert lru.get(1, lambda: "c") == "a"
+    assert lru.get(3, lambda: "d") == "d"
+    # 2 was the least recently used
+    assert lru.get(2, lambda: "e") == "e"
+    assert lru.get(1, lambda: "f") == "f"
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# fast parsing of Twitter timestamps and a per-user time series that is built
+# once and shared by every time-based feature extractor (see UserIntermediates
+# in feature_extractors/templates.py)
+
+import calendar
+import datetime
+import functools
+
+import numpy
+
+# e.g. "Wed Oct 10 20:19:24 +0000 2018"
+CREATED_AT_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+MONTHS = {
+    month: i + 1 for (i, month) in enumerate([
+        "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+        "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"
+    ])
+}
+
+# the number of distinct created_at strings whose parsed values are kept
+CREATED_AT_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize = CREATED_AT_CACHE_SIZE)
+def parse_created_at(created_at):
+    """ Parse a Twitter created_at string
+
+    The fields are read from their fixed positions, which is much faster than
+    strptime or dateutil; strings that do not have the expected layout are
+    parsed with strptime instead.
+
+    Args:
+        created_at: A string in CREATED_AT_FORMAT
+
+    Returns:
+        The time as an int Unix timestamp in seconds
+    """
+
+    try:
+        offset = int(created_at[21:23]) * 3600 + int(created_at[23:25]) * 60
+        if (created_at[20] == "-"):
+            offset = -offset
+        elif (created_at[20] != "+"):
+            raise ValueError(created_at)
+        return calendar.timegm((
+            int(created_at[26:30]), MONTHS[created_at[4:7]],
+            int(created_at[8:10]), int(created_at[11:13]),
+            int(created_at[14:16]), int(created_at[17:19])
+        )) - offset
+    except (IndexError, KeyError, ValueError):
+        return int(datetime.datetime.strptime(
+            created_at, CREATED_AT_FORMAT
+        ).timestamp())
+
+def tweet_ms(tweet):
+    """ Find the time of a tweet
+
+    Args:
+        tweet: A tweet dictionary or lib.records.Tweet
+
+    Returns:
+        The time in milliseconds as an int, from timestamp_ms or else
+        created_at, or None if the tweet has neither
+    """
+
+    if ("timestamp_ms" in tweet):
+        return int(tweet["timestamp_ms"])
+    if ("created_at" in tweet):
+        return parse_created_at(tweet["created_at"]) * 1000
+    return None
+
+class Timeline(object):
+    """ The times of a user's tweets
+
+    Attributes:
+        ms: An int64 array of the time of each tweet in milliseconds, in the
+            order of the tweets
+        sorted_ms: ms in ascending order
+    """
+
+    def __init__(self, tweets):
+        """ Initializes Timeline
+
+        Args:
+            tweets: A list of tweets, each of which must have a timestamp_ms
+                or created_at
+        """
+
+        self.ms = numpy.fromiter(
+            (tweet_ms(tweet) for tweet in tweets),
+            dtype = numpy.int64, count = len(tweets)
+        )
+        self.sorted_ms = numpy.sort(self.ms)
+
+    def __len__(self):
+        return len(self.ms)
+
+    @functools.cached_property
+    def intervals(self):
+        """ A float64 array of the seconds between consecutive tweets """
+
+        return numpy.diff(self.sorted_ms) / 1000
+
+    @functools.cached_property
+    def hours(self):
+        """ An int64 array of the UTC hour of the day of each tweet """
+
+        return (self.sorted_ms // 3600000) % 24
+
+def test():
+    """ Compare the parser to strptime and check a small timeline """
+
+    import random
+
+    rng = random.Random(0)
+    for _ in range(1000):
+        timestamp = rng.randint(0, 2 ** 31)
+        for offset in ("+0000", "-0530", "+1000"):
+            created_at = datetime.datetime.fromtimestamp(
+                timestamp, datetime.timezone.utc
+            ).strftime("%a %b %d %H:%M:%S " + offset + " %Y")
+            assert parse_created_at(created_at) == int(
+                datetime.datetime.strptime(
+                    created_at, CREATED_AT_FORMAT
+                ).timestamp()
+            ), created_at
+
+    assert parse_created_at("Wed Oct 10 20:19:24 +0000 2018") == 1539202764
+
+    tweets = [
+        {"timestamp_ms": "7200000"},
+        {"created_at": "Thu Jan 01 00:00:00 +0000 1970"},
+        {"timestamp_ms": 3600000}
+    ]
+    timeline = Timeline(tweets)
+    assert timeline.ms.tolist() == [7200000, 0, 3600000]
+    assert timeline.sorted_ms.tolist() == [0, 3600000, 7200000]
+    assert timeline.intervals.tolist() == [3600.0, 3600.0]
+    assert timeline.hours.tolist() == [0, 1, 2]
+    assert len(Timeline([])) == 0
+    assert tweet_ms({}) is None
+
+if (__name__ == "__main__"):
+    test()
+    print("All tests OK")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# fixtures shared by the tests
+#
+# MongoDB is replaced by mongomock and config.ini by a copy of config.ini.skel
+# in a temporary directory. Feature extractors are imported strictly, so tests
+# that use botdetector are skipped where a dependency of one of them is
+# missing.
+
+import configparser
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if (ROOT not in sys.path):
+    sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import TimelineGenerator
+from util import config_loader
+
+# feature extractors that need no external services or training data
+FEATURES = [
+    "AverageHashtagsPerTweet",
+    "AverageMentionsPerTweet",
+    "AverageRetweetsPerTweet",
+    "AverageTweetContentSimilarity",
+    "FollowersToFriendsRatio",
+    "MeanTweetInterval",
+    "PostingHourEntropy",
+    "TweetCount",
+    "TweetIntervalCV",
+    "TweetsWithLinksProportion",
+    "UserIsVerified",
+    "UserJoinDate",
+    "UsernameLength"
+]
+
+@pytest.fixture
+def configure(tmp_path, monkeypatch):
+    """ Load the configuration from a config.ini written to tmp_path
+
+    The configuration is config.ini.skel with its training root in tmp_path
+    and FEATURES as its features.
+
+    Returns:
+        A function that takes a dictionary mapping sections to dictionaries
+        of keys to override, and rewrites the configuration
+    """
+
+    path = tmp_path / "config.ini"
+    monkeypatch.setattr(
+        config_loader.ConfigLoader, "CONFIG_FILE", str(path)
+    )
+
+    def configure(overrides = None):
+        config = configparser.ConfigParser()
+        config.read(os.path.join(
+            ROOT, config_loader.ConfigLoader.CONFIG_FALLBACK
+        ))
+        config["training"]["root"] = str(tmp_path / "training")
+        config["classifier"]["features"] = ",".join(FEATURES)
+        for (section, values) in (overrides or {}).items():
+            for (key, value) in values.items():
+                config[section][key] = str(value)
+
+        with open(path, "w") as f:
+            config.write(f)
+
+    configure()
+    return configure
+
+@pytest.fixture
+def mongo():
+    """ A mongomock.MongoClient """
+
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient()
+
+@pytest.fixture
+def botdetector(configure):
+    """ The botdetector module """
+
+    return pytest.importorskip("botdetector")
+
+@pytest.fixture
+def insert_timelines():
+    """ Insert synthetic timelines into a collection
+
+    Returns:
+        A function that takes a collection, a list of timeline lengths and an
+        optional seed, inserts a user with a timeline of each length, and
+        returns a dictionary mapping the user IDs to (user, tweets) tuples
+    """
+
+    def insert_timelines(collection, sizes, seed = 0):
+        generator = TimelineGenerator(seed = seed)
+        timelines = {}
+        for n_tweets in sizes:
+            (user, tweets) = generator.timeline(n_tweets)
+            collection.insert_many([
+                dict(tweet, user = user) for tweet in tweets
+            ])
+            timelines[user["id"]] = (user, tweets)
+        return timelines
+
+    return insert_timelines
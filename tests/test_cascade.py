@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# training, saving and loading a cascaded classifier
+
+import json
+
+import pytest
+
+from benchmarks.synthetic import TimelineGenerator
+from conftest import FEATURES
+from lib import metrics
+
+CHEAP_FEATURES = [
+    "FollowersToFriendsRatio",
+    "TweetCount",
+    "UserIsVerified",
+    "UserJoinDate",
+    "UsernameLength"
+]
+
+def insert_users(collection, generator, sizes):
+    user_ids = []
+    for n_tweets in sizes:
+        (user, tweets) = generator.timeline(n_tweets)
+        collection.insert_many([dict(tweet, user = user) for tweet in tweets])
+        user_ids.append(user["id"])
+    return user_ids
+
+def write_costs(csv_path):
+    """ Replace the measured costs of a feature matrix with fixed ones, so
+    that the split into cheap and expensive features does not depend on
+    timing """
+
+    with open(csv_path + metrics.COSTS_SUFFIX, "w") as f:
+        json.dump({
+            "extractors": {
+                feature: {
+                    "calls": 1,
+                    "wall_seconds": (
+                        0.0001 if (feature in CHEAP_FEATURES) else 0.01
+                    )
+                }
+                for feature in FEATURES
+            },
+            "pushdown": {"calls": 0, "users": 0, "wall_seconds": 0.0}
+        }, f)
+
+@pytest.mark.parametrize("pushdown", [0, 1])
+def test_cascade_round_trip(botdetector, configure, mongo, tmp_path,
+                            pushdown):
+    configure({"classifier": {
+        "cascade": 1,
+        "cascade_band": "0.2,0.8",
+        "cascade_cheap_ms": 1,
+        "max_tweets": 0,
+        "pushdown": pushdown
+    }})
+
+    # spammers post more, link and repeat themselves more than other users
+    generator = TimelineGenerator(seed = 0)
+    ham_ids = insert_users(mongo.db.tweets, generator, range(3, 19, 2))
+    generator.url_density = 1.5
+    generator.duplicate_fraction = 0.6
+    spam_ids = insert_users(mongo.db.tweets, generator, range(20, 36, 2))
+    user_ids = sorted(spam_ids + ham_ids)
+
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    spam_csv = str(tmp_path / "spam.csv")
+    ham_csv = str(tmp_path / "ham.csv")
+    classifier.gen_feature_matrix(spam_ids, spam_csv)
+    classifier.gen_feature_matrix(ham_ids, ham_csv)
+    write_costs(spam_csv)
+    write_costs(ham_csv)
+
+    classifier.train(spam_csv, ham_csv)
+    assert classifier.cheap_features == CHEAP_FEATURES
+    assert classifier.cheap_forest is not None
+    predictions = classifier.predict(user_ids)
+    report = classifier.cascade_report
+    assert report["users"] == len(user_ids)
+
+    model_dir = str(tmp_path / "model")
+    classifier.save(model_dir)
+
+    loaded = botdetector.Classifier()
+    loaded.collection = mongo.db.tweets
+    loaded.load(model_dir)
+    assert loaded.cheap_features == CHEAP_FEATURES
+    assert loaded.cascade_stats == classifier.cascade_stats
+    assert loaded.predict(user_ids) == predictions
+    assert loaded.cascade_report == report
+
+def test_cascade_is_not_loaded_when_disabled(botdetector, configure, mongo,
+                                             tmp_path):
+    configure({"classifier": {
+        "cascade": 1,
+        "max_tweets": 0,
+        "pushdown": 0
+    }})
+    generator = TimelineGenerator(seed = 1)
+    ham_ids = insert_users(mongo.db.tweets, generator, range(3, 13))
+    generator.url_density = 1.5
+    spam_ids = insert_users(mongo.db.tweets, generator, range(20, 30))
+
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    spam_csv = str(tmp_path / "spam.csv")
+    ham_csv = str(tmp_path / "ham.csv")
+    classifier.gen_feature_matrix(spam_ids, spam_csv)
+    classifier.gen_feature_matrix(ham_ids, ham_csv)
+    write_costs(spam_csv)
+    write_costs(ham_csv)
+    classifier.train(spam_csv, ham_csv)
+    model_dir = str(tmp_path / "model")
+    classifier.save(model_dir)
+
+    configure({"classifier": {"cascade": 0, "max_tweets": 0}})
+    loaded = botdetector.Classifier()
+    loaded.collection = mongo.db.tweets
+    loaded.load(model_dir)
+    assert loaded.cheap_forest is None
+
+    user_ids = sorted(spam_ids + ham_ids)
+    assert loaded.predict(user_ids) == dict(zip(
+        user_ids, classifier.forest.predict([
+            loaded.dict_to_feature_vector(results)
+            for (user_id, user, results)
+            in loaded.iter_user_features(user_ids)
+        ])
+    ))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# resuming gen_feature_matrix after a crash
+
+import csv
+
+def read_rows(path):
+    with open(path, "r") as f:
+        return list(csv.DictReader(f))
+
+def test_resume_after_partial_writes(botdetector, configure, mongo,
+                                     insert_timelines, tmp_path):
+    configure({"classifier": {"max_tweets": 0, "pushdown": 0}})
+    timelines = insert_timelines(mongo.db.tweets, [3, 5, 7, 9, 11])
+    user_ids = sorted(timelines)
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+
+    expected = str(tmp_path / "expected.csv")
+    classifier.gen_feature_matrix(user_ids, expected)
+
+    output = str(tmp_path / "output.csv")
+    checkpoint_path = output + botdetector.CHECKPOINT_SUFFIX
+    classifier.gen_feature_matrix(user_ids[:2], output)
+
+    # a crash while the next row and its entry were being written
+    with open(output, "a") as f:
+        f.write("%d,user,no" % user_ids[2])
+    with open(checkpoint_path, "a") as f:
+        f.write('{"status": "done", "user_id": %d, "off' % user_ids[2])
+
+    classifier.gen_feature_matrix(user_ids[:4], output, resume = True)
+    checkpoint = classifier.read_checkpoint(output)
+    assert checkpoint["done"] == set(user_ids[:4])
+
+    # the entries written after the partial one must survive another resume
+    classifier.gen_feature_matrix(user_ids, output, resume = True)
+    checkpoint = classifier.read_checkpoint(output)
+    assert checkpoint["done"] == set(user_ids)
+
+    with open(checkpoint_path, "rb") as f:
+        assert checkpoint["checkpoint_offset"] == len(f.read())
+    assert read_rows(output) == read_rows(expected)
+
+def test_resume_skips_failed_users(botdetector, configure, mongo,
+                                   insert_timelines, tmp_path):
+    configure({"classifier": {"max_tweets": 0, "pushdown": 0}})
+    timelines = insert_timelines(mongo.db.tweets, [3, 5])
+    user_ids = sorted(timelines) + [10 ** 12]
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+
+    output = str(tmp_path / "output.csv")
+    assert classifier.gen_feature_matrix(user_ids, output) == [10 ** 12]
+    assert classifier.gen_feature_matrix(
+        user_ids, output, resume = True
+    ) == []
+    assert classifier.gen_feature_matrix(
+        user_ids, output, resume = True, retry_failed = True
+    ) == [10 ** 12]
+    assert len(read_rows(output)) == 2
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# the extraction cost table of util/evaluate.py
+
+import json
+
+import pytest
+
+from lib import metrics
+from util import evaluate
+
+FEATURES = ["AverageHashtagsPerTweet", "TweetCount", "UserIsVerified"]
+
+def write_costs(csv_path, extractors, pushdown_users, pushdown_seconds):
+    with open(csv_path + metrics.COSTS_SUFFIX, "w") as f:
+        json.dump({
+            "extractors": {
+                feature: {"calls": calls, "wall_seconds": seconds}
+                for (feature, (calls, seconds)) in extractors.items()
+            },
+            "pushdown": {
+                "calls": 1,
+                "users": pushdown_users,
+                "wall_seconds": pushdown_seconds
+            }
+        }, f)
+
+def test_pushdown_is_reported_on_its_own(tmp_path):
+    spam_csv = str(tmp_path / "spam.csv")
+    ham_csv = str(tmp_path / "ham.csv")
+    write_costs(spam_csv, {
+        "AverageHashtagsPerTweet": (10, 0.02),
+        "UserIsVerified": (10, 0.001)
+    }, 10, 0.5)
+    write_costs(ham_csv, {
+        "AverageHashtagsPerTweet": (30, 0.06),
+        "UserIsVerified": (30, 0.003)
+    }, 30, 1.5)
+
+    costs = evaluate.feature_costs([spam_csv, ham_csv], FEATURES)
+    assert costs == {
+        "AverageHashtagsPerTweet": pytest.approx(0.002),
+        "TweetCount": 0.0,
+        "UserIsVerified": pytest.approx(0.0001),
+        evaluate.PUSHDOWN: pytest.approx(0.05)
+    }
+
+    text = evaluate.report([{
+        "features": FEATURES, "n_estimators": 10,
+        "precision": 0.9, "precision_std": 0.01,
+        "recall": 0.8, "recall_std": 0.02,
+        "auc": 0.95, "auc_std": 0.03
+    }], costs)
+    lines = text.split("\n")
+    assert "2.100" in lines[1].split()
+    assert lines[lines.index("extraction cost per user:") + 1:] == [
+        "  %-32s %s" % ("AverageHashtagsPerTweet", "2.000 ms"),
+        "  %-32s %s" % ("UserIsVerified", "0.100 ms"),
+        "  %-32s %s" % ("TweetCount", "0.000 ms"),
+        "  %-32s %s" % ("(MongoDB aggregations)", "50.000 ms")
+    ]
+
+def test_costs_are_unknown_without_cost_files(tmp_path):
+    costs = evaluate.feature_costs([str(tmp_path / "spam.csv")], FEATURES)
+    assert costs == dict.fromkeys(FEATURES + [evaluate.PUSHDOWN])
+
+    text = evaluate.report([], costs)
+    assert text.split("\n")[-len(FEATURES):] == [
+        "  %-32s -" % feature for feature in FEATURES
+    ]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# saving, loading and verifying compiled forests
+
+import os
+
+import numpy
+import pytest
+import sklearn.ensemble
+
+from lib import shared
+from lib.forest import CompiledForest
+
+FEATURES = ["a", "b", "c", "d"]
+
+def train(seed):
+    random = numpy.random.RandomState(seed)
+    X = random.normal(size = (200, len(FEATURES)))
+    y = numpy.where(X[:, 0] + X[:, 1] * X[:, 2] > 0, "spam", "ham")
+    forest = sklearn.ensemble.RandomForestClassifier(
+        n_estimators = 10, random_state = seed
+    )
+    forest.fit(X, y)
+    return (forest, X)
+
+def array_path(output_dir, name):
+    with open(os.path.join(output_dir, shared.POINTER_FILE), "r") as f:
+        return os.path.join(output_dir, f.read().strip(), "%s.npy" % name)
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, mmap):
+    (forest, X) = train(0)
+    compiled = CompiledForest.from_sklearn(forest, FEATURES)
+    assert compiled.verify(forest, X)
+
+    output_dir = str(tmp_path / "forest")
+    compiled.save(output_dir)
+    loaded = CompiledForest.load(output_dir, mmap = mmap)
+
+    assert isinstance(loaded.feature, numpy.memmap) == mmap
+    assert loaded.classes == ["ham", "spam"]
+    assert loaded.features == FEATURES
+    assert loaded.predict(X) == compiled.predict(X)
+    assert numpy.allclose(loaded.predict_proba(X), forest.predict_proba(X))
+    assert loaded.verify(forest, X)
+
+def test_verify_rejects_corrupted_files(tmp_path):
+    (forest, X) = train(0)
+    output_dir = str(tmp_path / "forest")
+    CompiledForest.from_sklearn(forest, FEATURES).save(output_dir)
+
+    # every split sends its samples to the other side
+    path = array_path(output_dir, "threshold")
+    numpy.save(path, -numpy.load(path))
+    assert not CompiledForest.load(output_dir).verify(forest, X)
+
+    # a truncated array can not be loaded at all
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    with pytest.raises(ValueError):
+        CompiledForest.load(output_dir)
+
+def test_verify_rejects_another_forest(tmp_path):
+    (forest, X) = train(0)
+    (other, _) = train(1)
+    output_dir = str(tmp_path / "forest")
+    CompiledForest.from_sklearn(other, FEATURES).save(output_dir)
+
+    assert not CompiledForest.load(output_dir).verify(forest, X)
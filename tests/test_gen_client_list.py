@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# tallying the clients of a collection with util/gen_client_list.py
+
+import collections
+import csv
+
+import pytest
+
+from util import gen_client_list
+
+# tweets whose source can not be parsed into a client
+UNPARSEABLE = [
+    {"source": "web"},
+    {"source": "<a href=\"nowhere\">nowhere</a>"},
+    {"source": ""},
+    {"source": None},
+    {}
+]
+
+@pytest.mark.parametrize("method", ["aggregate", "parallel", "scan"])
+def test_methods_agree(mongo, insert_timelines, monkeypatch, tmp_path,
+                       method):
+    timelines = insert_timelines(mongo.db.tweets, [40, 25, 60, 10])
+    mongo.db.tweets.insert_many([dict(doc) for doc in UNPARSEABLE])
+    monkeypatch.setattr(
+        gen_client_list.pymongo, "MongoClient", lambda address: mongo
+    )
+
+    expected = collections.Counter(
+        gen_client_list.clean_source(tweet["source"])
+        for (user, tweets) in timelines.values()
+        for tweet in tweets
+    )
+    assert None not in expected
+
+    output = str(tmp_path / "clients.csv")
+    gen_client_list.main("localhost", "db", "tweets", output, method, 2)
+
+    with open(output, "r") as f:
+        rows = list(csv.DictReader(f))
+    assert {row["CLIENT"]: int(row["COUNT"]) for row in rows} == expected
+    assert [int(row["COUNT"]) for row in rows] == sorted(
+        expected.values(), reverse = True
+    )
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# per-user intermediates shared by the feature extractors of one user
+
+from lib import timeline
+
+TEMPORAL = ["MeanTweetInterval", "PostingHourEntropy", "TweetIntervalCV"]
+
+def test_timeline_is_built_once_per_user(botdetector, configure, mongo,
+                                         insert_timelines, monkeypatch):
+    timelines = insert_timelines(mongo.db.tweets, [5, 30, 12])
+    extractor = botdetector.FeatureExtractor()
+    extractor.initialize_feature_extractors(TEMPORAL)
+
+    built = []
+    Timeline = timeline.Timeline
+    def counting_timeline(tweets):
+        built.append(len(tweets))
+        return Timeline(tweets)
+    monkeypatch.setattr(timeline, "Timeline", counting_timeline)
+
+    for (user, tweets) in timelines.values():
+        results = extractor.extract_features(user, tweets, TEMPORAL)
+        for feature in TEMPORAL:
+            # run on its own, a feature extractor builds its own timeline
+            assert results[feature] == extractor.extractors[feature].run(
+                user, tweets
+            )
+
+    sizes = [len(tweets) for (user, tweets) in timelines.values()]
+    assert built == [
+        size for size in sizes for n_builds in range(1 + len(TEMPORAL))
+    ]
+
+def test_tweets_changed_in_place_are_not_stale(botdetector, configure, mongo,
+                                               insert_timelines):
+    (user, tweets) = next(iter(
+        insert_timelines(mongo.db.tweets, [10]).values()
+    ))
+    extractor = botdetector.FeatureExtractor()
+
+    before = extractor.extract_features(user, tweets, TEMPORAL)
+    tweets[0] = dict(tweets[0], timestamp_ms = "0")
+    after = extractor.extract_features(user, tweets, TEMPORAL)
+
+    assert after["MeanTweetInterval"] != before["MeanTweetInterval"]
+
+def test_single_hour_entropy_is_not_negative(botdetector, configure, mongo,
+                                             insert_timelines):
+    (user, tweets) = next(iter(
+        insert_timelines(mongo.db.tweets, [3]).values()
+    ))
+    tweets = [dict(tweet, timestamp_ms = "3600000") for tweet in tweets]
+    extractor = botdetector.FeatureExtractor()
+
+    entropy = extractor.extract_features(
+        user, tweets, ["PostingHourEntropy"]
+    )["PostingHourEntropy"]
+    assert str(entropy) == "0.0"
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# loading caverlee-2011 tweet files with util/load_tweets.py
+
+import pytest
+
+from conftest import FEATURES
+from util import load_tweets, user_index
+
+USERS = [
+    "6301\t2006-09-18 01:07:50\t2009-11-20 23:52:41\t3269\t3071\t861\t8\t132",
+    "10836\t2006-10-27 14:38:04\t2009-11-20 23:52:18\t1949\t793\t226\t7\t134"
+]
+
+TWEETS = [
+    "6301\t5599519501\tMake money online #easy http://bit.ly/x\t"
+    "2009-11-10 15:14:31",
+    "6301\t5600313663\t@someone check\tthis out\t2009-11-10 15:47:22",
+    "6301\t5600328557\tMore at http://spam.example/deal\t2009-11-10 15:48:00",
+    "10836\t5607113734\tGood morning everyone\t2009-11-10 20:00:01",
+    "10836\t5612385001\tLunch with @friend #food\t2009-11-11 01:12:45",
+    # a user that is not in the user file
+    "99\t5612385002\tHello\t2009-11-11 01:12:46",
+    "malformed line"
+]
+
+@pytest.fixture
+def paths(tmp_path):
+    users_path = tmp_path / "content_polluters.txt"
+    users_path.write_text("\n".join(USERS) + "\n")
+    tweets_path = tmp_path / "content_polluters_tweets.txt"
+    tweets_path.write_text("\n".join(TWEETS) + "\n")
+    return (str(users_path), str(tweets_path))
+
+def load(mongo, monkeypatch, users_path, tweets_path):
+    """ Load a tweet file into mongo.db.tweets in small chunks, the way the
+    worker processes of load_tweets.load do """
+
+    monkeypatch.setattr(
+        load_tweets.pymongo, "MongoClient", lambda address: mongo
+    )
+    monkeypatch.setattr(load_tweets, "_collection", None)
+    monkeypatch.setattr(load_tweets, "_users", None)
+    load_tweets._init_worker(
+        "localhost", "db", "tweets", load_tweets.read_users(users_path)
+    )
+
+    (n_inserted, n_skipped) = (0, 0)
+    for (start, end) in load_tweets.chunk_ranges(tweets_path, 100):
+        (inserted, skipped) = load_tweets._load_tsv_chunk(
+            (tweets_path, start, end)
+        )
+        n_inserted += inserted
+        n_skipped += skipped
+    return (n_inserted, n_skipped)
+
+def test_load_tsv(mongo, monkeypatch, paths):
+    # the malformed line and the tweet of the user without a profile are
+    # skipped
+    assert load(mongo, monkeypatch, *paths) == (5, 2)
+    assert load(mongo, monkeypatch, *paths) == (0, 2)
+
+    tweets = {tweet["_id"]: tweet for tweet in mongo.db.tweets.find()}
+    assert len(tweets) == 5
+    assert 5612385002 not in tweets
+
+    tweet = tweets[5600313663]
+    assert tweet["text"] == "@someone check\tthis out"
+    assert tweet["timestamp_ms"] == "1257868042000"
+    assert tweet["created_at"] == "Tue Nov 10 15:47:22 +0000 2009"
+    assert tweet["entities"]["user_mentions"][0]["screen_name"] == "someone"
+    assert (tweet["retweet_count"], tweet["source"]) == (0, "")
+    assert tweet["coordinates"] is None
+    assert "screen_name" not in tweet["user"]
+    assert tweet["user"]["screen_name_length"] == 8
+    assert tweet["user"]["verified"] is False
+    assert tweet["user"]["followers_count"] == 3071
+
+def test_indexes_are_built_after_the_load(mongo, monkeypatch, paths):
+    load(mongo, monkeypatch, *paths)
+    assert user_index.marker_field(mongo.db.tweets) is None
+
+    load_tweets.build_indexes(mongo.db.tweets)
+    assert user_index.marker_field(mongo.db.tweets) == (
+        user_index.MARKER_FIELD
+    )
+
+def test_tsv_needs_a_user_file(paths):
+    with pytest.raises(AssertionError):
+        load_tweets.load("localhost", "db", "tweets", [paths[1]])
+
+@pytest.mark.parametrize("compact_records", [0, 1])
+def test_loaded_tweets_have_every_feature(botdetector, configure, mongo,
+                                          monkeypatch, paths,
+                                          compact_records):
+    load(mongo, monkeypatch, *paths)
+    configure({"classifier": {
+        "compact_records": compact_records,
+        "max_tweets": 0,
+        "pushdown": 0
+    }})
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+
+    results = {
+        user_id: features
+        for (user_id, user, features)
+        in classifier.iter_user_features([6301, 10836])
+    }
+
+    assert sorted(results) == [6301, 10836]
+    for features in results.values():
+        assert set(FEATURES) <= set(features)
+    assert results[6301]["TweetCount"] == 3
+    assert results[6301]["TweetsWithLinksProportion"] == pytest.approx(2 / 3)
+    assert results[10836]["UserIsVerified"] == 0
+    assert results[6301]["UsernameLength"] == 8
+    assert results[10836]["UsernameLength"] == 7
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# the counters and histograms of lib/metrics.py and their exposition
+
+from benchmarks.synthetic import TimelineGenerator
+from conftest import FEATURES
+from lib import metrics
+
+def test_exposition():
+    registry = metrics.Registry()
+    registry.inc("users_processed_total")
+    registry.inc("users_processed_total", 2)
+    registry.inc("extractor_calls_total", extractor = "Tweet\"Count")
+    registry.observe("pushdown_wall_seconds", 0.3, buckets = [0.1, 1])
+    registry.observe("pushdown_wall_seconds", 0.05, buckets = [0.1, 1])
+    registry.observe("pushdown_wall_seconds", 2.5, buckets = [0.1, 1])
+
+    assert registry.get("users_processed_total") == 3
+    assert registry.get("extractor_calls_total") == 0
+    assert registry.to_prometheus() == "\n".join([
+        "# TYPE extractor_calls_total counter",
+        "extractor_calls_total{extractor=\"Tweet\\\"Count\"} 1",
+        "# TYPE users_processed_total counter",
+        "users_processed_total 3",
+        "# TYPE pushdown_wall_seconds histogram",
+        "pushdown_wall_seconds_bucket{le=\"0.1\"} 1",
+        "pushdown_wall_seconds_bucket{le=\"1\"} 2",
+        "pushdown_wall_seconds_bucket{le=\"+Inf\"} 3",
+        "pushdown_wall_seconds_sum 2.85",
+        "pushdown_wall_seconds_count 3"
+    ]) + "\n"
+
+    registry.reset()
+    assert registry.to_prometheus() == "\n"
+
+def test_feature_extraction_is_counted(botdetector, configure):
+    registry = metrics.Registry()
+    extractor = botdetector.FeatureExtractor(registry)
+    generator = TimelineGenerator(seed = 0)
+    timelines = [generator.timeline(n_tweets) for n_tweets in (4, 9)]
+
+    before = registry.snapshot()
+    for (user, tweets) in timelines:
+        extractor.extract_features(user, tweets, FEATURES)
+    after = registry.snapshot()
+
+    assert registry.get("users_processed_total") == 2
+    assert registry.get("tweets_processed_total") == 13
+    histograms = {
+        histogram["labels"]["extractor"]: histogram
+        for histogram in after["histograms"]
+        if (histogram["name"] == "extractor_wall_seconds")
+    }
+    assert sorted(histograms) == FEATURES
+    for feature in FEATURES:
+        assert registry.get("extractor_calls_total", extractor = feature) == 2
+        assert histograms[feature]["count"] == 2
+
+    costs = metrics.extraction_costs(before, after)
+    assert sorted(costs["extractors"]) == FEATURES
+    assert all(entry["calls"] == 2 for entry in costs["extractors"].values())
+    assert costs["pushdown"] == {"calls": 0, "users": 0, "wall_seconds": 0}
+
+    exposition = registry.to_prometheus().split("\n")
+    assert "users_processed_total 2" in exposition
+    assert "# TYPE extractor_wall_seconds histogram" in exposition
+    assert ("extractor_wall_seconds_count{extractor=\"TweetCount\"} 2"
+            in exposition)
+    assert ("extractor_calls_total{extractor=\"TweetCount\"} 2"
+            in exposition)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# the oversize policies of Classifier, which bound the tweets held in memory
+
+import pytest
+
+from conftest import FEATURES
+
+def make_classifier(botdetector, configure, mongo, policy, max_tweets = 10):
+    configure({"classifier": {
+        "max_tweets": max_tweets,
+        "oversize_policy": policy,
+        "stream_chunk_size": 4,
+        "pushdown": 0
+    }})
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    return classifier
+
+@pytest.mark.parametrize("compact_records", ["0", "1"])
+def test_recent_keeps_latest_tweets(botdetector, configure, mongo,
+                                    insert_timelines, compact_records):
+    timelines = insert_timelines(mongo.db.tweets, [25])
+    (user_id, (user, tweets)) = next(iter(timelines.items()))
+    classifier = make_classifier(botdetector, configure, mongo, "recent")
+    classifier.compact_records = compact_records == "1"
+
+    data = classifier.collect_tweets(user_id)
+
+    assert data["sampling"] == "recent:10/25"
+    assert [tweet["id"] for tweet in data["tweets"]] == [
+        tweet["id"] for tweet in tweets[-10:]
+    ]
+
+def test_recent_dates_tweets_without_timestamp_ms(botdetector, configure,
+                                                  mongo, insert_timelines):
+    timelines = insert_timelines(mongo.db.tweets, [25])
+    (user_id, (user, tweets)) = next(iter(timelines.items()))
+    classifier = make_classifier(botdetector, configure, mongo, "recent")
+    mongo.db.tweets.update_many({}, {"$unset": {"timestamp_ms": ""}})
+
+    (user, results) = classifier.group_features(
+        user_id, classifier.collection.find({"user.id": user_id}),
+        ["TweetCount", "MeanTweetInterval"]
+    )
+
+    assert results["sampling"] == "recent:10/25"
+    assert results["TweetCount"] == 10
+    # created_at only has second precision
+    expected = (int(tweets[-1]["timestamp_ms"]) // 1000
+                - int(tweets[-10]["timestamp_ms"]) // 1000) / 9
+    assert results["MeanTweetInterval"] == pytest.approx(expected)
+
+def test_reservoir_is_reproducible(botdetector, configure, mongo,
+                                   insert_timelines):
+    timelines = insert_timelines(mongo.db.tweets, [40])
+    user_id = next(iter(timelines))
+    classifier = make_classifier(botdetector, configure, mongo, "reservoir")
+
+    first = classifier.collect_tweets(user_id)
+    second = classifier.collect_tweets(user_id)
+
+    assert first["sampling"] == "reservoir:10/40"
+    assert len(first["tweets"]) == 10
+    assert ([tweet["id"] for tweet in first["tweets"]]
+            == [tweet["id"] for tweet in second["tweets"]])
+
+def test_stream_feeds_every_tweet_to_streaming_extractors(
+        botdetector, configure, mongo, insert_timelines):
+    timelines = insert_timelines(mongo.db.tweets, [30])
+    (user_id, (user, tweets)) = next(iter(timelines.items()))
+    classifier = make_classifier(botdetector, configure, mongo, "stream")
+
+    (user, results) = classifier.user_features(user_id, FEATURES)
+
+    assert results["sampling"] == "stream:10/30"
+    assert results["TweetCount"] == 30
+    assert results["AverageRetweetsPerTweet"] == pytest.approx(
+        sum(tweet["retweet_count"] for tweet in tweets) / 30
+    )
+
+@pytest.mark.parametrize("policy", ["recent", "reservoir", "stream"])
+def test_small_users_are_not_sampled(botdetector, configure, mongo,
+                                     insert_timelines, policy):
+    timelines = insert_timelines(mongo.db.tweets, [8])
+    user_id = next(iter(timelines))
+    classifier = make_classifier(botdetector, configure, mongo, policy)
+
+    unbounded = make_classifier(botdetector, configure, mongo, policy, 0)
+    (user, expected) = unbounded.user_features(user_id, FEATURES)
+    (user, results) = classifier.user_features(user_id, FEATURES)
+
+    assert results == expected
+    assert results["sampling"] == "none"
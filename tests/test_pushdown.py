@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# features computed by MongoDB aggregations must match the Python ones
+
+import pytest
+
+from conftest import FEATURES
+
+def extract(botdetector, configure, mongo, user_ids, pushdown,
+            compact_records = 0):
+    configure({"classifier": {
+        "pushdown": pushdown,
+        "pushdown_batch_size": 2,
+        "compact_records": compact_records,
+        "max_tweets": 0
+    }})
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    return {
+        user_id: results
+        for (user_id, user, results)
+        in classifier.iter_user_features(user_ids)
+    }
+
+@pytest.mark.parametrize("compact_records", [0, 1])
+def test_pushdown_matches_python(botdetector, configure, mongo,
+                                 insert_timelines, compact_records):
+    timelines = insert_timelines(mongo.db.tweets, [1, 5, 17, 40, 3])
+    user_ids = sorted(timelines)
+
+    python = extract(botdetector, configure, mongo, user_ids, 0,
+                     compact_records)
+    pushed = extract(botdetector, configure, mongo, user_ids, 1,
+                     compact_records)
+
+    pushed_features = [
+        feature for feature in FEATURES
+        if (botdetector.FEATURE_EXTRACTORS[feature].aggregation is not None)
+    ]
+    assert pushed_features
+
+    for user_id in user_ids:
+        assert set(pushed[user_id]) == set(python[user_id])
+        for feature in FEATURES:
+            assert pushed[user_id][feature] == pytest.approx(
+                python[user_id][feature]
+            ), feature
+
+def test_aggregate_features_covers_only_requested_users(
+        botdetector, configure, mongo, insert_timelines):
+    timelines = insert_timelines(mongo.db.tweets, [4, 6, 8])
+    user_ids = sorted(timelines)
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    classifier.feature_extractor.initialize_feature_extractors(["TweetCount"])
+
+    aggregated = classifier.aggregate_features(user_ids[:2], ["TweetCount"])
+
+    assert sorted(aggregated) == user_ids[:2]
+    for user_id in user_ids[:2]:
+        assert aggregated[user_id]["TweetCount"] == len(timelines[user_id][1])
+        assert aggregated[user_id]["user"]["id"] == user_id
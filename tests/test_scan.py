@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# extracting the features of a whole collection with a single scan
+
+import csv
+
+import pytest
+
+from util import scan
+
+SIZES = [3, 1, 8, 5, 12, 2, 7]
+
+def read_rows(path):
+    with open(path, "r") as f:
+        return sorted(
+            list(csv.DictReader(f)), key = lambda row: int(row["user_id"])
+        )
+
+def make_classifier(botdetector, configure, mongo, **classifier):
+    configure({"classifier": dict({"max_tweets": 0, "pushdown": 0},
+                                  **classifier)})
+    classifier = botdetector.Classifier()
+    classifier.collection = mongo.db.tweets
+    return classifier
+
+@pytest.mark.parametrize("options", [
+    {"compact_records": 0},
+    {"compact_records": 1},
+    {"max_tweets": 4, "oversize_policy": "recent"}
+])
+def test_scan_matches_per_user_queries(botdetector, configure, mongo,
+                                       insert_timelines, tmp_path, options):
+    timelines = insert_timelines(mongo.db.tweets, SIZES)
+    classifier = make_classifier(botdetector, configure, mongo, **options)
+
+    expected = str(tmp_path / "expected.csv")
+    assert classifier.gen_feature_matrix(sorted(timelines), expected) == []
+    output = str(tmp_path / "output.csv")
+    assert classifier.gen_feature_matrix(None, output) == []
+
+    assert len(read_rows(output)) == len(SIZES)
+    assert read_rows(output) == read_rows(expected)
+
+def test_ranges_cover_every_user_once(botdetector, configure, mongo,
+                                      insert_timelines):
+    timelines = insert_timelines(mongo.db.tweets, SIZES)
+    classifier = make_classifier(botdetector, configure, mongo)
+
+    ranges = botdetector.split_user_ids(mongo.db.tweets, 3)
+    assert ranges[0][0] is None and ranges[-1][1] is None
+
+    scanned = []
+    for user_id_range in ranges:
+        for (user_id, docs) in classifier.scan_user_groups(user_id_range):
+            docs = list(docs)
+            assert len(docs) == len(timelines[user_id][1])
+            scanned.append(user_id)
+    assert scanned == sorted(timelines)
+
+    # a group that is not consumed is skipped
+    assert [
+        user_id for (user_id, docs) in classifier.scan_user_groups()
+    ] == sorted(timelines)
+
+def test_resume_scan(botdetector, configure, mongo, insert_timelines,
+                     tmp_path):
+    timelines = insert_timelines(mongo.db.tweets, SIZES)
+    classifier = make_classifier(botdetector, configure, mongo)
+
+    expected = str(tmp_path / "expected.csv")
+    classifier.gen_feature_matrix(None, expected)
+
+    scan_collection = classifier.iter_collection_features
+    def crash(*args, **kwargs):
+        for (i, item) in enumerate(scan_collection(*args, **kwargs)):
+            if (i == 3):
+                raise KeyboardInterrupt()
+            yield item
+
+    output = str(tmp_path / "output.csv")
+    classifier.iter_collection_features = crash
+    with pytest.raises(KeyboardInterrupt):
+        classifier.gen_feature_matrix(None, output)
+    assert len(read_rows(output)) == 3
+
+    # the resumed scan starts after the last user that was done
+    read = []
+    def counted(*args, **kwargs):
+        for item in scan_collection(*args, **kwargs):
+            read.append(item[0])
+            yield item
+    classifier.iter_collection_features = counted
+    classifier.gen_feature_matrix(None, output, resume = True)
+
+    assert read == sorted(timelines)[3:]
+    assert read_rows(output) == read_rows(expected)
+
+def test_scan_collection(botdetector, configure, mongo, insert_timelines,
+                         monkeypatch, tmp_path):
+    timelines = insert_timelines(mongo.db.tweets, SIZES)
+    make_classifier(botdetector, configure, mongo)
+    monkeypatch.setattr(botdetector, "mongo_client", lambda address: mongo)
+
+    output = str(tmp_path / "output.csv")
+    assert scan.scan("db", "tweets", output) == []
+    assert [int(row["user_id"]) for row in read_rows(output)] == sorted(
+        timelines
+    )
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# util/scrape_caverlee.py against a local fake of statuses/user_timeline
+
+import datetime
+import http.server
+import json
+import threading
+import urllib.parse
+
+import bson
+import pytest
+
+from util import load_tweets, scrape_caverlee, user_index
+
+# user ID -> the IDs of the tweets in their timeline
+TIMELINES = {
+    "1": list(range(1000, 1450)),
+    "2": list(range(5000, 5010))
+}
+
+START = datetime.datetime(2011, 1, 1, tzinfo = datetime.timezone.utc)
+
+def fake_tweet(tweet_id, user_id):
+    created_at = START + datetime.timedelta(minutes = tweet_id)
+    return {
+        "id": tweet_id,
+        "text": "tweet %d" % tweet_id,
+        "created_at": created_at.strftime(load_tweets.TWITTER_DATE_FORMAT),
+        "user": {"id": int(user_id)}
+    }
+
+class TimelineHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(
+            urllib.parse.urlparse(self.path).query
+        ))
+        self.server.requests.append(params)
+
+        if (params["user_id"] not in TIMELINES):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        tweet_ids = sorted(TIMELINES[params["user_id"]], reverse = True)
+        if ("max_id" in params):
+            tweet_ids = [
+                tweet_id for tweet_id in tweet_ids
+                if (tweet_id <= int(params["max_id"]))
+            ]
+        body = json.dumps([
+            fake_tweet(tweet_id, params["user_id"])
+            for tweet_id in tweet_ids[:int(params["count"])]
+        ]).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("x-rate-limit-remaining", "100")
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def api():
+    """ The base URL of a fake Twitter API, with a list of the query
+    parameters of every request it received as its requests attribute """
+
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), TimelineHandler
+    )
+    server.requests = []
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def scraper(api, mongo, monkeypatch):
+    monkeypatch.setattr(
+        scrape_caverlee.pymongo, "MongoClient", lambda address: mongo
+    )
+    return scrape_caverlee.Scraper(
+        db = "caverlee_2011",
+        api_url = "http://127.0.0.1:%d/1.1" % api.server_address[1],
+        auth = lambda request: request
+    )
+
+def test_scrape_stores_prepared_tweets(scraper, mongo):
+    assert scraper.scrape(["1", "2", "3"], "spam", workers = 2) == 460
+
+    collection = mongo.caverlee_2011.spam
+    assert collection.count_documents({}) == 460
+    for tweet in collection.find():
+        assert tweet["_id"] == tweet["id"]
+        assert isinstance(tweet[user_index.MARKER_FIELD], bson.ObjectId)
+        created_at = START + datetime.timedelta(minutes = tweet["id"])
+        assert tweet["timestamp_ms"] == load_tweets.timestamp_ms(created_at)
+
+    progress = {
+        marker["user_id"]: marker
+        for marker in mongo.caverlee_2011[scrape_caverlee.PROGRESS_COLLECTION]
+            .find()
+    }
+    assert all(marker["done"] for marker in progress.values())
+    assert progress["3"]["error"] == "unavailable"
+    assert user_index.marker_field(collection) == user_index.MARKER_FIELD
+
+def test_scrape_resumes_from_the_last_page(scraper, api, mongo,
+                                          monkeypatch):
+    fetch_page = scraper.fetch_page
+    pages = []
+
+    def interrupt(user_id, max_id = None):
+        if (pages):
+            raise KeyboardInterrupt()
+        pages.append(max_id)
+        return fetch_page(user_id, max_id)
+
+    monkeypatch.setattr(scraper, "fetch_page", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        scraper.scrape_user("1", "spam")
+    monkeypatch.setattr(scraper, "fetch_page", fetch_page)
+
+    # the saved max_id continues below the last complete page
+    assert scraper.scrape_user("1", "spam") == 250
+    assert api.requests[1]["max_id"] == "1249"
+    assert mongo.caverlee_2011.spam.count_documents({}) == 450
+
+    # a finished user is not requested again, and tweets that are already
+    # stored are skipped
+    n_requests = len(api.requests)
+    assert scraper.scrape(["1"], "spam") == 0
+    assert len(api.requests) == n_requests
+    assert scraper.insert(
+        mongo.caverlee_2011.spam, [fake_tweet(1449, "1"), fake_tweet(1, "1")]
+    ) == 1
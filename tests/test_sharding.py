@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# the MongoDB lease queue of util/sharding.py
+
+import csv
+
+from util import sharding
+
+def make_queue(mongo, monkeypatch):
+    monkeypatch.setattr(
+        sharding.pymongo, "MongoClient", lambda address: mongo
+    )
+    return sharding.WorkQueue()
+
+def make_classifier(botdetector, mongo, addresses = None):
+    """ A Classifier that connects to mongo, recording the addresses it was
+    asked to connect to """
+
+    classifier = botdetector.Classifier()
+    def connect(db, collection, address = None):
+        if (addresses is not None):
+            addresses.append(address)
+        classifier.collection = mongo[db][collection]
+    classifier.connect = connect
+    return classifier
+
+def read_rows(path):
+    with open(path, "r") as f:
+        return sorted(
+            list(csv.DictReader(f)), key = lambda row: int(row["user_id"])
+        )
+
+def test_workers_process_every_shard(botdetector, configure, mongo,
+                                     insert_timelines, monkeypatch,
+                                     tmp_path):
+    configure({"classifier": {"max_tweets": 0, "pushdown": 0}})
+    timelines = insert_timelines(mongo.db.tweets, [2, 3, 4, 5, 6, 7])
+    queue = make_queue(mongo, monkeypatch)
+    assert queue.enqueue(
+        "job", "db", "tweets", sorted(timelines), 3, str(tmp_path)
+    ) == 3
+
+    classifier = make_classifier(botdetector, mongo)
+    assert sharding.work(queue, "job", classifier, "a") == 3
+    assert sharding.work(queue, "job", classifier, "b") == 0
+
+    shards = queue.shards("job")
+    assert all(shard["status"] == sharding.DONE for shard in shards)
+    merged = str(tmp_path / "merged.csv")
+    assert sharding.merge(
+        [shard["output"] for shard in shards], merged
+    ) == len(timelines)
+
+def test_worker_that_lost_its_lease_stops_writing(botdetector, configure,
+                                                  mongo, insert_timelines,
+                                                  monkeypatch, tmp_path):
+    configure({"classifier": {"max_tweets": 0, "pushdown": 0}})
+    timelines = insert_timelines(mongo.db.tweets, [2, 3, 4, 5, 6, 7])
+    user_ids = sorted(timelines)
+    queue = make_queue(mongo, monkeypatch)
+    queue.enqueue("job", "db", "tweets", user_ids, 1, str(tmp_path))
+
+    expected = str(tmp_path / "expected.csv")
+    reference = make_classifier(botdetector, mongo)
+    reference.collection = mongo.db.tweets
+    reference.gen_feature_matrix(user_ids, expected)
+
+    stalled = make_classifier(botdetector, mongo)
+    extract = stalled.iter_user_features
+    n_taken_over = []
+
+    def stall(user_ids, **kwargs):
+        for (i, item) in enumerate(extract(user_ids, **kwargs)):
+            if (i == 2):
+                # the worker stalls past its lease while extracting the third
+                # user, and another worker takes the shard over and finishes
+                # it
+                mongo.botdetector.shards.update_one(
+                    {}, {"$set": {"lease_expires": 0}}
+                )
+                n_taken_over.append(sharding.work(
+                    queue, "job", make_classifier(botdetector, mongo), "b"
+                ))
+            yield item
+
+    stalled.iter_user_features = stall
+    assert sharding.work(queue, "job", stalled, "a") == 0
+    assert n_taken_over == [1]
+
+    (shard,) = queue.shards("job")
+    assert shard["status"] == sharding.DONE
+    assert shard["worker"] == "b"
+    assert read_rows(shard["output"]) == read_rows(expected)
+    assert stalled.read_checkpoint(shard["output"])["done"] == set(user_ids)
+
+def test_renew_and_holds_follow_the_lease_token(mongo, monkeypatch):
+    queue = make_queue(mongo, monkeypatch)
+    queue.enqueue("job", "db", "tweets", [1, 2, 3], 1, "shards")
+
+    first = queue.claim("job", "a", lease_seconds = 60)
+    assert queue.holds(first)
+    assert queue.claim("job", "b") is None
+
+    mongo.botdetector.shards.update_one({}, {"$set": {"lease_expires": 0}})
+    assert not queue.holds(first)
+    second = queue.claim("job", "a", lease_seconds = 60)
+
+    # the same worker name does not revive the old claim
+    assert not queue.renew(first)
+    assert not queue.holds(first)
+    assert queue.renew(second)
+    assert queue.holds(second, margin = 30)
+
+def test_workers_connect_to_the_tweet_database(botdetector, configure, mongo,
+                                               insert_timelines, monkeypatch,
+                                               tmp_path):
+    configure({"classifier": {"max_tweets": 0, "pushdown": 0}})
+    timelines = insert_timelines(mongo.db.tweets, [2, 3, 4])
+    queue = make_queue(mongo, monkeypatch)
+    n_shards = queue.enqueue(
+        "job", "db", "tweets", sorted(timelines), 2, str(tmp_path),
+        "tweets.example.com:27017"
+    )
+
+    addresses = []
+    classifier = make_classifier(botdetector, mongo, addresses)
+    assert sharding.work(queue, "job", classifier, "a") == n_shards
+    assert addresses == ["tweets.example.com:27017"] * n_shards
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# time limits on feature extractors
+
+import threading
+import time
+
+import pytest
+
+release = threading.Event()
+
+@pytest.fixture
+def extractor(botdetector, configure, monkeypatch):
+    from feature_extractors.templates import PerTweetAverage
+
+    class Stall(PerTweetAverage):
+        """ A fused feature extractor that stalls on every tweet until
+        released, like one that waits on a network request """
+
+        blocking = True
+
+        def value(self, tweet, shared):
+            release.wait(30)
+            return 1
+
+    monkeypatch.setitem(botdetector.FEATURE_EXTRACTORS, "Stall", Stall)
+    configure({"classifier": {"extractor_timeout": 0.2}})
+    release.clear()
+    yield botdetector.FeatureExtractor()
+    release.set()
+
+def test_blocking_extractors_are_bounded(extractor, insert_timelines, mongo):
+    (user, tweets) = next(iter(
+        insert_timelines(mongo.db.tweets, [20]).values()
+    ))
+    start = time.perf_counter()
+
+    results = extractor.extract_features(user, tweets, ["Stall", "TweetCount"])
+
+    assert time.perf_counter() - start < 5
+    assert results["imputed"] == "Stall"
+    assert results["Stall"] == 0
+    assert results["TweetCount"] == 20
+
+def test_blocking_extractors_are_not_streamed(extractor, insert_timelines,
+                                              mongo):
+    (user, tweets) = next(iter(
+        insert_timelines(mongo.db.tweets, [20]).values()
+    ))
+    chunks = [(user, tweets[:10]), (user, tweets[10:])]
+    start = time.perf_counter()
+
+    (user, results, n_tweets) = extractor.extract_features_chunked(
+        chunks, ["Stall", "TweetCount"], 5, seed = 0
+    )
+
+    assert time.perf_counter() - start < 5
+    assert n_tweets == 20
+    assert results["imputed"] == "Stall"
+    assert results["Stall"] == 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# training CRM114 straight from the caverlee-2011 archive
+
+import importlib
+import io
+import os
+import sys
+import types
+import zipfile
+
+import pytest
+
+TWEETS = {
+    "legitimate_users_tweets.txt": [
+        b"1\t11\tgood morning\t2010-01-01 00:00:00",
+        b"1\t12\tlunch time\t2010-01-01 12:00:00"
+    ],
+    "content_polluters_tweets.txt": [
+        b"2\t21\tcheap pills http://spam.example\t2010-01-01 00:00:00"
+    ]
+}
+USERS = {
+    "legitimate_users.txt": b"1\t2009-01-01 00:00:00\n",
+    "content_polluters.txt": b"2\t2009-01-01 00:00:00\n"
+}
+
+class FakeStdin(io.BytesIO):
+    """ Keeps what was written to it when it is closed """
+
+    def close(self):
+        self.written = self.getvalue()
+        super().close()
+
+class FakeCrm(object):
+    """ Stands in for a crm process, recording the learned text """
+
+    processes = []
+
+    def __init__(self, args, stdin = None, stdout = None):
+        self.args = args
+        self.stdin = FakeStdin()
+        self.returncode = 0
+        FakeCrm.processes.append(self)
+
+    def wait(self):
+        return self.returncode
+
+@pytest.fixture
+def train_crm114(monkeypatch, tmp_path):
+    """ util.train_crm114 with a stub crm114 module and crm binary """
+
+    monkeypatch.setitem(sys.modules, "crm114", types.ModuleType("crm114"))
+    monkeypatch.delitem(sys.modules, "util.train_crm114", raising = False)
+    module = importlib.import_module("util.train_crm114")
+    monkeypatch.setattr(module.subprocess, "Popen", FakeCrm)
+    monkeypatch.setattr(module, "OUT_DIR", str(tmp_path / "caverlee_2011"))
+    FakeCrm.processes = []
+    return module
+
+def write_archive(path, tweets = TWEETS):
+    with zipfile.ZipFile(path, "w") as z:
+        for (name, lines) in tweets.items():
+            z.writestr("caverlee-2011/%s" % name, b"\n".join(lines) + b"\n")
+        for (name, content) in USERS.items():
+            z.writestr("caverlee-2011/%s" % name, content)
+
+def learned():
+    """ Map the .css file of each crm process to the text it learned """
+
+    return {
+        process.args[1].split("(")[1].split(")")[0]: process.stdin.written
+        for process in FakeCrm.processes
+    }
+
+def test_train_from_archive(train_crm114, tmp_path):
+    archive_path = str(tmp_path / "caverlee-2011.zip")
+    write_archive(archive_path)
+    crm114_dir = str(tmp_path / "crm114")
+
+    assert train_crm114.train_from_archive(crm114_dir, archive_path)
+    assert learned() == {
+        "%s/ham.css" % crm114_dir: b"good morning\nlunch time\n",
+        "%s/spam.css" % crm114_dir: b"cheap pills http://spam.example\n"
+    }
+    assert all(
+        process.args[0] == "crm" and "learn" in process.args[1]
+        for process in FakeCrm.processes
+    )
+    for (name, content) in USERS.items():
+        with open(os.path.join(train_crm114.OUT_DIR, name), "rb") as f:
+            assert f.read() == content
+    with open(os.path.join(crm114_dir, train_crm114.CHECKSUM_FILE)) as f:
+        assert f.read() == train_crm114.sha256sum(archive_path)
+
+    # an unchanged archive is not trained on again
+    FakeCrm.processes = []
+    assert train_crm114.train_from_archive(crm114_dir, archive_path)
+    assert FakeCrm.processes == []
+
+    # a changed one is, from scratch
+    with open(os.path.join(crm114_dir, "ham.css"), "w") as f:
+        f.write("old")
+    write_archive(archive_path, dict(TWEETS, **{
+        "content_polluters_tweets.txt": [b"2\t22\tfollow back\t"]
+    }))
+    assert train_crm114.train_from_archive(crm114_dir, archive_path)
+    assert learned()["%s/spam.css" % crm114_dir] == b"follow back\n"
+    assert not os.path.exists(os.path.join(crm114_dir, "ham.css"))
+
+def test_failed_training_is_not_recorded(train_crm114, monkeypatch, tmp_path):
+    archive_path = str(tmp_path / "caverlee-2011.zip")
+    write_archive(archive_path)
+    crm114_dir = str(tmp_path / "crm114")
+    monkeypatch.setattr(FakeCrm, "wait", lambda self: 1)
+
+    with pytest.raises(train_crm114.subprocess.CalledProcessError):
+        train_crm114.train_from_archive(crm114_dir, archive_path)
+    assert not os.path.exists(
+        os.path.join(crm114_dir, train_crm114.CHECKSUM_FILE)
+    )
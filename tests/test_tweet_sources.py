@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# scoring tweets by their annotated source
+
+import pytest
+
+def source(client):
+    return "<a href=\"http://%s/\" rel=\"nofollow\">%s</a>" % (client, client)
+
+@pytest.fixture
+def tweet_sources(botdetector, configure, tmp_path):
+    training = tmp_path / "training"
+    training.mkdir(exist_ok = True)
+    (training / "twitter_clients.csv").write_text(
+        "COUNT,CLIENT,MOSTLY_BOT\n"
+        "10,instagram.com,-1\n"
+        "8,foursquare.com,0\n"
+        "5,twitterfeed.com,1\n"
+        "3,unknown.com,?\n"
+    )
+    return botdetector.FEATURE_EXTRACTORS["TweetSources"]()
+
+def test_tweets_without_a_known_source_are_not_counted(tweet_sources):
+    tweets = [
+        {"source": source("twitterfeed.com")},
+        {"source": source("instagram.com")},
+        {"source": source("twitterfeed.com")},
+        {"source": source("unknown.com")},
+        {"source": "web"},
+        {"source": ""},
+        {}
+    ]
+
+    assert tweet_sources.run({}, tweets) == pytest.approx(1 / 3)
+    assert tweet_sources.run({}, [{}, {"source": "web"}]) == 0
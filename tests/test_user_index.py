@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# the distinct-user index of util/user_index.py
+
+import pytest
+
+from util import user_index
+
+def emulate_merge(collection, monkeypatch):
+    """ Apply the $merge stage of user_index.update in Python, as mongomock
+    does not support it """
+
+    aggregate = collection.aggregate
+
+    def merge(pipeline, **kwargs):
+        if ("$merge" not in pipeline[-1]):
+            return aggregate(pipeline, **kwargs)
+        index = collection.database[pipeline[-1]["$merge"]["into"]]
+        for doc in aggregate(pipeline[:-1], **kwargs):
+            index.update_one({"_id": doc["_id"]}, {
+                "$inc": {"tweet_count": doc["tweet_count"]},
+                "$min": {"first_timestamp_ms": doc["first_timestamp_ms"]},
+                "$max": {"last_timestamp_ms": doc["last_timestamp_ms"]}
+            }, upsert = True)
+        return iter([])
+
+    monkeypatch.setattr(collection, "aggregate", merge)
+
+def insert(collection, user, tweets, marked = True):
+    docs = [dict(tweet, _id = tweet["id"], user = user) for tweet in tweets]
+    collection.insert_many(user_index.mark(docs) if marked else docs)
+
+def expected_index(timelines):
+    return {
+        user_id: {
+            "_id": user_id,
+            "tweet_count": len(tweets),
+            "first_timestamp_ms": min(
+                int(tweet["timestamp_ms"]) for tweet in tweets
+            ),
+            "last_timestamp_ms": max(
+                int(tweet["timestamp_ms"]) for tweet in tweets
+            )
+        }
+        for (user_id, (user, tweets)) in timelines.items()
+    }
+
+def read_index(collection):
+    return {
+        doc["_id"]: doc for doc in user_index.index_of(collection).find()
+    }
+
+def test_build_and_sample(mongo, insert_timelines):
+    collection = mongo.db.tweets
+    timelines = insert_timelines(collection, [1, 4, 9, 16, 25])
+    user_index.build(collection)
+
+    assert user_index.exists(collection)
+    assert read_index(collection) == expected_index(timelines)
+
+    assert sorted(user_index.sample(collection, 10)) == sorted(timelines)
+    assert sorted(user_index.sample(collection, 10, 4, 17)) == sorted(
+        user_id for (user_id, (user, tweets)) in timelines.items()
+        if (4 <= len(tweets) < 17)
+    )
+    buckets = user_index.sample_stratified(collection, 10, [1, 10])
+    assert sorted(buckets) == [(1, 10), (10, None)]
+    assert len(buckets[(1, 10)]) == 3 and len(buckets[(10, None)]) == 2
+
+def test_update_finds_tweets_by_insertion_marker(mongo, insert_timelines,
+                                                 monkeypatch):
+    collection = mongo.db.tweets
+    user_index.create_marker_index(collection)
+    timelines = insert_timelines(mongo.scratch.tweets, [6, 8, 3], seed = 1)
+    ((a, a_tweets), (b, b_tweets), (c, c_tweets)) = timelines.values()
+
+    insert(collection, a, a_tweets[3:])
+    insert(collection, b, b_tweets)
+    user_index.build(collection)
+    assert user_index.marker_field(collection) == user_index.MARKER_FIELD
+
+    # tweets inserted later have lower tweet IDs than the ones indexed
+    # already, so only the insertion marker can tell that they are new
+    emulate_merge(collection, monkeypatch)
+    insert(collection, a, a_tweets[:3])
+    insert(collection, c, c_tweets)
+    assert min(tweet["id"] for tweet in a_tweets[:3]) < max(
+        tweet["id"] for tweet in b_tweets
+    )
+    user_index.update(collection)
+
+    assert read_index(collection) == expected_index(timelines)
+
+    # nothing was inserted since
+    user_index.update(collection)
+    assert read_index(collection) == expected_index(timelines)
+
+def test_update_without_marker_rebuilds(mongo, insert_timelines,
+                                        monkeypatch):
+    collection = mongo.db.tweets
+    timelines = insert_timelines(mongo.scratch.tweets, [5, 7], seed = 2)
+    ((a, a_tweets), (b, b_tweets)) = timelines.values()
+
+    insert(collection, a, a_tweets, marked = False)
+    user_index.update(collection)
+    assert user_index.marker_field(collection) is None
+
+    aggregate = collection.aggregate
+
+    def rebuild_only(pipeline, **kwargs):
+        assert "$merge" not in pipeline[-1]
+        return aggregate(pipeline, **kwargs)
+
+    monkeypatch.setattr(collection, "aggregate", rebuild_only)
+
+    insert(collection, b, b_tweets, marked = False)
+    user_index.update(collection)
+    assert read_index(collection) == expected_index(timelines)
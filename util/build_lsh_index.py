@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# build the MinHash LSH index used by the CrossUserDuplicateProportion feature
+# extractor in a single streaming pass over one or more tweet collections
+
+import pymongo
+import sys
+import time
+
+from lib.minhash import LSHIndex, MinHasher
+
+BATCH_SIZE = 10000
+
+def build(index, collection, batch_size = BATCH_SIZE):
+    """ Add every tweet of a collection to an LSH index
+
+    Args:
+        index: A lib.minhash.LSHIndex object
+        collection: A pymongo.collection.Collection of tweets
+        batch_size: The number of tweets to add per transaction
+
+    Returns:
+        The number of tweets added
+    """
+
+    seen = 0
+    batch = []
+    start = time.time()
+    last_report = start
+
+    cursor = collection.find(
+        {"text": {"$exists": True}},
+        {"_id": 0, "text": 1, "user.id": 1},
+        no_cursor_timeout = True,
+        batch_size = batch_size
+    )
+
+    for doc in cursor:
+        batch.append((doc["user"]["id"], doc["text"]))
+        if (len(batch) == batch_size):
+            index.add(batch)
+            seen += len(batch)
+            batch = []
+
+            if (time.time() - last_report > 1):
+                last_report = time.time()
+                sys.stdout.write("\rIndexed %d tweets (%d/s)" % (
+                    seen, seen / (last_report - start)
+                ))
+                sys.stdout.flush()
+
+    cursor.close()
+
+    if (batch):
+        index.add(batch)
+        seen += len(batch)
+
+    print("\rIndexed %d tweets from %s" % (seen, collection.full_name))
+
+    return seen
+
+if (__name__ == "__main__"):
+    import optparse
+
+    from util import config_loader
+
+    config = config_loader.ConfigLoader().load()
+    feature_config = config["feature_extractors"]
+
+    parser = optparse.OptionParser(
+        usage = "%prog [options] COLLECTION [COLLECTION ...]"
+    )
+
+    parser.add_option("-a", "--address", dest = "address",
+                      default = "localhost:27017",
+                      help = "The host and port where Mongo is located")
+    parser.add_option("-d", "--db", dest = "db",
+                      help = "The database where the tweets are stored")
+    parser.add_option("-o", "--output", dest = "output",
+                      default = feature_config["lsh_index"],
+                      help = "The path of the index")
+    (options, args) = parser.parse_args()
+
+    if (not (options.db and args)):
+        parser.print_help()
+    else:
+        index = LSHIndex(options.output, MinHasher(
+            int(feature_config["lsh_bands"]), int(feature_config["lsh_rows"])
+        ))
+        db = pymongo.MongoClient(options.address)[options.db]
+        for collection in args:
+            build(index, db[collection])
+        index.close()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# cross-validate the classifier on feature matrices written by
+# gen_feature_matrix, without extracting any features again
+#
+# usage:
+#     python3 -m util.evaluate spam.csv ham.csv
+#     python3 -m util.evaluate spam.csv ham.csv -k 10 -s drop-one -n 10,50,100
+#
+# Every combination of feature subset, n_estimators and fold is trained in
+# parallel processes. The extraction cost of each feature is read from the
+# .costs.json files that gen_feature_matrix writes next to the matrices.
+
+import csv
+import json
+import multiprocessing
+import os
+
+import numpy
+import sklearn.ensemble
+import sklearn.metrics
+import sklearn.model_selection
+
+from lib.metrics import COSTS_SUFFIX
+from util.sharding import ID_COLUMNS
+
+SWEEPS = ["all", "drop-one", "each"]
+
+# key of the time spent in MongoDB aggregations in the dictionary returned by
+# feature_costs
+PUSHDOWN = "pushdown"
+
+# state of the worker processes, set by _init_worker
+_X = None
+_y = None
+
+def load_matrix(csv_path):
+    """ Load a feature matrix
+
+    Args:
+        csv_path: The path to a CSV written by gen_feature_matrix
+
+    Returns:
+        A tuple containing the list of features and a numpy array with one
+        row per user
+    """
+
+    with open(csv_path, "r") as f:
+        reader = csv.DictReader(f)
+        features = [
+            column for column in reader.fieldnames
+            if (column not in ID_COLUMNS)
+        ]
+        rows = [
+            [float(row[feature]) for feature in features]
+            for row in reader
+        ]
+
+    return (features, numpy.array(rows, dtype = numpy.float64).reshape(
+        len(rows), len(features)
+    ))
+
+def load_dataset(spam_csv, ham_csv):
+    """ Load the spam and ham feature matrices as one labelled dataset
+
+    Args:
+        spam_csv: The path to the spam feature matrix
+        ham_csv: The path to the ham feature matrix
+
+    Returns:
+        A tuple containing the list of features, the feature array, and an
+        array of labels where 1 is spam and 0 is ham
+    """
+
+    (spam_features, spam) = load_matrix(spam_csv)
+    (ham_features, ham) = load_matrix(ham_csv)
+    if (spam_features != ham_features):
+        raise Exception("%s and %s have different features" % (
+            spam_csv, ham_csv
+        ))
+
+    return (
+        spam_features,
+        numpy.vstack([spam, ham]),
+        numpy.concatenate([
+            numpy.ones(len(spam), dtype = int),
+            numpy.zeros(len(ham), dtype = int)
+        ])
+    )
+
+def feature_subsets(features, sweep = "all"):
+    """ Generate the feature subsets of a sweep
+
+    Args:
+        features: A list of features
+        sweep: "all" for only the full set, "drop-one" for the full set and
+            every set with one feature left out, or "each" for the full set
+            and every feature on its own
+
+    Returns:
+        A list of lists of features
+    """
+
+    subsets = [list(features)]
+    if (len(features) > 1):
+        if (sweep == "drop-one"):
+            subsets += [
+                [other for other in features if (other != feature)]
+                for feature in features
+            ]
+        elif (sweep == "each"):
+            subsets += [[feature] for feature in features]
+    return subsets
+
+def _init_worker(X, y):
+    global _X, _y
+    (_X, _y) = (X, y)
+
+def _evaluate_fold(args):
+    """ Train and score a random forest on one fold
+
+    Args:
+        args: A tuple containing the column indices of the features, the
+            number of trees, the train and test row indices, and a seed
+
+    Returns:
+        A dictionary with the precision, recall and AUC of spam detection
+    """
+
+    (columns, n_estimators, train, test, seed) = args
+
+    forest = sklearn.ensemble.RandomForestClassifier(
+        n_estimators = n_estimators, random_state = seed, n_jobs = 1
+    )
+    forest.fit(_X[train][:, columns], _y[train])
+
+    spam_column = list(forest.classes_).index(1)
+    probabilities = forest.predict_proba(_X[test][:, columns])[:, spam_column]
+    predictions = (probabilities > 0.5).astype(int)
+
+    return {
+        "precision": sklearn.metrics.precision_score(
+            _y[test], predictions, zero_division = 0
+        ),
+        "recall": sklearn.metrics.recall_score(
+            _y[test], predictions, zero_division = 0
+        ),
+        "auc": sklearn.metrics.roc_auc_score(_y[test], probabilities)
+    }
+
+def cross_validate(features, X, y, subsets, n_estimators = (10,), k = 5,
+                   seed = 0, processes = None):
+    """ Run stratified k-fold cross-validation for every configuration
+
+    The folds are the same for every configuration, and all configurations
+    and folds are evaluated in parallel.
+
+    Args:
+        features: The list of features of the columns of X
+        X: A feature array
+        y: An array of labels where 1 is spam and 0 is ham
+        subsets: A list of lists of features to evaluate
+        n_estimators: A list of random forest sizes to evaluate
+        k: The number of folds
+        seed: A seed for the folds and the forests
+        processes: The number of worker processes; defaults to the number of
+            CPUs
+
+    Returns:
+        A list with a dictionary per configuration, containing its
+        "features" and "n_estimators", and the mean and standard deviation
+        over the folds of its "precision", "recall" and "auc"
+    """
+
+    folds = list(sklearn.model_selection.StratifiedKFold(
+        n_splits = k, shuffle = True, random_state = seed
+    ).split(X, y))
+
+    configurations = [
+        (subset, n_trees) for subset in subsets for n_trees in n_estimators
+    ]
+    tasks = [
+        (
+            [features.index(feature) for feature in subset],
+            n_trees, train, test, seed
+        )
+        for (subset, n_trees) in configurations
+        for (train, test) in folds
+    ]
+
+    with multiprocessing.Pool(processes, _init_worker, (X, y)) as pool:
+        scores = pool.map(_evaluate_fold, tasks)
+
+    results = []
+    for (i, (subset, n_trees)) in enumerate(configurations):
+        fold_scores = scores[i * k:(i + 1) * k]
+        result = {"features": subset, "n_estimators": n_trees}
+        for metric in ("precision", "recall", "auc"):
+            values = [score[metric] for score in fold_scores]
+            result[metric] = float(numpy.mean(values))
+            result["%s_std" % metric] = float(numpy.std(values))
+        results.append(result)
+
+    return results
+
+def feature_costs(csv_paths, features):
+    """ Estimate the extraction time per user of each feature
+
+    Features that were computed by a MongoDB aggregation (see
+    classifier.pushdown) have no timings of their own and cost nothing
+    here; the time of the aggregations is reported separately under
+    PUSHDOWN, since it can not be attributed to any one feature.
+
+    Args:
+        csv_paths: The paths to the feature matrices
+        features: The list of features
+
+    Returns:
+        A dictionary mapping features to seconds per user, or to None if no
+        costs were recorded, and PUSHDOWN to the seconds per user spent in
+        aggregations, or to None if no aggregations were run
+    """
+
+    calls = dict.fromkeys(features, 0)
+    seconds = dict.fromkeys(features, 0.0)
+    pushdown_users = 0
+    pushdown_seconds = 0.0
+
+    for csv_path in csv_paths:
+        costs_path = "%s%s" % (csv_path, COSTS_SUFFIX)
+        if (not os.path.isfile(costs_path)):
+            continue
+        with open(costs_path, "r") as f:
+            costs = json.load(f)
+        for (feature, entry) in costs["extractors"].items():
+            if (feature in calls):
+                calls[feature] += entry["calls"]
+                seconds[feature] += entry.get("wall_seconds", 0.0)
+        pushdown_users += costs["pushdown"]["users"]
+        pushdown_seconds += costs["pushdown"]["wall_seconds"]
+
+    costs = {
+        feature: (
+            (seconds[feature] / calls[feature]) if calls[feature]
+            else 0.0 if pushdown_users
+            else None
+        )
+        for feature in features
+    }
+    costs[PUSHDOWN] = (
+        (pushdown_seconds / pushdown_users) if pushdown_users else None
+    )
+
+    return costs
+
+def report(results, costs):
+    """ Format cross-validation results as a table
+
+    The extraction cost of a feature subset does not include the time
+    spent in aggregations, which is listed on its own line.
+
+    Args:
+        results: A list returned by cross_validate
+        costs: A dictionary returned by feature_costs
+
+    Returns:
+        A string
+    """
+
+    lines = ["%-9s %-5s %-15s %-15s %-15s %-10s %s" % (
+        "features", "trees", "precision", "recall", "auc", "ms/user",
+        "subset"
+    )]
+
+    for result in sorted(results, key = lambda result: -result["auc"]):
+        subset_costs = [costs[feature] for feature in result["features"]]
+        if (None in subset_costs):
+            cost = "-"
+        else:
+            cost = "%.3f" % (sum(subset_costs) * 1000)
+        lines.append("%-9d %-5d %-15s %-15s %-15s %-10s %s" % (
+            len(result["features"]), result["n_estimators"],
+            "%.3f +- %.3f" % (result["precision"], result["precision_std"]),
+            "%.3f +- %.3f" % (result["recall"], result["recall_std"]),
+            "%.3f +- %.3f" % (result["auc"], result["auc_std"]),
+            cost, ",".join(result["features"])
+        ))
+
+    lines.append("")
+    lines.append("extraction cost per user:")
+    for (feature, cost) in sorted(
+        [item for item in costs.items() if (item[0] != PUSHDOWN)],
+        key = lambda item: -(item[1] or 0)
+    ):
+        lines.append("  %-32s %s" % (
+            feature, "-" if (cost is None) else "%.3f ms" % (cost * 1000)
+        ))
+    if (costs.get(PUSHDOWN) is not None):
+        lines.append("  %-32s %.3f ms" % (
+            "(MongoDB aggregations)", costs[PUSHDOWN] * 1000
+        ))
+
+    return "\n".join(lines)
+
+def evaluate(spam_csv, ham_csv, sweep = "all", n_estimators = (10,), k = 5,
+             seed = 0, processes = None):
+    """ Load feature matrices, cross-validate and report
+
+    Returns:
+        A tuple containing the list returned by cross_validate and the
+        report string
+    """
+
+    (features, X, y) = load_dataset(spam_csv, ham_csv)
+    results = cross_validate(
+        features, X, y, feature_subsets(features, sweep), n_estimators, k,
+        seed, processes
+    )
+    costs = feature_costs([spam_csv, ham_csv], features)
+    return (results, report(results, costs))
+
+if (__name__ == "__main__"):
+    import optparse
+
+    parser = optparse.OptionParser(
+        usage = "%prog [options] SPAM_CSV HAM_CSV"
+    )
+
+    parser.add_option("-k", "--folds", dest = "k", type = "int", default = 5,
+                      help = "The number of cross-validation folds")
+    parser.add_option("-s", "--sweep", dest = "sweep", default = "all",
+                      choices = SWEEPS,
+                      help = "The feature subsets to evaluate: all, drop-one "
+                             "or each")
+    parser.add_option("-n", "--n-estimators", dest = "n_estimators",
+                      default = "10",
+                      help = "A comma-separated list of random forest sizes")
+    parser.add_option("-p", "--processes", dest = "processes", type = "int",
+                      help = "The number of worker processes")
+    parser.add_option("--seed", dest = "seed", type = "int", default = 0,
+                      help = "Seed for the folds and the forests")
+    parser.add_option("-o", "--output", dest = "output",
+                      help = "A JSON file to write the results to")
+    (options, args) = parser.parse_args()
+
+    if (len(args) != 2):
+        parser.print_help()
+    else:
+        (results, text) = evaluate(
+            args[0], args[1], options.sweep,
+            [int(n) for n in options.n_estimators.split(",")],
+            options.k, options.seed, options.processes
+        )
+        print(text)
+        if (options.output):
+            with open(options.output, "w") as f:
+                json.dump(results, f, indent = 4)
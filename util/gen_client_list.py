@@ -1,23 +1,62 @@
 #!/usr/bin/env python3
 # build a list of Twitter clients by parsing the tweets of a MongoDB collection
 
-import csv
+import collections
+import multiprocessing
+import os
 import pymongo
 import sys
+import time
 
 OUTPUT_FILE = "twitter_clients.csv"
 
-WRITE_INTERVAL = 10000
+# minimum number of seconds between progress reports and snapshots
+PROGRESS_INTERVAL = 1
+SNAPSHOT_INTERVAL = 60
+
+# number of _ids sampled per worker to split the collection into ranges
+SAMPLES_PER_WORKER = 100
+
+# server-side equivalent of clean_source: the third "/"-separated part of the
+# second "\""-separated part of the source, or missing if there is none
+CLIENT_EXPRESSION = {"$arrayElemAt": [
+    {"$split": [
+        {"$arrayElemAt": [{"$split": ["$source", "\""]}, 1]},
+        "/"
+    ]},
+    2
+]}
+
+def clean_source(source):
+    """ Extract the client domain from a tweet's "source" HTML
+
+    Args:
+        source: The "source" field of a tweet
+
+    Returns:
+        The client domain, or None if it can not be parsed, e.g. because
+        source is not a string
+    """
+
+    try:
+        return source.split("\"")[1].split("/")[2]
+    except (AttributeError, IndexError):
+        return None
 
 def write(output_file, dict_):
     """ Write a tally dictionary to a CSV file
 
+    The tally is written to a temporary file first, which then replaces
+    output_file, so that a snapshot is never left half-written.
+
     Args:
         output_file: The path of the output file
         dict_: A dictionary where the keys are strings and the values are ints
     """
 
-    with open(output_file, "w") as f:
+    temp_file = "%s.tmp" % output_file
+
+    with open(temp_file, "w") as f:
         f.write("COUNT,CLIENT\n")
 
         for row in sorted(
@@ -27,40 +66,212 @@ def write(output_file, dict_):
         ):
             f.write("%s,%s\n" % (row[1], row[0]))
 
-def main(address, db, collection, output_file = OUTPUT_FILE):
-    clients = {}
+    os.replace(temp_file, output_file)
+
+class Progress(object):
+    """ Rate-limited progress reporting on a single terminal line """
+
+    def __init__(self, interval = PROGRESS_INTERVAL):
+        self.interval = interval
+        self.start = time.time()
+        self._last = 0
+
+    def report(self, message, force = False):
+        now = time.time()
+        if (force or (now - self._last >= self.interval)):
+            self._last = now
+            sys.stdout.write("\r%s (%ds)          " % (
+                message, now - self.start
+            ))
+            sys.stdout.flush()
+
+def tally_aggregate(collection):
+    """ Tally clients with a single aggregation on the MongoDB server
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+
+    Returns:
+        A collections.Counter of clients
+    """
+
+    clients = collections.Counter()
+
+    for doc in collection.aggregate([
+        # sources without a quote can not be parsed; drop them before $split
+        {"$match": {"source": {"$type": "string", "$regex": "\""}}},
+        {"$group": {"_id": CLIENT_EXPRESSION, "count": {"$sum": 1}}},
+        {"$match": {"_id": {"$ne": None}}}
+    ], allowDiskUse = True):
+        clients[doc["_id"]] = doc["count"]
+
+    return clients
+
+def _scan_range(args):
+    """ Tally the clients of the tweets in a range of _ids
+
+    Args:
+        args: A tuple containing the address, database and collection of the
+            tweets, and the lower (inclusive) and upper (exclusive) _id bounds
+            of the range, where None means unbounded
+
+    Returns:
+        A tuple containing a collections.Counter of clients and the number of
+        tweets scanned
+    """
+
+    (address, db, collection, lower, upper) = args
+
+    query = {"source": {"$exists": True}}
+    id_range = {}
+    if (lower is not None):
+        id_range["$gte"] = lower
+    if (upper is not None):
+        id_range["$lt"] = upper
+    if (id_range):
+        query["_id"] = id_range
+
+    clients = collections.Counter()
+    seen = 0
+
+    client = pymongo.MongoClient(address)
+    cursor = client[db][collection].find(
+        query, {"_id": 0, "source": 1}, no_cursor_timeout = True
+    )
+    for tweet in cursor:
+        seen += 1
+        source = clean_source(tweet["source"])
+        if (source is not None):
+            clients[source] += 1
+    cursor.close()
+    client.close()
+
+    return (clients, seen)
+
+def tally_parallel(address, db, collection, n_workers, output_file = None):
+    """ Tally clients by scanning _id ranges of the collection in parallel
+
+    The range boundaries are quantiles of a random sample of _ids, so that the
+    ranges contain roughly the same number of tweets.
+
+    Args:
+        address: The host and port where Mongo is located
+        db: The database where the tweets are stored
+        collection: The collection where the tweets are stored
+        n_workers: The number of worker processes
+        output_file: If given, a snapshot of the tally is written here as
+            ranges finish, at most once every SNAPSHOT_INTERVAL seconds
+
+    Returns:
+        A collections.Counter of clients
+    """
+
+    n_ranges = n_workers * 4
+    sample = sorted(
+        doc["_id"]
+        for doc in pymongo.MongoClient(address)[db][collection].aggregate([
+            {"$sample": {"size": n_workers * SAMPLES_PER_WORKER}},
+            {"$project": {"_id": 1}}
+        ])
+    )
+    boundaries = [
+        sample[i * len(sample) // n_ranges] for i in range(1, n_ranges)
+    ] if sample else []
+    boundaries = sorted(set(boundaries))
+    ranges = list(zip([None] + boundaries, boundaries + [None]))
+
+    clients = collections.Counter()
     seen = 0
+    progress = Progress()
+    last_snapshot = time.time()
+
+    with multiprocessing.Pool(n_workers) as pool:
+        for (i, (range_clients, range_seen)) in enumerate(
+            pool.imap_unordered(_scan_range, [
+                (address, db, collection, lower, upper)
+                for (lower, upper) in ranges
+            ])
+        ):
+            clients.update(range_clients)
+            seen += range_seen
+            progress.report("Processed %d tweets, %d/%d ranges" % (
+                seen, i + 1, len(ranges)
+            ))
+
+            if (output_file
+                    and (time.time() - last_snapshot > SNAPSHOT_INTERVAL)):
+                last_snapshot = time.time()
+                write(output_file, clients)
+
+    progress.report("Processed %d tweets" % seen, force = True)
+    print()
+
+    return clients
+
+def tally_scan(address, db, collection, output_file = None):
+    """ Tally clients by iterating over the collection in Python
+
+    Args:
+        address: The host and port where Mongo is located
+        db: The database where the tweets are stored
+        collection: The collection where the tweets are stored
+        output_file: If given, a snapshot of the tally is written here at
+            most once every SNAPSHOT_INTERVAL seconds
+
+    Returns:
+        A collections.Counter of clients
+    """
+
+    clients = collections.Counter()
+    seen = 0
+    progress = Progress()
+    last_snapshot = time.time()
 
     cursor = pymongo.MongoClient(address)[db][collection].find(
         {"source": {"$exists": True}},
+        {"_id": 0, "source": 1},
         no_cursor_timeout = True
     )
 
     for tweet in cursor:
-        try:
-            source = tweet["source"].split("\"")[1].split("/")[2]
-        except IndexError:
-            continue
-
-        if (not source in clients):
-            sys.stdout.write("\rFound new client: %s          \n" % source)
-            sys.stdout.flush()
-            clients[source] = 1
-        else:
+        seen += 1
+        source = clean_source(tweet["source"])
+        if (source is not None):
             clients[source] += 1
 
-        seen += 1
-        sys.stdout.write("\rProcessed %d tweets" % seen)
-        sys.stdout.flush()
+        progress.report("Processed %d tweets, found %d clients" % (
+            seen, len(clients)
+        ))
 
-        if (seen % WRITE_INTERVAL == 0):
-            sys.stdout.write("\rWriting snapshot of tallies          \n")
-            sys.stdout.flush()
+        if (output_file
+                and (time.time() - last_snapshot > SNAPSHOT_INTERVAL)):
+            last_snapshot = time.time()
             write(output_file, clients)
 
-
     cursor.close()
 
+    progress.report("Processed %d tweets" % seen, force = True)
+    print()
+
+    return clients
+
+def main(address, db, collection, output_file = OUTPUT_FILE,
+         method = "aggregate", workers = None):
+    if (method == "aggregate"):
+        clients = tally_aggregate(
+            pymongo.MongoClient(address)[db][collection]
+        )
+    elif (method == "parallel"):
+        clients = tally_parallel(
+            address, db, collection, workers or multiprocessing.cpu_count(),
+            output_file
+        )
+    else:
+        clients = tally_scan(address, db, collection, output_file)
+
+    write(output_file, clients)
+    print("Found %d clients; wrote %s" % (len(clients), output_file))
+
 if (__name__ == "__main__"):
     import optparse
 
@@ -73,10 +284,21 @@ if (__name__ == "__main__"):
                       help = "The database where the tweets are stored")
     parser.add_option("-c", "--collection", dest = "collection",
                       help = "The collection where the tweets are stored")
+    parser.add_option("-o", "--output", dest = "output_file",
+                      default = OUTPUT_FILE,
+                      help = "The CSV file to write the tally to")
+    parser.add_option("-m", "--method", dest = "method",
+                      default = "aggregate",
+                      choices = ["aggregate", "parallel", "scan"],
+                      help = "aggregate: tally on the server; parallel: scan "
+                             "_id ranges in parallel processes; scan: scan "
+                             "the collection in this process")
+    parser.add_option("-w", "--workers", dest = "workers", type = "int",
+                      help = "The number of processes for the parallel method")
     (options, args) = parser.parse_args()
 
     options = vars(options)
-    if (not all(options.values())):
+    if (not all([options["address"], options["db"], options["collection"]])):
         parser.print_help()
     else:
         main(**options)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# bulk load local tweet dumps into MongoDB
+#
+# usage:
+#     unzip -j caverlee-2011.zip '*content_polluters_tweets.txt' -d /tmp
+#     python3 -m util.load_tweets -d caverlee_2011 -c spam \
+#         -u training/caverlee_2011/content_polluters.txt \
+#         /tmp/content_polluters_tweets.txt
+#     python3 -m util.load_tweets -d caverlee_2011 -c ham \
+#         training/caverlee_2011_tweets/ham/
+#
+# Two formats are supported:
+#
+# * caverlee-2011 tweet files (*.txt): tab separated UserID, TweetID, Tweet,
+#   CreatedAt. These only contain the text and date of each tweet; entities
+#   are parsed out of the text, and user profiles are taken from the
+#   matching user file (-u), which is required for them. Tweets of users that
+#   are not in the user file are skipped.
+# * JSON files as written by older versions of util/scrape_caverlee.py, each
+#   containing a list of tweets from the Twitter API. A directory is expanded
+#   to the *.json files in it.
+#
+# Files are split into chunks that are parsed and inserted by a pool of
+# processes, each with its own connection. Secondary indexes are only built
+# once everything has been loaded.
+
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import pymongo
+import pymongo.errors
+
+from util import user_index
+
+BATCH_SIZE = 10000
+CHUNK_SIZE = 64 * 1024 * 1024 # bytes of a TSV file per task
+
+CAVERLEE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+TWITTER_DATE_PARSE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+# user.id first so that the index also serves queries on user.id alone, and
+# timestamp_ms second so that the most recent tweets of a user can be read
+# from the index in order
+INDEXES = [
+    [("user.id", pymongo.ASCENDING), ("timestamp_ms", pymongo.DESCENDING)],
+    [("timestamp_ms", pymongo.ASCENDING)]
+]
+
+DUPLICATE_KEY_ERROR = 11000
+
+HASHTAG_RE = re.compile(r"(?<!\w)#(\w+)")
+MENTION_RE = re.compile(r"(?<!\w)@(\w+)")
+URL_RE = re.compile(r"https?://\S+")
+
+# state of the worker processes, set by _init_worker
+_collection = None
+_users = None
+
+def parse_caverlee_date(string):
+    """ Parse a caverlee-2011 date, which is in UTC
+
+    Args:
+        string: A date such as "2009-12-16 15:46:33"
+
+    Returns:
+        A timezone-aware datetime.datetime
+    """
+
+    return datetime.datetime.strptime(
+        string, CAVERLEE_DATE_FORMAT
+    ).replace(tzinfo = datetime.timezone.utc)
+
+def timestamp_ms(date):
+    """ Convert a datetime to a timestamp_ms string as used by Twitter """
+
+    return str(int(date.timestamp() * 1000))
+
+def parse_entities(text):
+    """ Extract the hashtags, mentions and URLs of a tweet from its text
+
+    Args:
+        text: The text of a tweet
+
+    Returns:
+        A dictionary in the format of the "entities" field of a tweet
+    """
+
+    return {
+        "hashtags": [
+            {"text": match.group(1), "indices": list(match.span())}
+            for match in HASHTAG_RE.finditer(text)
+        ],
+        "user_mentions": [
+            {"screen_name": match.group(1), "indices": list(match.span())}
+            for match in MENTION_RE.finditer(text)
+        ],
+        "urls": [
+            {
+                "url": match.group(0),
+                "expanded_url": match.group(0),
+                "indices": list(match.span())
+            }
+            for match in URL_RE.finditer(text)
+        ]
+    }
+
+def read_users(path):
+    """ Read a caverlee-2011 user file into user dictionaries
+
+    The columns are UserID, CreatedAt, CollectedAt, NumerOfFollowings,
+    NumberOfFollowers, NumberOfTweets, LengthOfScreenName and
+    LengthOfDescriptionInUserProfile. The dataset does not contain screen
+    names, so only their length is kept as screen_name_length, and no user
+    is verified.
+
+    Args:
+        path: The path to content_polluters.txt or legitimate_users.txt
+
+    Returns:
+        A dictionary mapping user IDs to partial Twitter user dictionaries
+    """
+
+    users = {}
+
+    with open(path, "r", encoding = "utf-8", errors = "replace") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            try:
+                user_id = int(fields[0])
+                users[user_id] = {
+                    "id": user_id,
+                    "id_str": str(user_id),
+                    "created_at": parse_caverlee_date(fields[1]).strftime(
+                        TWITTER_DATE_FORMAT
+                    ),
+                    "friends_count": int(fields[3]),
+                    "followers_count": int(fields[4]),
+                    "statuses_count": int(fields[5]),
+                    "screen_name_length": int(fields[6]),
+                    "verified": False
+                }
+            except (IndexError, ValueError):
+                continue
+
+    return users
+
+def parse_caverlee_line(line, users):
+    """ Convert a line of a caverlee-2011 tweet file into a tweet document
+
+    Args:
+        line: A line of the file, without the trailing newline
+        users: A dictionary returned by read_users
+
+    Returns:
+        A tweet dictionary with the tweet ID as its _id, or None if the line
+        is malformed or its user is not in users. Fields that the file lacks
+        are set to what the Twitter API returns for a tweet that was never
+        retweeted and has no client or location.
+    """
+
+    fields = line.split("\t")
+    if (len(fields) < 4):
+        return None
+
+    try:
+        user_id = int(fields[0])
+        tweet_id = int(fields[1])
+        date = parse_caverlee_date(fields[-1].strip())
+    except ValueError:
+        return None
+    if (user_id not in users):
+        return None
+
+    # tabs in the tweet text end up as extra columns
+    text = "\t".join(fields[2:-1])
+
+    return {
+        "_id": tweet_id,
+        "id": tweet_id,
+        "id_str": str(tweet_id),
+        "text": text,
+        "created_at": date.strftime(TWITTER_DATE_FORMAT),
+        "timestamp_ms": timestamp_ms(date),
+        "retweet_count": 0,
+        "source": "",
+        "coordinates": None,
+        "entities": parse_entities(text),
+        "user": users[user_id]
+    }
+
+def prepare_api_tweet(tweet):
+    """ Prepare a tweet from the Twitter API for insertion
+
+    Sets the tweet ID as the _id, and fills in timestamp_ms, which only tweets
+    from the streaming API have.
+
+    Args:
+        tweet: A tweet dictionary
+
+    Returns:
+        The same dictionary
+    """
+
+    tweet["_id"] = tweet["id"]
+    if ("timestamp_ms" not in tweet):
+        tweet["timestamp_ms"] = timestamp_ms(datetime.datetime.strptime(
+            tweet["created_at"], TWITTER_DATE_PARSE_FORMAT
+        ))
+    return tweet
+
+def insert(collection, docs):
+    """ Insert documents with an unordered bulk insert
+
+    Documents whose _id already exists are skipped, so a load can be re-run
+    after it was interrupted. Each document is given an insertion marker (see
+    util.user_index.mark), so that user index updates can find it.
+
+    Args:
+        collection: A pymongo.collection.Collection
+        docs: A list of documents with their _id set
+
+    Returns:
+        The number of documents that were inserted
+    """
+
+    if (not docs):
+        return 0
+
+    user_index.mark(docs)
+    try:
+        return len(collection.insert_many(docs, ordered = False).inserted_ids)
+    except pymongo.errors.BulkWriteError as error:
+        if (any(
+            write_error["code"] != DUPLICATE_KEY_ERROR
+            for write_error in error.details["writeErrors"]
+        )):
+            raise
+        return error.details["nInserted"]
+
+def chunk_ranges(path, chunk_size = CHUNK_SIZE):
+    """ Split a file into byte ranges to be read in parallel
+
+    Args:
+        path: The path of the file
+        chunk_size: The approximate size of each range in bytes
+
+    Returns:
+        A list of (start, end) tuples; each line belongs to the range that
+        contains its first byte
+    """
+
+    size = os.path.getsize(path)
+    return [
+        (start, min(start + chunk_size, size))
+        for start in range(0, size, chunk_size)
+    ]
+
+def _init_worker(address, db, collection, users):
+    global _collection, _users
+    _collection = pymongo.MongoClient(address)[db][collection]
+    _users = users
+
+def _load_tsv_chunk(args):
+    """ Parse and insert the lines of a caverlee-2011 tweet file in a range
+
+    Args:
+        args: A tuple containing the path of the file and the start and end
+            of the range
+
+    Returns:
+        A tuple containing the number of documents that were inserted and the
+        number of malformed lines that were skipped
+    """
+
+    (path, start, end) = args
+    n_inserted = 0
+    n_skipped = 0
+    batch = []
+
+    with open(path, "rb") as f:
+        if (start > 0):
+            # the line that contains start - 1 belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+
+        while (position < end):
+            line = f.readline()
+            if (not line):
+                break
+            position += len(line)
+
+            doc = parse_caverlee_line(
+                line.decode("utf-8", errors = "replace").rstrip("\r\n"),
+                _users
+            )
+            if (doc is None):
+                n_skipped += 1
+                continue
+
+            batch.append(doc)
+            if (len(batch) == BATCH_SIZE):
+                n_inserted += insert(_collection, batch)
+                batch = []
+
+    n_inserted += insert(_collection, batch)
+
+    return (n_inserted, n_skipped)
+
+def _load_json_file(path):
+    """ Insert the tweets of a JSON file containing a list of tweets
+
+    Args:
+        path: The path of the file
+
+    Returns:
+        A tuple containing the number of documents that were inserted and the
+        number of malformed tweets that were skipped
+    """
+
+    n_inserted = 0
+    n_skipped = 0
+
+    with open(path, "r") as f:
+        tweets = json.load(f)
+
+    docs = []
+    for tweet in tweets:
+        try:
+            docs.append(prepare_api_tweet(tweet))
+        except (KeyError, ValueError):
+            n_skipped += 1
+
+    for start in range(0, len(docs), BATCH_SIZE):
+        n_inserted += insert(_collection, docs[start:start + BATCH_SIZE])
+
+    return (n_inserted, n_skipped)
+
+def expand_paths(paths):
+    """ Expand directories into the JSON files that they contain """
+
+    expanded = []
+    for path in paths:
+        if (os.path.isdir(path)):
+            expanded += sorted(glob.glob(os.path.join(path, "*.json")))
+        else:
+            expanded.append(path)
+    return expanded
+
+def load(address, db, collection, paths, users = None, processes = None,
+         chunk_size = CHUNK_SIZE):
+    """ Load tweet dumps into a collection in parallel
+
+    Args:
+        address: The host and port where Mongo is located
+        db: The database to load the tweets into
+        collection: The collection to load the tweets into
+        paths: A list of caverlee-2011 tweet files, JSON files and
+            directories of JSON files
+        users: A dictionary returned by read_users; required if there are
+            caverlee-2011 tweet files
+        processes: The number of worker processes; defaults to the number of
+            CPUs
+        chunk_size: The approximate size in bytes of each TSV chunk
+
+    Returns:
+        The number of documents that were inserted
+    """
+
+    tasks = []
+    for path in expand_paths(paths):
+        if (path.endswith(".json")):
+            tasks.append((_load_json_file, path))
+        else:
+            assert users is not None, (
+                   "%s is a caverlee-2011 tweet file, which needs a user "
+                   "file" % path)
+            tasks += [
+                (_load_tsv_chunk, (path, start, end))
+                for (start, end) in chunk_ranges(path, chunk_size)
+            ]
+
+    n_inserted = 0
+    n_skipped = 0
+    start = time.time()
+
+    with multiprocessing.Pool(
+        processes, _init_worker, (address, db, collection, users)
+    ) as pool:
+        results = [pool.apply_async(function, (args,))
+                   for (function, args) in tasks]
+
+        for (i, result) in enumerate(results):
+            (task_inserted, task_skipped) = result.get()
+            n_inserted += task_inserted
+            n_skipped += task_skipped
+            sys.stdout.write("\rLoaded %d/%d chunks, %d docs (%d docs/s)" % (
+                i + 1, len(tasks), n_inserted,
+                n_inserted / max(time.time() - start, 1e-6)
+            ))
+            sys.stdout.flush()
+
+    elapsed = time.time() - start
+    print("\rLoaded %d docs into %s.%s in %.1fs (%d docs/s); skipped %d" % (
+        n_inserted, db, collection, elapsed,
+        n_inserted / max(elapsed, 1e-6), n_skipped
+    ))
+
+    return n_inserted
+
+def build_indexes(collection):
+    """ Build the secondary indexes used by the classifier, and the index
+    on the insertion marker that user index updates use (see
+    util.user_index.marker_field)
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+    """
+
+    for keys in INDEXES:
+        start = time.time()
+        name = collection.create_index(keys)
+        print("Built index %s in %.1fs" % (name, time.time() - start))
+
+    start = time.time()
+    user_index.create_marker_index(collection)
+    print("Built the insertion marker index in %.1fs" % (time.time() - start))
+
+if (__name__ == "__main__"):
+    import optparse
+
+    parser = optparse.OptionParser(
+        usage = "%prog [options] PATH [PATH ...]"
+    )
+
+    parser.add_option("-a", "--address", dest = "address",
+                      default = "localhost:27017",
+                      help = "The host and port where Mongo is located")
+    parser.add_option("-d", "--db", dest = "db",
+                      help = "The database to load the tweets into")
+    parser.add_option("-c", "--collection", dest = "collection",
+                      help = "The collection to load the tweets into")
+    parser.add_option("-u", "--users", dest = "users",
+                      help = "A caverlee-2011 user file to take user "
+                             "profiles from")
+    parser.add_option("-p", "--processes", dest = "processes", type = "int",
+                      help = "The number of worker processes")
+    parser.add_option("--no-indexes", dest = "indexes", default = True,
+                      action = "store_false",
+                      help = "Do not build indexes after loading")
+    (options, args) = parser.parse_args()
+
+    if (not (options.db and options.collection and args)):
+        parser.print_help()
+    else:
+        load(
+            options.address, options.db, options.collection, args,
+            read_users(options.users) if options.users else None,
+            options.processes
+        )
+        if (options.indexes):
+            build_indexes(
+                pymongo.MongoClient(options.address)[options.db][
+                    options.collection
+                ]
+            )
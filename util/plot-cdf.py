@@ -1,44 +1,76 @@
 #!/usr/bin/env python3
-# usage: ./plot-cdf FeatureName
+# usage: ./plot-cdf FeatureName [features.csv ...]
+#
+# Plots the CDF of a feature in each feature matrix (spam.csv and ham.csv by
+# default) from the quantile sketches stored next to them, and prints the
+# Kolmogorov-Smirnov distance between each pair of distributions.
 
 from matplotlib import pyplot
-import csv
+import itertools
+import os
 import sys
 
+# this script can not be run with -m because of its name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from lib.sketch import FeatureSketches, ks_distance
+
 show = pyplot.show
 
 class CDFPlotter(object):
 
-    def __init__(self, feature, use_pyplot_hist = True):
+    def __init__(self, feature, step = True):
         self.feature_max_values = []
         self.feature = feature
-        self.use_pyplot_hist = use_pyplot_hist
+        self.step = step
+        self.sketches = {}
 
     def plot(self, features_csv):
-        with open(features_csv, "r") as f:
-            data = sorted([
-                float(row[feature])
-                for row in csv.DictReader(f)
-            ])
-
-        self.feature_max_values.append(max(data))
-
-        if (self.use_pyplot_hist):
-            pyplot.hist(
-                data, len(data),
-                normed = 1, cumulative = True,
-                label = features_csv,
-                histtype = "step",
+        """ Plot the CDF of the feature in a feature matrix
+
+        The stored sketches of the matrix are used if they exist; otherwise
+        the CSV is streamed into a new sketch, so memory use does not depend
+        on the number of rows.
+
+        Args:
+            features_csv: The path to a feature matrix
+        """
+
+        sketch = FeatureSketches.from_csv(
+            features_csv, [self.feature]
+        )[self.feature]
+        self.sketches[features_csv] = sketch
+
+        self.feature_max_values.append(sketch.max)
+        (values, fractions) = sketch.cdf()
+
+        if (self.step):
+            pyplot.step(
+                values, fractions,
+                where = "post",
+                label = "%s (n = %d)" % (features_csv, len(sketch)),
                 linewidth = 2
             )
         else:
             pyplot.plot(
-                data,
-                [i/len(data) for i in range(len(data))],
-                label = features_csv,
+                values, fractions,
+                label = "%s (n = %d)" % (features_csv, len(sketch)),
                 linewidth = 2
             )
 
+    def compare(self):
+        """ Return the Kolmogorov-Smirnov distances between the plotted
+        distributions
+
+        Returns:
+            A list of (csv_a, csv_b, distance) tuples
+        """
+
+        return [
+            (a, b, ks_distance(self.sketches[a], self.sketches[b]))
+            for (a, b) in itertools.combinations(self.sketches.keys(), 2)
+        ]
+
     def decorate(self):
         pyplot.grid(True)
         pyplot.ylabel("cdf")
@@ -47,10 +79,14 @@ class CDFPlotter(object):
 
 if (__name__ == "__main__"):
     feature = sys.argv[1]
+    csv_paths = sys.argv[2:] or ["spam.csv", "ham.csv"]
 
     p = CDFPlotter(feature)
-    p.plot("spam.csv")
-    p.plot("ham.csv")
+    for csv_path in csv_paths:
+        p.plot(csv_path)
     p.decorate()
 
+    for (a, b, distance) in p.compare():
+        print("KS distance between %s and %s: %.4f" % (a, b, distance))
+
     pyplot.show()
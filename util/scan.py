@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# extract the features of every user in a collection with a single scan per
+# worker process, instead of one query per user
+#
+# usage:
+#     python3 -m util.scan -d caverlee_2011 -c spam -o spam_all.csv
+#     python3 -m util.scan -d caverlee_2011 -c spam -o spam_all.csv -p 8
+#
+# The collection is read in user ID order through its user.id index. With
+# more than one process, the user IDs are split into ranges with about the
+# same number of tweets, each range is scanned into its own feature matrix
+# (<output>.part<n>), and the parts are merged into the output.
+
+import multiprocessing
+
+from util import sharding
+
+def _scan_range(args):
+    """ Scan one range of user IDs into a feature matrix
+
+    Args:
+        args: A tuple containing the database, the collection, the MongoDB
+            address, the range of user IDs, the output path, and whether or
+            not to resume
+
+    Returns:
+        A list of the user IDs that failed
+    """
+
+    (db, collection, address, user_id_range, output, resume) = args
+
+    import botdetector
+
+    classifier = botdetector.Classifier()
+    classifier.connect(db, collection, address)
+    return classifier.gen_feature_matrix(
+        None, output, resume = resume, user_id_range = user_id_range
+    )
+
+def scan(db, collection, output, address = None, processes = 1,
+         resume = False):
+    """ Extract the features of every user in a collection
+
+    Args:
+        db: The database of the collection
+        collection: The collection of tweets
+        output: The path of the feature matrix
+        address: The host and port where Mongo is located
+        processes: The number of worker processes, each scanning its own
+            range of user IDs
+        resume: Whether or not to resume from the checkpoints of a previous
+            run; the ranges must then be the same, so the same number of
+            processes must be used
+
+    Returns:
+        A list of the user IDs that failed
+    """
+
+    import botdetector
+
+    if (processes <= 1):
+        return _scan_range((db, collection, address, None, output, resume))
+
+    ranges = botdetector.split_user_ids(
+        botdetector.mongo_client(address)[db][collection], processes
+    )
+    parts = ["%s.part%d" % (output, i) for i in range(len(ranges))]
+
+    # a fresh process per range, so that no MongoClient is inherited across
+    # a fork
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        failed = pool.map(_scan_range, [
+            (db, collection, address, user_id_range, part, resume)
+            for (user_id_range, part) in zip(ranges, parts)
+        ])
+
+    sharding.merge(parts, output)
+
+    return [user_id for part_failed in failed for user_id in part_failed]
+
+if (__name__ == "__main__"):
+    import logging
+    import optparse
+
+    parser = optparse.OptionParser()
+
+    parser.add_option("-d", "--db", dest = "db",
+                      help = "The database of the collection")
+    parser.add_option("-c", "--collection", dest = "collection",
+                      help = "The collection of tweets")
+    parser.add_option("-a", "--address", dest = "address",
+                      help = "The host and port of MongoDB")
+    parser.add_option("-o", "--output", dest = "output",
+                      help = "The path of the feature matrix")
+    parser.add_option("-p", "--processes", dest = "processes", type = "int",
+                      default = 1,
+                      help = "The number of worker processes")
+    parser.add_option("--resume", dest = "resume", action = "store_true",
+                      default = False,
+                      help = "Resume from the checkpoints of a previous run")
+    (options, args) = parser.parse_args()
+
+    if ((not options.db) or (not options.collection)
+            or (not options.output)):
+        parser.print_help()
+    else:
+        logging.basicConfig(level = logging.INFO)
+        failed = scan(
+            options.db, options.collection, options.output, options.address,
+            options.processes, options.resume
+        )
+        print("Wrote %s (%d users failed)" % (options.output, len(failed)))
@@ -1,75 +1,339 @@
 #!/usr/bin/env python3
+# scrape the timelines of the caverlee-2011 users into MongoDB
+#
+# usage:
+#     python3 -m util.scrape_caverlee -d caverlee_2011 -l spam -w 8
+#
+# Tweets are inserted into the collection named after the list (spam or ham)
+# with the tweet ID as _id, and the progress of every user is stored in the
+# PROGRESS_COLLECTION of the same database, so an interrupted scrape picks up
+# where it left off.
 
-import configparser
-import json
-import os
-import tweepy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-CONFIG_FILE = "config.ini"
+import pymongo
+import requests
+
+from util import config_loader, load_tweets, user_index
 
 CAVERLEE_DIR = "training/caverlee_2011/"
 SPAMMERS = "%s/content_polluters.txt" % CAVERLEE_DIR
 NOT_SPAMMERS = "%s/legitimate_users.txt" % CAVERLEE_DIR
+LISTS = {
+    "spam": SPAMMERS,
+    "ham": NOT_SPAMMERS
+}
 
-OUTDIR = "training/caverlee_2011_tweets/"
-SPAMMERS_OUTDIR = "spam/"
-NOT_SPAMMERS_OUTDIR = "ham/"
+TWITTER_API = "https://api.twitter.com/1.1"
+PROGRESS_COLLECTION = "scrape_progress"
 
 PAGE_LIMIT = 3
+PAGE_SIZE = 200
+
+# statuses/user_timeline allows 900 requests per 15 minute window per user
+# access token
+RATE_LIMIT = 900
+RATE_LIMIT_WINDOW = 15 * 60
+
+class RateLimiter(object):
+    """ A request budget that is shared between threads
+
+    At most `limit` requests are started per `window` seconds. If the API
+    reports that the budget is exhausted before that, every thread waits
+    until the reset time that the API reported.
+    """
+
+    def __init__(self, limit = RATE_LIMIT, window = RATE_LIMIT_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._remaining = limit
+        self._reset = time.time() + window
+
+    def acquire(self):
+        """ Block until a request may be made """
+
+        while True:
+            with self._lock:
+                now = time.time()
+                if (now >= self._reset):
+                    self._remaining = self.limit
+                    self._reset = now + self.window
+                if (self._remaining > 0):
+                    self._remaining -= 1
+                    return
+                wait = self._reset - now
+            print("rate limit reached; waiting %d seconds" % wait)
+            time.sleep(wait)
+
+    def update(self, headers):
+        """ Synchronise the budget with the rate limit headers of a response
+
+        Args:
+            headers: The headers of a Twitter API response
+        """
+
+        if ("x-rate-limit-remaining" not in headers):
+            return
+
+        with self._lock:
+            self._remaining = min(
+                self._remaining, int(headers["x-rate-limit-remaining"])
+            )
+            if ("x-rate-limit-reset" in headers):
+                self._reset = float(headers["x-rate-limit-reset"])
+
+    def exhaust(self, reset = None):
+        """ Mark the budget as exhausted until reset, e.g. after a 429 """
+
+        with self._lock:
+            self._remaining = 0
+            if (reset is not None):
+                self._reset = float(reset)
 
 class Scraper(object):
 
-    def __init__(self):
-        config = configparser.ConfigParser()
-        config.read(CONFIG_FILE)
+    def __init__(self, address = "localhost:27017", db = "caverlee_2011",
+                 api_url = None, auth = None, rate_limiter = None):
+        """ Initializes Scraper
 
-        auth = tweepy.OAuthHandler(
-            config["credentials"]["twitter_consumer_key"],
-            config["credentials"]["twitter_consumer_secret"]
-        )
-        auth.set_access_token(
-            config["credentials"]["twitter_access_key"],
-            config["credentials"]["twitter_access_secret"]
-        )
-        self.api = tweepy.API(
-            auth, wait_on_rate_limit = True, wait_on_rate_limit_notify = True
-        )
+        Args:
+            address: The host and port where Mongo is located
+            db: The database to store the tweets in
+            api_url: The base URL of the Twitter API; defaults to
+                sources.twitter_api in config.ini
+            auth: A requests authentication object; defaults to OAuth 1 with
+                the Twitter credentials in config.ini
+            rate_limiter: A RateLimiter shared by all requests
+        """
+
+        if ((api_url is None) or (auth is None)):
+            config = config_loader.ConfigLoader().load()
+            if (api_url is None):
+                api_url = config["sources"].get("twitter_api", TWITTER_API)
+            if (auth is None):
+                import tweepy
+                handler = tweepy.OAuthHandler(
+                    config["credentials"]["twitter_consumer_key"],
+                    config["credentials"]["twitter_consumer_secret"]
+                )
+                handler.set_access_token(
+                    config["credentials"]["twitter_access_key"],
+                    config["credentials"]["twitter_access_secret"]
+                )
+                auth = handler.apply_auth()
+
+        self.api_url = api_url.rstrip("/")
+        self.auth = auth
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.db = pymongo.MongoClient(address)[db]
+        self.progress = self.db[PROGRESS_COLLECTION]
+        self._local = threading.local()
+
+    def _session(self):
+        """ Return a requests session for the current thread """
+
+        if (not hasattr(self._local, "session")):
+            self._local.session = requests.Session()
+            self._local.session.auth = self.auth
+        return self._local.session
+
+    def fetch_page(self, user_id, max_id = None):
+        """ Retrieve one page of a user's timeline
+
+        Args:
+            user_id: A Twitter user ID
+            max_id: Only return tweets with IDs up to and including this one
+
+        Returns:
+            A list of tweet dictionaries, or None if the timeline is not
+            accessible (the user is protected, suspended or deleted)
+        """
+
+        params = {
+            "user_id": user_id,
+            "count": PAGE_SIZE,
+            "include_rts": "true",
+            "trim_user": "false"
+        }
+        if (max_id is not None):
+            params["max_id"] = max_id
+
+        while True:
+            self.rate_limiter.acquire()
+            response = self._session().get(
+                "%s/statuses/user_timeline.json" % self.api_url,
+                params = params, timeout = 60
+            )
+            self.rate_limiter.update(response.headers)
+
+            if (response.status_code == 429):
+                self.rate_limiter.exhaust(
+                    response.headers.get("x-rate-limit-reset")
+                )
+                continue
+            elif (response.status_code in (401, 403, 404)):
+                return None
+
+            response.raise_for_status()
+            return response.json()
 
-    def scrape_user(self, user_id, page = 0, page_limit = PAGE_LIMIT):
-        tweets = []
+    def insert(self, collection, tweets):
+        """ Insert tweets, skipping ones that were already inserted
 
-        print("retrieving page %d of user %s" % (page, user_id))
-        timeline = self.api.user_timeline(
-            user_id, count = 200, page = 15
+        The tweets are prepared the same way as the JSON dumps loaded by
+        util/load_tweets.py, so that they have a timestamp_ms.
+
+        Args:
+            collection: A pymongo.collection.Collection
+            tweets: A list of tweet dictionaries
+
+        Returns:
+            The number of tweets that were inserted
+        """
+
+        return load_tweets.insert(
+            collection,
+            [load_tweets.prepare_api_tweet(tweet) for tweet in tweets]
         )
 
-        tweets = [
-            tweet._json
-            for tweet in self.api.user_timeline(
-                user_id, count = 200, page = page
+    def scrape_user(self, user_id, collection, page_limit = PAGE_LIMIT):
+        """ Scrape a user's timeline into a collection
+
+        Pages are requested newest first using max_id. After every page, the
+        next max_id is saved in the progress collection, so a user whose
+        scrape was interrupted continues from the last complete page.
+
+        Args:
+            user_id: A Twitter user ID
+            collection: The name of the collection to insert tweets into
+            page_limit: The index of the last page to retrieve, or None to
+                retrieve the whole timeline
+
+        Returns:
+            The number of tweets that were inserted
+        """
+
+        marker_id = "%s:%s" % (collection, user_id)
+        marker = self.progress.find_one({"_id": marker_id}) or {
+            "_id": marker_id,
+            "collection": collection,
+            "user_id": user_id,
+            "page": 0,
+            "max_id": None,
+            "done": False
+        }
+        if (marker["done"]):
+            return 0
+
+        n_inserted = 0
+
+        while (not marker["done"]):
+            print("retrieving page %d of user %s" % (marker["page"], user_id))
+            tweets = self.fetch_page(user_id, marker["max_id"])
+
+            if (tweets is None):
+                marker["error"] = "unavailable"
+                tweets = []
+            elif (tweets):
+                n_inserted += self.insert(self.db[collection], tweets)
+                marker["max_id"] = min(tweet["id"] for tweet in tweets) - 1
+
+            marker["page"] += 1
+            marker["done"] = (
+                (not tweets)
+                or ((page_limit is not None) and (marker["page"] > page_limit))
+            )
+            self.progress.replace_one(
+                {"_id": marker_id}, marker, upsert = True
+            )
+
+        return n_inserted
+
+    def scrape(self, user_ids, collection, workers = 4,
+               page_limit = PAGE_LIMIT):
+        """ Scrape the timelines of many users concurrently
+
+        All workers share this scraper's rate limiter, so the number of
+        workers only affects how many requests are in flight, not how many
+        are made per window.
+
+        Args:
+            user_ids: A list of Twitter user IDs
+            collection: The name of the collection to insert tweets into
+            workers: The number of threads
+            page_limit: Passed to scrape_user
+
+        Returns:
+            The number of tweets that were inserted
+        """
+
+        done = set(
+            marker["user_id"]
+            for marker in self.progress.find(
+                {"collection": collection, "done": True}, {"user_id": 1}
             )
-        ]
+        )
+        user_ids = [user_id for user_id in user_ids if (user_id not in done)]
+        user_index.create_marker_index(self.db[collection])
+        print("%d users already retrieved; %d left" % (
+            len(done), len(user_ids)
+        ))
+
+        with ThreadPoolExecutor(workers) as executor:
+            return sum(executor.map(
+                lambda user_id: self.scrape_user(
+                    user_id, collection, page_limit
+                ),
+                user_ids
+            ))
 
-        if (len(tweets) > 0):
-            if ((page_limit is None) or (page < page_limit)):
-                tweets += self.scrape_user(user_id, page + 1)
+def read_user_ids(path):
+    """ Read the user IDs of a caverlee-2011 user list
 
-        return tweets
+    Args:
+        path: The path to content_polluters.txt or legitimate_users.txt
+
+    Returns:
+        A list of user IDs as strings
+    """
+
+    with open(path, "r") as f:
+        return [line.split("\t")[0] for line in f if line.strip()]
 
 if (__name__ == "__main__"):
-    scraper = Scraper()
-
-    outdir = "%s/%s" % (OUTDIR, SPAMMERS_OUTDIR)
-    if (not os.path.isdir(outdir)):
-        os.makedirs(outdir)
-
-    with open(SPAMMERS, "r") as in_fp:
-        for line in in_fp.readlines():
-            user_id = line.split("\t")[0]
-            outfile = "%s/%s.json" % (outdir, user_id)
-            if (os.path.isfile(outfile)):
-                print("already retrieved user %s" % user_id)
-            else:
-                tweets = scraper.scrape_user(user_id)
-                with open(outfile, "w") as out_fp:
-                    json.dump(tweets, out_fp)
+    import optparse
+
+    parser = optparse.OptionParser()
+
+    parser.add_option("-a", "--address", dest = "address",
+                      default = "localhost:27017",
+                      help = "The host and port where Mongo is located")
+    parser.add_option("-d", "--db", dest = "db", default = "caverlee_2011",
+                      help = "The database to store the tweets in")
+    parser.add_option("-l", "--list", dest = "lists", action = "append",
+                      choices = list(LISTS.keys()),
+                      help = "The user list to scrape (spam or ham); may be "
+                             "given more than once; defaults to both")
+    parser.add_option("-w", "--workers", dest = "workers", type = "int",
+                      default = 4, help = "The number of scraping threads")
+    parser.add_option("-p", "--pages", dest = "page_limit", type = "int",
+                      default = PAGE_LIMIT,
+                      help = "The index of the last page to retrieve per user")
+    parser.add_option("-u", "--api-url", dest = "api_url",
+                      help = "The base URL of the Twitter API; overrides "
+                             "sources.twitter_api")
+    (options, args) = parser.parse_args()
+
+    scraper = Scraper(options.address, options.db, options.api_url)
+
+    for name in (options.lists or sorted(LISTS.keys())):
+        n_inserted = scraper.scrape(
+            read_user_ids(LISTS[name]), name, options.workers,
+            options.page_limit
+        )
+        print("inserted %d tweets into %s.%s" % (
+            n_inserted, options.db, name
+        ))
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# split feature extraction into shards that independent workers lease from a
+# queue stored in MongoDB, and merge the per-shard feature matrices
+#
+# usage:
+#     python3 -m util.sharding enqueue -j spam -d caverlee_2011 -c spam \
+#         -t tweets.example.com:27017 \
+#         -i training/caverlee_spam_geotagged.txt -n 16 -o shards/
+#     python3 -m util.sharding work -j spam       # on every worker
+#     python3 -m util.sharding status -j spam
+#     python3 -m util.sharding merge -j spam -o spam.csv
+#
+# Workers write their shards to the output directory given to enqueue, which
+# must be shared between nodes (or copied to one node before merging). The
+# address of the MongoDB holding the tweets (-t) is stored with the shards;
+# it defaults to the address of the queue (-a).
+
+import csv
+import hashlib
+import os
+import socket
+import threading
+import time
+
+import bson
+import pymongo
+
+from lib.sketch import FeatureSketches
+
+QUEUE_DB = "botdetector"
+QUEUE_COLLECTION = "shards"
+
+LEASE_SECONDS = 600
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+# columns of a feature matrix that are not features
+ID_COLUMNS = [
+    "user_id", "username", "sampling", "imputed", "error_bounds"
+]
+
+def shard_of(user_id, n_shards):
+    """ Assign a user to a shard by hash range
+
+    The user ID is hashed to a uniformly distributed 64-bit integer, and the
+    hash space is split into n_shards equal ranges. The assignment only
+    depends on the user ID and n_shards, so every node computes the same
+    partitioning.
+
+    Args:
+        user_id: A Twitter user ID
+        n_shards: The number of shards
+
+    Returns:
+        An integer from 0 to n_shards - 1
+    """
+
+    digest = hashlib.md5(str(user_id).encode("ascii")).digest()
+    return (int.from_bytes(digest[:8], "big") * n_shards) >> 64
+
+def partition(user_ids, n_shards):
+    """ Partition user IDs into shards
+
+    Args:
+        user_ids: A list of Twitter user IDs
+        n_shards: The number of shards
+
+    Returns:
+        A list of n_shards lists of user IDs
+    """
+
+    shards = [[] for i in range(n_shards)]
+    for user_id in user_ids:
+        shards[shard_of(user_id, n_shards)].append(user_id)
+    return shards
+
+class WorkQueue(object):
+    """ A queue of shards that workers lease from a MongoDB collection
+
+    Each shard document contains the user IDs of the shard and where its
+    tweets and feature matrix are located. A worker leases a shard for
+    LEASE_SECONDS and keeps renewing the lease while it works; if the worker
+    dies, the lease expires and another worker takes the shard over, resuming
+    from the shard's checkpoint.
+
+    Every claim gets a new lease token. Workers check that they still hold
+    the token before every write (see holds), so a worker that stalled past
+    its lease does not write to a shard that another worker has taken over.
+    """
+
+    def __init__(self, address = "localhost:27017", db = QUEUE_DB,
+                 collection = QUEUE_COLLECTION):
+        """ Initializes WorkQueue
+
+        Args:
+            address: The host and port of the MongoDB holding the queue
+            db: The database of the queue
+            collection: The collection of the queue
+        """
+
+        self.collection = pymongo.MongoClient(address)[db][collection]
+        self.collection.create_index([
+            ("job", pymongo.ASCENDING),
+            ("status", pymongo.ASCENDING)
+        ])
+
+    def enqueue(self, job, db, collection, user_ids, n_shards, output_dir,
+                address = None):
+        """ Partition users into shards and add them to the queue
+
+        Args:
+            job: A name for this set of shards
+            db: The database containing the tweets
+            collection: The collection containing the tweets
+            user_ids: A list of Twitter user IDs
+            n_shards: The number of shards
+            output_dir: The directory that shard feature matrices are written
+                to
+            address: The host and port of the MongoDB containing the tweets,
+                which every worker connects to; defaults to localhost
+
+        Returns:
+            The number of shards that were added
+        """
+
+        n_added = 0
+
+        for (shard, shard_user_ids) in enumerate(
+            partition(user_ids, n_shards)
+        ):
+            if (not shard_user_ids):
+                continue
+            result = self.collection.update_one(
+                {"_id": "%s:%d" % (job, shard)},
+                {"$setOnInsert": {
+                    "job": job,
+                    "shard": shard,
+                    "address": address,
+                    "db": db,
+                    "collection": collection,
+                    "user_ids": shard_user_ids,
+                    "output": os.path.join(
+                        output_dir, "%s-%04d.csv" % (job, shard)
+                    ),
+                    "status": PENDING,
+                    "worker": None,
+                    "lease": None,
+                    "lease_expires": 0,
+                    "failed_user_ids": []
+                }},
+                upsert = True
+            )
+            if (result.upserted_id is not None):
+                n_added += 1
+
+        return n_added
+
+    def claim(self, job, worker, lease_seconds = LEASE_SECONDS):
+        """ Lease a pending shard, or a shard whose lease has expired
+
+        Args:
+            job: The job to claim a shard from
+            worker: A name identifying the worker
+            lease_seconds: How long the lease lasts unless it is renewed
+
+        Returns:
+            The shard document, or None if no shards are available
+        """
+
+        now = time.time()
+        return self.collection.find_one_and_update(
+            {
+                "job": job,
+                "$or": [
+                    {"status": PENDING},
+                    {"status": LEASED, "lease_expires": {"$lt": now}}
+                ]
+            },
+            {"$set": {
+                "status": LEASED,
+                "worker": worker,
+                "lease": bson.ObjectId(),
+                "lease_expires": now + lease_seconds
+            }},
+            return_document = pymongo.ReturnDocument.AFTER
+        )
+
+    def renew(self, shard, lease_seconds = LEASE_SECONDS):
+        """ Extend the lease of a shard
+
+        Args:
+            shard: A shard document returned by claim
+            lease_seconds: How long the lease lasts from now
+
+        Returns:
+            True if the lease was renewed, False if it was lost to another
+            worker
+        """
+
+        result = self.collection.update_one(
+            {"_id": shard["_id"], "status": LEASED, "lease": shard["lease"]},
+            {"$set": {"lease_expires": time.time() + lease_seconds}}
+        )
+        return result.modified_count == 1
+
+    def holds(self, shard, margin = 0):
+        """ Check that a lease is still held, to fence off writes by a worker
+        that lost it
+
+        Args:
+            shard: A shard document returned by claim
+            margin: The number of seconds that the lease must still last
+
+        Returns:
+            True if the shard is still leased with the token of this claim
+        """
+
+        return self.collection.find_one({
+            "_id": shard["_id"],
+            "status": LEASED,
+            "lease": shard["lease"],
+            "lease_expires": {"$gt": time.time() + margin}
+        }, {"_id": 1}) is not None
+
+    def complete(self, shard, failed_user_ids):
+        """ Mark a shard as done
+
+        Args:
+            shard: A shard document returned by claim
+            failed_user_ids: The users whose features could not be extracted
+        """
+
+        self.collection.update_one(
+            {"_id": shard["_id"], "lease": shard["lease"]},
+            {"$set": {
+                "status": DONE,
+                "failed_user_ids": failed_user_ids
+            }}
+        )
+
+    def shards(self, job):
+        """ Return the shard documents of a job, without their user IDs """
+
+        return list(self.collection.find(
+            {"job": job}, {"user_ids": 0}
+        ).sort("shard", pymongo.ASCENDING))
+
+class LeaseLost(Exception):
+    """ Raised when a worker no longer holds the lease of its shard """
+
+def work(queue, job, classifier, worker = None, lease_seconds = LEASE_SECONDS):
+    """ Process shards from the queue until none are left
+
+    If the lease of a shard is lost, e.g. because the worker stalled for
+    longer than the lease, work on the shard stops before anything else is
+    written to it, and the worker moves on to the next shard.
+
+    Args:
+        queue: A WorkQueue object
+        job: The job to process shards from
+        classifier: A botdetector.Classifier object
+        worker: A name identifying this worker; defaults to hostname:pid
+        lease_seconds: The lease duration
+
+    Returns:
+        The number of shards processed
+    """
+
+    if (worker is None):
+        worker = "%s:%d" % (socket.gethostname(), os.getpid())
+
+    n_processed = 0
+
+    while True:
+        shard = queue.claim(job, worker, lease_seconds)
+        if (shard is None):
+            break
+
+        print("%s processing shard %d of job %s (%d users)" % (
+            worker, shard["shard"], job, len(shard["user_ids"])
+        ))
+
+        output_dir = os.path.dirname(shard["output"])
+        if (output_dir and (not os.path.isdir(output_dir))):
+            os.makedirs(output_dir, exist_ok = True)
+
+        # keep the lease alive while working
+        stop = threading.Event()
+        lost = threading.Event()
+        def heartbeat():
+            while (not stop.wait(lease_seconds / 3)):
+                if (not queue.renew(shard, lease_seconds)):
+                    lost.set()
+                    return
+        thread = threading.Thread(target = heartbeat, daemon = True)
+        thread.start()
+
+        def fence():
+            # leave a margin for the write that follows the check
+            if (lost.is_set()
+                    or (not queue.holds(shard, lease_seconds / 10))):
+                lost.set()
+                raise LeaseLost("%s lost the lease of shard %d" % (
+                    worker, shard["shard"]
+                ))
+
+        try:
+            classifier.connect(
+                shard["db"], shard["collection"], shard.get("address")
+            )
+            # resuming picks up where a previous, dead worker left off
+            failed = classifier.gen_feature_matrix(
+                shard["user_ids"], shard["output"], resume = True,
+                fence = fence
+            )
+        except LeaseLost as error:
+            print(error)
+            continue
+        finally:
+            stop.set()
+            thread.join()
+
+        queue.complete(shard, failed)
+        n_processed += 1
+
+    return n_processed
+
+def merge(csv_paths, output_path):
+    """ Merge feature matrices into one
+
+    Rows are deduplicated by user ID. The merged matrix is written to a
+    temporary file that replaces output_path once complete.
+
+    The feature sketches of the matrices are merged into a sketch of the
+    merged matrix. Shards never share users, so merging their sketches gives
+    the same distribution as sketching the merged rows; if a matrix has no
+    stored sketches, they are rebuilt from the merged rows instead.
+
+    Args:
+        csv_paths: A list of paths of feature matrices with identical columns
+        output_path: The path of the merged feature matrix
+
+    Returns:
+        The number of rows written
+    """
+
+    fieldnames = None
+    seen = set()
+    temp_path = "%s.tmp" % output_path
+
+    stored_sketches = all(
+        os.path.isfile(FeatureSketches.path_of(csv_path))
+        for csv_path in csv_paths
+    )
+    sketches = None
+
+    with open(temp_path, "w") as out:
+        writer = None
+        for csv_path in csv_paths:
+            with open(csv_path, "r") as f:
+                reader = csv.DictReader(f)
+                if (fieldnames is None):
+                    fieldnames = reader.fieldnames
+                    writer = csv.DictWriter(out, fieldnames = fieldnames)
+                    writer.writeheader()
+                    sketches = FeatureSketches([
+                        column for column in fieldnames
+                        if (column not in ID_COLUMNS)
+                    ])
+                elif (reader.fieldnames != fieldnames):
+                    raise Exception("%s has different columns than %s" % (
+                        csv_path, csv_paths[0]
+                    ))
+
+                if (stored_sketches):
+                    sketches.merge(FeatureSketches.load(
+                        FeatureSketches.path_of(csv_path)
+                    ))
+
+                for row in reader:
+                    if (row["user_id"] not in seen):
+                        seen.add(row["user_id"])
+                        writer.writerow(row)
+                        if (not stored_sketches):
+                            sketches.update(row)
+
+    os.replace(temp_path, output_path)
+    if (sketches is not None):
+        sketches.save(FeatureSketches.path_of(output_path))
+
+    return len(seen)
+
+if (__name__ == "__main__"):
+    import optparse
+    import sys
+
+    parser = optparse.OptionParser(
+        usage = "%prog enqueue|work|status|merge [options]"
+    )
+
+    parser.add_option("-a", "--address", dest = "address",
+                      default = "localhost:27017",
+                      help = "The host and port of the MongoDB holding the "
+                             "queue")
+    parser.add_option("-j", "--job", dest = "job",
+                      help = "The name of the job")
+    parser.add_option("-d", "--db", dest = "db",
+                      help = "enqueue: the database containing the tweets")
+    parser.add_option("-c", "--collection", dest = "collection",
+                      help = "enqueue: the collection containing the tweets")
+    parser.add_option("-t", "--tweets-address", dest = "tweets_address",
+                      help = "enqueue: the host and port of the MongoDB "
+                             "containing the tweets; defaults to --address")
+    parser.add_option("-i", "--ids", dest = "ids",
+                      help = "enqueue: a file of user IDs, one per line")
+    parser.add_option("-n", "--shards", dest = "n_shards", type = "int",
+                      default = 16, help = "enqueue: the number of shards")
+    parser.add_option("-o", "--output", dest = "output",
+                      help = "enqueue: the directory to write shards to; "
+                             "merge: the merged feature matrix")
+    parser.add_option("-l", "--lease", dest = "lease", type = "int",
+                      default = LEASE_SECONDS,
+                      help = "work: the lease duration in seconds")
+    (options, args) = parser.parse_args()
+
+    if ((len(args) != 1) or (not options.job)):
+        parser.print_help()
+        sys.exit(1)
+
+    queue = WorkQueue(options.address)
+    command = args[0]
+
+    if (command == "enqueue"):
+        with open(options.ids, "r") as f:
+            user_ids = [int(line) for line in f if line.strip()]
+        n_added = queue.enqueue(
+            options.job, options.db, options.collection, user_ids,
+            options.n_shards, options.output,
+            options.tweets_address or options.address
+        )
+        print("Added %d shards to job %s" % (n_added, options.job))
+
+    elif (command == "work"):
+        import botdetector
+        n_processed = work(
+            queue, options.job, botdetector.Classifier(),
+            lease_seconds = options.lease
+        )
+        print("Processed %d shards" % n_processed)
+
+    elif (command == "status"):
+        for shard in queue.shards(options.job):
+            print("%4d %-8s %-24s %d failed" % (
+                shard["shard"], shard["status"], shard["worker"] or "-",
+                len(shard["failed_user_ids"])
+            ))
+
+    elif (command == "merge"):
+        shards = queue.shards(options.job)
+        unfinished = [
+            shard["shard"] for shard in shards if (shard["status"] != DONE)
+        ]
+        if (unfinished):
+            print("Shards %s are not done yet" % unfinished)
+            sys.exit(1)
+        n_rows = merge([shard["output"] for shard in shards], options.output)
+        print("Merged %d shards (%d users) into %s" % (
+            len(shards), n_rows, options.output
+        ))
+
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -2,8 +2,10 @@
 # contains interactive procedure for downloading Twitter spam training data and
 # using it to train the crm114 classifier
 
+import concurrent.futures
 import configparser
 import crm114
+import hashlib
 import os
 import requests
 import shutil
@@ -11,10 +13,21 @@ import subprocess
 import sys
 import zipfile
 
-TEMP_DIR = "training/temp"
 OUT_DIR = "training/caverlee_2011"
 DL_PATH = "caverlee-2011.zip"
 
+# category -> tab-separated file of tweets in the caverlee-2011 archive
+TWEET_FILES = {
+    "ham": "legitimate_users_tweets.txt",
+    "spam": "content_polluters_tweets.txt"
+}
+USER_FILES = ["legitimate_users.txt", "content_polluters.txt"]
+
+# saved in the crm114 directory to skip retraining on an unchanged archive
+CHECKSUM_FILE = "archive.sha256"
+
+CHUNK_SIZE = 1024 * 1024
+
 def save_file(url, output_path):
     """ Save a URL to a file
 
@@ -57,54 +70,147 @@ def save_file(url, output_path):
         print("=> Download failed: %s" % url)
         return False
 
-def train_caverlee(crm114_dir, category, input_file):
+def sha256sum(path):
+    """ Compute the SHA-256 checksum of a file
+
+    Args:
+        path: The path of the file
+
+    Returns:
+        The hex digest of the file's checksum
+    """
+
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def find_member(archive, name):
+    """ Find a file in a zip archive by its base name """
+
+    for member in archive.namelist():
+        if (os.path.basename(member) == name):
+            return member
+    raise KeyError("%s not found in archive" % name)
+
+def third_column(line):
+    """ Return the third tab-separated column of a line, like cut -f 3 """
+
+    fields = line.rstrip(b"\n").split(b"\t")
+    if (len(fields) == 1):
+        return fields[0]
+    elif (len(fields) < 3):
+        return b""
+    return fields[2]
+
+def train_category_from_archive(crm114_dir, category, archive_path, member):
+    """ Train a CRM114 category by streaming the tweet text column of a file
+    in a zip archive into crm, without extracting the file to disk
+
+    Args:
+        crm114_dir: The directory containing the CRM114 .css files
+        category: The category to train
+        archive_path: The path of the zip archive
+        member: The name of the tab-separated tweets file in the archive
+    """
+
     print("Training category: \"%s\"" % category)
 
-    # This is much faster and memory efficient than doing it the Python way
-    subprocess.check_output(
-        "cut -f 3 %s | "
-        "crm '-{ learn <osb unique microgroom> (%s/%s.css) }'" % (
-            input_file, crm114_dir, category
-        ),
-        shell = True
+    proc = subprocess.Popen(
+        [
+            "crm",
+            "-{ learn <osb unique microgroom> (%s/%s.css) }" % (
+                crm114_dir, category
+            )
+        ],
+        stdin = subprocess.PIPE,
+        stdout = subprocess.DEVNULL
     )
 
+    try:
+        # every thread opens its own handle, because ZipFile objects can not
+        # be read from concurrently
+        with zipfile.ZipFile(archive_path, "r") as z:
+            with z.open(member, "r") as f:
+                for line in f:
+                    proc.stdin.write(third_column(line))
+                    proc.stdin.write(b"\n")
+    finally:
+        proc.stdin.close()
+
+    if (proc.wait() != 0):
+        raise subprocess.CalledProcessError(proc.returncode, "crm")
+
+def train_from_archive(crm114_dir, archive_path):
+    """ Train the CRM114 classifier from a local copy of the caverlee-2011
+    archive
+
+    Both categories are trained at the same time, reading straight from the
+    archive. The checksum of the archive is saved in crm114_dir, and training
+    is skipped if the archive has not changed since the last time.
+
+    Args:
+        crm114_dir: The directory containing the CRM114 .css files
+        archive_path: The path of the caverlee-2011 zip archive
+
+    Returns:
+        True if training succeeds or was already done
+    """
+
+    checksum = sha256sum(archive_path)
+    checksum_path = os.path.join(crm114_dir, CHECKSUM_FILE)
+
+    if (os.path.isfile(checksum_path)):
+        with open(checksum_path, "r") as f:
+            if (f.read().strip() == checksum):
+                print("CRM114 is already trained on %s" % archive_path)
+                return True
+
+    # Create clean crm114_dir
+    if (not os.path.isdir(crm114_dir)):
+        os.makedirs(crm114_dir)
+    else:
+        for file_ in os.listdir(crm114_dir):
+            os.remove("%s/%s" % (crm114_dir, file_))
+
+    with zipfile.ZipFile(archive_path, "r") as z:
+        members = {
+            category: find_member(z, name)
+            for (category, name) in TWEET_FILES.items()
+        }
+
+        # the user lists are small, and are needed by scrape_caverlee.py
+        if (not os.path.isdir(OUT_DIR)):
+            os.makedirs(OUT_DIR)
+        for name in USER_FILES:
+            with z.open(find_member(z, name), "r") as src:
+                with open(os.path.join(OUT_DIR, name), "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+
+    with concurrent.futures.ThreadPoolExecutor(len(members)) as executor:
+        futures = [
+            executor.submit(
+                train_category_from_archive,
+                crm114_dir, category, archive_path, member
+            )
+            for (category, member) in members.items()
+        ]
+        for future in futures:
+            future.result()
+
+    with open(checksum_path, "w") as f:
+        f.write(checksum)
+
+    return True
+
 def train(crm114_dir):
     config = configparser.ConfigParser()
     config.read("config.ini")
 
-    if (save_file(config["sources"]["caverlee_2011"], DL_PATH)):
-
-        # Create clean TEMP_DIR
-        if (not os.path.isdir(TEMP_DIR)):
-            os.makedirs(TEMP_DIR)
-        else:
-            for file_ in os.listdir(TEMP_DIR):
-                shutil.rmtree("%s/%s" % (TEMP_DIR, file_))
-
-        # Extract to TEMP_DIF
-        print("Unzipping file")
-        with zipfile.ZipFile(DL_PATH, "r") as z:
-            z.extractall(TEMP_DIR)
-        os.remove(DL_PATH)
-
-        # Move desired files out of TEMP_DIR and remove TEMP_DIR
-        if (os.path.isdir(OUT_DIR)):
-            shutil.rmtree(OUT_DIR)
-        os.rename("%s/social_honeypot_icwsm_2011" % TEMP_DIR, OUT_DIR)
-        shutil.rmtree(TEMP_DIR)
-
-        # Create clean crm114_dir
-        if (not os.path.isdir(crm114_dir)):
-            os.makedirs(crm114_dir)
-        else:
-            for file_ in os.listdir(crm114_dir):
-                os.remove("%s/%s" % (crm114_dir, file_))
-
-        # Train classifier
-        train_caverlee(crm114_dir, "ham",
-                       "%s/legitimate_users_tweets.txt" % OUT_DIR)
-        train_caverlee(crm114_dir, "spam",
-                       "%s/content_polluters_tweets.txt" % OUT_DIR)
-
-        return True
+    # reuse a local copy of the archive if there is one
+    if (os.path.isfile(DL_PATH)
+            or save_file(config["sources"]["caverlee_2011"], DL_PATH)):
+        return train_from_archive(crm114_dir, DL_PATH)
+
+    return False
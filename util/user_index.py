@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# maintain a per-collection index of distinct users and sample from it
+#
+# For a collection of tweets db.tweets, the index is stored in db.tweets_users
+# with one document per user:
+#     {"_id": user_id, "tweet_count": int,
+#      "first_timestamp_ms": long, "last_timestamp_ms": long}
+#
+# Updates only aggregate the tweets inserted since the last build or update,
+# which are found by an insertion marker: the MARKER_FIELD ObjectId that
+# util/load_tweets.py and util/scrape_caverlee.py give every tweet, or else an
+# ObjectId _id. Tweet ID _ids can not be used, since tweets are not inserted
+# in ID order. Collections without either marker are rebuilt instead.
+
+import bson
+import pymongo
+
+INDEX_SUFFIX = "_users"
+
+# collection that stores the last insertion marker included in each index, so
+# that later updates only have to aggregate newer tweets
+STATE_COLLECTION = "user_index_state"
+
+# field holding the ObjectId generated when a tweet was inserted; it is only
+# used as an insertion marker if the collection has an index on it
+MARKER_FIELD = "inserted_at"
+
+def index_of(collection):
+    """ Return the user index collection of a tweet collection
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+
+    Returns:
+        A pymongo.collection.Collection
+    """
+
+    return collection.database["%s%s" % (collection.name, INDEX_SUFFIX)]
+
+def exists(collection):
+    """ Check if a tweet collection has a user index """
+
+    index = index_of(collection)
+    return index.name in collection.database.list_collection_names()
+
+def _group_stages(match):
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$user.id",
+            "tweet_count": {"$sum": 1},
+            "first_timestamp_ms": {"$min": {"$toLong": "$timestamp_ms"}},
+            "last_timestamp_ms": {"$max": {"$toLong": "$timestamp_ms"}}
+        }}
+    ]
+
+def mark(docs):
+    """ Set the insertion marker of documents that are about to be inserted
+
+    Args:
+        docs: A list of documents
+
+    Returns:
+        The same list
+    """
+
+    for doc in docs:
+        doc[MARKER_FIELD] = bson.ObjectId()
+    return docs
+
+def create_marker_index(collection):
+    """ Index the insertion marker of a collection, so that user index
+    updates can find new tweets """
+
+    collection.create_index(MARKER_FIELD, sparse = True)
+
+def marker_field(collection):
+    """ Find the field that records the insertion order of a collection
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+
+    Returns:
+        MARKER_FIELD if it is indexed, "_id" if the _ids are ObjectIds, or
+        None if the insertion order is unknown
+    """
+
+    for index in collection.index_information().values():
+        if (any(key == MARKER_FIELD for (key, direction) in index["key"])):
+            return MARKER_FIELD
+
+    doc = collection.find_one({}, {"_id": 1})
+    if ((doc is not None) and isinstance(doc["_id"], bson.ObjectId)):
+        return "_id"
+    return None
+
+def _last_marker(collection, field):
+    doc = collection.find_one(
+        {field: {"$exists": True}}, {field: 1},
+        sort = [(field, pymongo.DESCENDING)]
+    )
+    return None if (doc is None) else doc[field]
+
+def build(collection):
+    """ Build the user index of a collection from scratch
+
+    This is a single aggregation over the whole collection whose output
+    replaces the index collection. Tweets without an insertion marker are
+    included too.
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+    """
+
+    index = index_of(collection)
+    field = marker_field(collection)
+    last = None if (field is None) else _last_marker(collection, field)
+
+    if (collection.find_one({}, {"_id": 1}) is None):
+        return
+
+    collection.aggregate(
+        _group_stages(
+            {} if (last is None) else {"$nor": [{field: {"$gt": last}}]}
+        ) + [
+            {"$out": index.name}
+        ],
+        allowDiskUse = True
+    )
+    index.create_index("tweet_count")
+
+    collection.database[STATE_COLLECTION].replace_one(
+        {"_id": collection.name},
+        {"_id": collection.name, "field": field, "last": last},
+        upsert = True
+    )
+
+def update(collection):
+    """ Add tweets inserted since the last build or update to the user index
+
+    The new tweets are found by their insertion marker (see marker_field);
+    if the collection has none, or it changed since the last build, the
+    index is rebuilt instead. Tweets that are inserted while an update runs
+    may be missed, so updates should not run concurrently with loads.
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+    """
+
+    state = collection.database[STATE_COLLECTION].find_one(
+        {"_id": collection.name}
+    )
+    field = marker_field(collection)
+    if ((state is None) or (field is None) or (state.get("field") != field)
+            or (state.get("last") is None)):
+        return build(collection)
+
+    last = _last_marker(collection, field)
+    if ((last is None) or (last == state["last"])):
+        return
+
+    collection.aggregate(
+        _group_stages({field: {"$gt": state["last"], "$lte": last}}) + [
+            {"$merge": {
+                "into": index_of(collection).name,
+                "whenMatched": [
+                    {"$set": {
+                        "tweet_count": {
+                            "$add": ["$tweet_count", "$$new.tweet_count"]
+                        },
+                        "first_timestamp_ms": {"$min": [
+                            "$first_timestamp_ms", "$$new.first_timestamp_ms"
+                        ]},
+                        "last_timestamp_ms": {"$max": [
+                            "$last_timestamp_ms", "$$new.last_timestamp_ms"
+                        ]}
+                    }}
+                ],
+                "whenNotMatched": "insert"
+            }}
+        ],
+        allowDiskUse = True
+    )
+
+    collection.database[STATE_COLLECTION].update_one(
+        {"_id": collection.name}, {"$set": {"last": last}}
+    )
+
+def sample(collection, n_users, min_tweets = 0, max_tweets = None):
+    """ Sample user IDs from the user index of a collection
+
+    Without a tweet count filter, $sample is the first stage of the pipeline
+    and is served by a random cursor on the index, so only the sampled
+    documents are read. With a filter, only the (indexed) matching users are
+    considered.
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+        n_users: The number of user IDs to sample
+        min_tweets: Users with fewer tweets than this are skipped
+        max_tweets: Users with this many tweets or more are skipped
+
+    Returns:
+        A list of Twitter user IDs
+    """
+
+    pipeline = []
+
+    tweet_count = {}
+    if (min_tweets > 0):
+        tweet_count["$gte"] = min_tweets
+    if (max_tweets is not None):
+        tweet_count["$lt"] = max_tweets
+    if (tweet_count):
+        pipeline.append({"$match": {"tweet_count": tweet_count}})
+
+    pipeline.append({"$sample": {"size": n_users}})
+    pipeline.append({"$project": {"_id": 1}})
+
+    return [doc["_id"] for doc in index_of(collection).aggregate(pipeline)]
+
+def sample_stratified(collection, n_per_bucket, boundaries):
+    """ Sample the same number of users from each tweet count bucket
+
+    Args:
+        collection: A pymongo.collection.Collection of tweets
+        n_per_bucket: The number of user IDs to sample from each bucket
+        boundaries: A sorted list of tweet counts separating the buckets, e.g.
+            [1, 10, 100] for the buckets [1, 10), [10, 100), and [100, inf)
+
+    Returns:
+        A dictionary where the keys are (min_tweets, max_tweets) tuples and the
+        values are lists of user IDs
+    """
+
+    buckets = list(zip(boundaries, boundaries[1:] + [None]))
+
+    return {
+        (min_tweets, max_tweets): sample(
+            collection, n_per_bucket, min_tweets, max_tweets
+        )
+        for (min_tweets, max_tweets) in buckets
+    }
+
+if (__name__ == "__main__"):
+    import optparse
+
+    parser = optparse.OptionParser()
+
+    parser.add_option("-a", "--address", dest = "address",
+                      default = "localhost:27017",
+                      help = "The host and port where Mongo is located")
+    parser.add_option("-d", "--db", dest = "db",
+                      help = "The database where the tweets are stored")
+    parser.add_option("-c", "--collection", dest = "collection",
+                      help = "The collection where the tweets are stored")
+    parser.add_option("-u", "--update", dest = "update",
+                      action = "store_true", default = False,
+                      help = "Only add tweets inserted since the last run")
+    (options, args) = parser.parse_args()
+
+    if (not (options.db and options.collection)):
+        parser.print_help()
+    else:
+        collection = pymongo.MongoClient(options.address)[options.db][
+            options.collection
+        ]
+        if (options.update):
+            update(collection)
+        else:
+            build(collection)
+        print("Indexed %d users in %s" % (
+            index_of(collection).estimated_document_count(),
+            index_of(collection).full_name
+        ))